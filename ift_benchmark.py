@@ -0,0 +1,203 @@
+from __future__ import division, print_function
+import json
+import os
+import platform
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import numpy as np
+try:
+    import resource
+except ImportError: #Windows: no peak memory, see _peak_rss
+    resource = None
+
+
+'''
+Benchmarks of the simulations: how many motor-steps per second each engine runs (one motor moved through one time step is one motor-step)
+and how much memory a run needs at its peak, for workloads from small to large.
+
+The default suite covers the single-flagellum Cell (ift_diffusion_model_nlh.py) with every agent engine for N from 50 to 5000 (and 50000
+for the vector and lattice engines), a few time steps, ss=True runs, and the two-flagella Cell (ift_diffusion_model_two_flagella.py) with
+both engines, including cut(). Each case runs in a fresh process, one case at a time, so cases don't share memory or warm caches, and
+nothing else runs while a case is timed. Peak memory is the most the process grew above what it used after importing the models. It
+comes from the resource module, which Windows doesn't have, so there peak_bytes is None and memory isn't compared.
+
+Results are a JSON-ready dictionary. save() writes them, compare() checks them against a saved baseline and flags cases that got slower or
+bigger, and print_report() also shows which engine was fastest for each workload size.
+
+Example:
+    results = run_suite()
+    print_report(results, load('benchmark_baseline.json'))
+    save(results, 'benchmark_baseline.json')
+
+or from the command line: python ift_benchmark.py [save] [quick]
+'''
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+
+#The default benchmark cases. Each is a dictionary with name, model ('single' or 'two'), params for Cell, and optionally action: 'cut' times
+#cell.cut() on a cell that has already run params. quick=True makes every run 10 times shorter, for checking the suite itself, and leaves
+#out the cut cases, whose 20000 time steps can't be shortened.
+def default_cases(quick=False):
+    scale = .1 if quick else 1
+    cases = []
+    for engine in ('vector', 'event', 'object', 'lattice'):
+        for N in (50, 200, 1000, 5000):
+            cases.append(dict(name='single %s N=%d' % (engine, N), model='single', params=dict(t=300*scale, N=N, engine=engine, seed=0)))
+    for engine in ('vector', 'lattice'): #motor pools far beyond the object engine's reach
+        cases.append(dict(name='single %s N=50000' % engine, model='single', params=dict(t=300*scale, N=50000, engine=engine, seed=0)))
+    for t_step in (.025, .1, .4):
+        cases.append(dict(name='single vector t_step=%g' % t_step, model='single', params=dict(t=300*scale, t_step=t_step, seed=0)))
+    for engine in ('vector', 'object'):
+        cases.append(dict(name='single %s ss' % engine, model='single', params=dict(t=300*scale, ss=True, engine=engine, seed=0)))
+    for engine in ('vector', 'object'):
+        cases.append(dict(name='two %s' % engine, model='two', params=dict(t=int(2000*scale), engine=engine, seed=0)))
+        if not quick: #cut() always runs its 20000 time steps
+            cases.append(dict(name='two %s cut' % engine, model='two', params=dict(t=2000, engine=engine, seed=0), action='cut'))
+    return cases
+
+
+#Peak memory of this process so far (bytes), None without the resource module
+def _peak_rss():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak*1024 #bytes on macOS, kilobytes on Linux
+
+
+#Run one case and measure it. This is what the fresh process for each case runs.
+def run_case(case):
+    if case['model'] == 'single':
+        from ift_diffusion_model_nlh import Cell
+    else:
+        from ift_diffusion_model_two_flagella import Cell
+    start_rss = _peak_rss()
+
+    start = time.perf_counter()
+    cell = Cell(**case['params'])
+    if case.get('action') == 'cut':
+        start = time.perf_counter() #time only the cut
+        before = cell.current_time
+        cell.cut()
+        steps = cell.current_time - before
+    else:
+        steps = cell.current_time + 1
+    seconds = time.perf_counter() - start
+
+    motor_steps = int(cell.N*steps)
+    return dict(model=case['model'], params=case['params'], action=case.get('action'), seconds=seconds, steps=int(steps),
+                motor_steps=motor_steps, motor_steps_per_s=motor_steps/seconds, peak_bytes=None if start_rss is None else max(_peak_rss() - start_rss, 0))
+
+
+def run_suite(cases=None, quick=False, repeat=1, verbose=True):
+    '''
+    Run benchmark cases, each in a fresh process, one after another.
+
+    cases: list of cases, see default_cases(). Default is default_cases(quick)
+    quick: shorter runs, only used with the default cases
+    repeat: number of runs of each case. The fastest time and the largest peak memory are kept.
+    verbose: print each case as it finishes
+
+    Returns a dictionary with:
+        machine: python, numpy, platform and processor the suite ran on, and the date
+        results: one dictionary per case name with model, params, action, seconds, steps, motor_steps, motor_steps_per_s and peak_bytes
+    '''
+
+    if cases is None:
+        cases = default_cases(quick)
+    results = {}
+    context = multiprocessing.get_context('spawn') #a clean interpreter for every case, so peak memory is only that case's
+    for case in cases:
+        runs = []
+        for _ in range(repeat):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                runs.append(executor.submit(run_case, case).result())
+        result = min(runs, key=lambda r: r['seconds'])
+        peaks = [r['peak_bytes'] for r in runs]
+        result['peak_bytes'] = None if None in peaks else max(peaks)
+        results[case['name']] = result
+        if verbose:
+            print_result(case['name'], result)
+
+    machine = dict(python=platform.python_version(), numpy=np.__version__, platform=platform.platform(), processor=platform.processor(),
+                   date=time.strftime('%Y-%m-%d %H:%M:%S'))
+    return dict(machine=machine, results=results)
+
+
+def save(results, path=BASELINE):
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=1, sort_keys=True)
+
+
+#Saved results, or None if there are none at path
+def load(path=BASELINE):
+    if not os.path.exists(path):
+        return None
+    with open(path) as file:
+        return json.load(file)
+
+
+def compare(results, baseline, tolerance=.2):
+    '''
+    Compare results with a baseline, case by case.
+
+    tolerance: relative change allowed before a case is flagged. Timing noise on a busy machine is often 10%.
+
+    Returns one dictionary per case in both, with name, speed (motor_steps_per_s relative to the baseline, above 1 is faster), memory
+    (peak_bytes relative to the baseline, nan if either has none) and flags: a list with 'slower' and/or 'bigger' for regressions beyond tolerance.
+    Cases missing from either side are skipped.
+    '''
+
+    rows = []
+    for name, r in results['results'].items():
+        b = baseline['results'].get(name)
+        if b is None:
+            continue
+        speed = r['motor_steps_per_s']/b['motor_steps_per_s']
+        memory = r['peak_bytes']/b['peak_bytes'] if r['peak_bytes'] is not None and b['peak_bytes'] else np.nan
+        flags = []
+        if speed < 1 - tolerance:
+            flags.append('slower')
+        if memory > 1 + tolerance:
+            flags.append('bigger')
+        rows.append(dict(name=name, speed=speed, memory=memory, flags=flags))
+    return rows
+
+
+#Fastest single-flagellum engine for each N among the results, as {N: engine}
+def fastest_engines(results):
+    best = {}
+    for r in results['results'].values():
+        p = r['params']
+        if r['model'] != 'single' or 'engine' not in p or p.get('ss') or 't_step' in p:
+            continue
+        N = p.get('N', 200)
+        if N not in best or r['motor_steps_per_s'] > best[N][1]:
+            best[N] = (p['engine'], r['motor_steps_per_s'])
+    return {N: engine for N, (engine, _) in sorted(best.items())}
+
+
+#Print one case of run_suite
+def print_result(name, result):
+    memory = 'n/a' if result['peak_bytes'] is None else '%.1f' % (result['peak_bytes']/2**20)
+    print('%-28s %8.2f s %12.3g motor-steps/s %9s MB' % (name, result['seconds'], result['motor_steps_per_s'], memory))
+
+
+#Print every case, the fastest engine for each N, and the comparison with baseline if there is one
+def print_report(results, baseline=None, tolerance=.2):
+    for name, result in results['results'].items():
+        print_result(name, result)
+    for N, engine in fastest_engines(results).items():
+        print('fastest engine for N=%d: %s' % (N, engine))
+    if baseline is not None:
+        for row in compare(results, baseline, tolerance):
+            print('%-28s speed x%.2f, memory x%.2f %s' % (row['name'], row['speed'], row['memory'], ' '.join(row['flags'])))
+
+
+if __name__ == '__main__':
+    results = run_suite(quick='quick' in sys.argv[1:], verbose=False)
+    print_report(results, load())
+    if 'save' in sys.argv[1:]:
+        save(results)
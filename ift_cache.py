@@ -0,0 +1,141 @@
+from __future__ import division, print_function
+import hashlib
+import inspect
+import json
+import os
+import numpy as np
+
+from ift_diffusion_model_nlh import write_checkpoint, read_checkpoint, _to_json
+
+
+'''
+On-disk cache of simulation results, so the same Cell(...) is only ever simulated once, across notebooks, sessions and people sharing a folder.
+
+A result is looked up by a hash of the model, every constructor argument (defaults filled in, so Cell() and Cell(D=1.75) are the same),
+the seed, how the length trace is thinned (keep_every), and the source code of the simulation files, so results made by older code are never served.
+Each result is one small file in the cache folder (the checkpoint format of ift_diffusion_model_nlh.py). Files are written under a temporary
+name and renamed, so several processes can share one folder. When the folder grows past max_bytes, the least recently used results are deleted.
+
+Every cached run needs an int seed, so that serving a result again is the same as simulating it again. Give different seeds for
+distinct replicates.
+
+Example:
+    cache = ResultCache('~/ift_cache')
+    for D in [1, 1.75, 10]:
+        print(D, cache.run(D=D, seed=0)['L'])
+'''
+
+MODULES = dict(single='ift_diffusion_model_nlh', two='ift_diffusion_model_two_flagella')
+SOURCES = ('ift_diffusion_model_nlh.py', 'ift_diffusion_model_two_flagella.py') #simulation code a cached result depends on
+
+
+#Hash of the simulation source code. Changes whenever the code changes, which makes every older cached result unused.
+def code_version():
+    h = hashlib.sha256()
+    here = os.path.dirname(os.path.abspath(__file__))
+    for name in SOURCES:
+        with open(os.path.join(here, name), 'rb') as file:
+            h.update(file.read())
+    return h.hexdigest()
+
+
+class ResultCache:
+
+    def __init__(self, path, max_bytes=2**30):
+        '''
+        path: folder of the cache. Made if it doesn't exist. Any number of processes can use the same folder.
+        max_bytes: size the folder is kept under by deleting the least recently used results
+        '''
+        self.path = os.path.expanduser(path)
+        self.max_bytes = max_bytes
+        self.version = code_version()
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path, exist_ok=True)
+
+    #Cache key of a simulation: hash of the model, all constructor arguments with defaults filled in, keep_every and the code version.
+    #Raises ValueError for arguments that can't be cached: a seed that isn't an int, a hook, or anything else that can't be saved.
+    def key(self, model='single', keep_every=10, **params):
+        Cell = self._model(model)
+        bound = inspect.signature(Cell).bind(**params) #a TypeError here means a misspelled argument
+        bound.apply_defaults()
+        seed = bound.arguments['seed']
+        if not isinstance(seed, (int, np.integer)) or isinstance(seed, bool):
+            raise ValueError('seed must be an int to cache a run, so the cached result is the one the run would give, not %r' % (seed,))
+        if bound.arguments.get('hook') is not None:
+            raise ValueError('a run with a hook can not be cached, the hook would not run when the result is served from the cache')
+        description = dict(model=model, params=bound.arguments, keep_every=keep_every, version=self.version)
+        try:
+            description = json.dumps(description, sort_keys=True, default=_to_json)
+        except TypeError as error:
+            raise ValueError('can not cache a run with these arguments: %s' % error)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def run(self, model='single', keep_every=10, **params):
+        '''
+        Result of Cell(**params), from the cache if it's there, otherwise simulated and saved.
+
+        model: 'single' for the single-flagellum Cell, 'two' for the two-flagella Cell
+        keep_every: keep every keep_every-th point of the length trace. Cell's own trace_every can be among params.
+        params: arguments of Cell. seed must be an int, and there can't be a hook.
+
+        Returns a dictionary with:
+            params: the parameter set
+            L: final length (single) or list of final lengths, one per flagellum (two)
+            L_predict, time2ss: as in Cell. time2ss is None for a model that doesn't compute it
+            avaT: avalanche size at every time step (single only)
+            L_trace: every keep_every-th length, one column per flagellum for two
+            cached: True if the result came from the cache
+        '''
+
+        key = self.key(model, keep_every, **params)
+        path = os.path.join(self.path, key + '.npz')
+        try:
+            meta, arrays = read_checkpoint(path)
+            os.utime(path) #most recently used
+            return dict(meta, params=params, cached=True, **arrays)
+        except (IOError, OSError, ValueError): #not cached, or deleted or half-written by another process
+            pass
+
+        with self._model(model)(**params) as cell:
+            meta = dict(L=cell.L if model == 'single' else cell.L.tolist(), L_predict=cell.L_predict, time2ss=getattr(cell, 'time2ss', None))
+            arrays = dict(L_trace=np.array(cell.L_trace[::keep_every]))
+            if model == 'single':
+                arrays['avaT'] = np.array(cell.avaT, dtype=int)
+        write_checkpoint(path, meta, arrays)
+        self.evict()
+        return dict(meta, params=params, cached=False, **arrays)
+
+    #Delete the least recently used results until the folder is under max_bytes
+    def evict(self):
+        files = []
+        for name in os.listdir(self.path):
+            if name.endswith('.npz'):
+                try:
+                    stat = os.stat(os.path.join(self.path, name))
+                except OSError: #deleted by another process
+                    continue
+                files.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except OSError:
+                pass
+            total -= size
+
+    #Delete every cached result
+    def clear(self):
+        for name in os.listdir(self.path):
+            if name.endswith('.npz'):
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _model(model):
+        if model not in MODULES:
+            raise ValueError('model must be one of %s, not %r' % (tuple(MODULES), model))
+        return __import__(MODULES[model]).Cell
@@ -1,16 +1,547 @@
 from __future__ import division, print_function
+import heapq
+import inspect
+import json
+import math
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
 import numpy as np
 import matplotlib.pyplot as plt
 
 
+#Motor states. The Motor class stores them as strings, the vectorized engine stores them as these integer codes. STATES[code] gives the string.
+BASE, IFT, DIFFUSION = 0, 1, 2
+STATES = ('base', 'IFT', 'diffusion')
+ENGINES = ('vector', 'object', 'event', 'ode', 'lattice')
+NO_TRACKS = ('ode', 'lattice') #engines without motor positions to record: their tracks array has no columns
+DIFFUSION_MODES = ('walk', 'first_passage', 'gaussian')
+
+
+#Steady-state length predicted by the equation in Ma, Hendel et al 2020. Works on numbers or numpy arrays of parameters.
+def L_predict(D, v, N, thresh, build_size, decay_size):
+    return -1*D/v + np.sqrt(-4*D + (D/v)**2 + 2*D*(N-thresh)*build_size/decay_size)
+
+
+#Mean-field model of the same cell. Apart from the thresh motors waiting in the base, every motor goes around a cycle of IFT to the tip (L/v),
+#diffusion back to the base (L**2/(2D) on average) and 2 more seconds, the constant that makes the steady state of this model L_predict.
+#Each arrival at the tip builds build_size. Returns the growth rate dL/dt (um/s). Works on numbers or numpy arrays of parameters.
+def mean_field_rate(L, D, v, N, thresh, build_size, decay_size):
+    return build_size*(N-thresh)/cycle_time(L, D, v) - decay_size
+
+#Time (s) a motor takes to go around the mean-field cycle, see mean_field_rate
+def cycle_time(L, D, v):
+    return L/v + L**2/(2*D) + 2
+
+
+#Length over time of the mean-field model (see mean_field_rate), one step of t_step seconds at a time like Cell. Parameters are the same as
+#Cell's and can be numbers or arrays, so many parameter sets can be run at once: each row of the result is a time step, each column a set.
+def mean_field_trace(t=3000, L=0, N=200, v=2, thresh=30, build_size=.00125, decay_size=.01, D=1.75, t_step=.1):
+    L, N, v, thresh, build_size, decay_size, D = np.broadcast_arrays(*(np.asarray(p, dtype=float) for p in (L, N, v, thresh, build_size, decay_size, D)))
+    L = L.copy()
+    L_trace = np.zeros((int(t/t_step),) + L.shape)
+    for i in range(len(L_trace)):
+        L = np.maximum(L + t_step*mean_field_rate(L, D, v, N, thresh, build_size, decay_size), 0)
+        L_trace[i] = L
+    return L_trace
+
+
+#Time for a motor to diffuse from the tip back to the base, in units of L**2/D: first passage to 0 of a Brownian motion started at 1 on [0,1]
+#with a reflecting tip. Its distribution function is tabulated once, from the short-time (erfc) series below tau=.25 and the long-time
+#(eigenfunction) series above. Past the table it is a single exponential to double precision. The mean is 1/2, i.e. L**2/(2D).
+def _first_passage_cdf(tau):
+    if tau < .25:
+        return 2*sum((-1)**k*math.erfc((2*k+1)/(2*math.sqrt(tau))) for k in range(6))
+    return 1 - sum(4/math.pi*(-1)**k/(2*k+1)*math.exp(-((2*k+1)*math.pi)**2*tau/4) for k in range(6))
+
+_FP_TAU = np.concatenate(([0], np.geomspace(.01, 1.5, 2000)))
+_FP_CDF = np.array([0] + [_first_passage_cdf(tau) for tau in _FP_TAU[1:]])
+
+#Draw first-passage times (see above) with one uniform random number each from rand, e.g. a cell's random.rand. size=None gives a single number.
+def first_passage_time(size=None, rand=np.random.rand):
+    return first_passage_from_uniform(rand(size) if size is not None else rand())
+
+#The first-passage times (see above) that uniform random numbers u stand for. Works on numbers or arrays.
+def first_passage_from_uniform(u):
+    tail = -4/np.pi**2*np.log(np.pi/4*(1-np.asarray(u)))
+    return np.where(u < _FP_CDF[-1], np.interp(u, _FP_CDF, _FP_TAU), tail)[()]
+
+
+#Diffusion for a time tau of motors at x on a flagellum of length L, reflecting at the tip and absorbing at the base.
+#Each motor uses three uniform numbers, the last axis of u: two make a normal number (Box-Muller) for a Brownian step of rms sqrt(2*D*tau),
+#folded back once at the tip, and the third decides whether the path touched the base on the way even though it ended above it, which happens
+#with probability exp(-x*y/(D*tau)) for a path from x to y on a half-line. This is exact while sqrt(2*D*tau) is small next to L. Once it is
+#comparable to L it is an approximation: a step can cross the flagellum more than once, and a path can touch the base after bouncing off
+#the tip, neither of which one fold and the half-line test count. Works on numbers or arrays. Returns the new positions, 0 for absorbed motors.
+def gaussian_step(x, L, tau, D, u):
+    z = np.sqrt(-2*np.log1p(-u[...,0]))*np.cos(2*np.pi*u[...,1])
+    y = x + np.sqrt(2*D*tau)*z
+    y = np.where(y > L, 2*L - y, y)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        touched = u[...,2] < np.exp(-x*y/(D*tau))
+    return np.where((y <= 0) | touched, 0., y)
+
+
+class RandomStream:
+    '''
+    The random numbers of one cell. Uniform numbers are drawn from a numpy Generator in blocks and handed out from a cursor, so a draw
+    of one number or of a few costs an index into the block instead of a call into numpy. Every other distribution is made from the same
+    uniform numbers, so the numbers are used in the same order whichever engine runs the cell. The engines take the same count of them every
+    time step, see Cell._draw_step.
+
+    seed: anything np.random.default_rng takes, e.g. an int or a SeedSequence. The same seed gives the same run, number for number. None
+            picks a fresh random seed.
+    block: how many uniform numbers to draw at a time
+    '''
+
+    def __init__(self, seed=None, block=4096):
+        self.generator = np.random.default_rng(seed)
+        self.block = block
+        self._uniform = np.zeros(0) #the current block
+        self._cursor = 0 #next unused number in it
+
+    #Uniform numbers in [0,1): one number for size=None, otherwise an array of size numbers
+    def rand(self, size=None):
+        n = 1 if size is None else size
+        if self._cursor + n > len(self._uniform):
+            self._uniform = np.concatenate((self._uniform[self._cursor:], self.generator.random(max(self.block, n))))
+            self._cursor = 0
+        self._cursor += n
+        if size is None:
+            return self._uniform.item(self._cursor - 1)
+        return self._uniform[self._cursor - n:self._cursor]
+
+    #Weibull numbers with shape a, like np.random.weibull, from one uniform number each
+    def weibull(self, a, size=None):
+        if size is None:
+            return (-math.log1p(-self.rand()))**(1/a)
+        return (-np.log1p(-self.rand(size)))**(1/a)
+
+    #Binomial numbers, like np.random.binomial. These come straight from the Generator, not from the uniform numbers, because a count of
+    #thousands of motors would take as many uniform numbers. Only the lattice engine uses them.
+    def binomial(self, n, p):
+        return self.generator.binomial(n, p)
+
+    #A seed for a new, independent stream, e.g. for a forked cell. Streams spawned from the same seed are the same.
+    def spawn(self):
+        return self.generator.bit_generator.seed_seq.spawn(1)[0]
+
+    #Everything needed to carry on with the same numbers: the Generator's state (a dictionary) and the unused part of the block
+    @property
+    def state(self):
+        return self.generator.bit_generator.state, self._uniform[self._cursor:].copy()
+
+    @state.setter
+    def state(self, value):
+        self.generator.bit_generator.state, self._uniform = value
+        self._cursor = 0
+
+
+#Checkpoint files. A checkpoint is a compressed .npz file: the arrays under their own names, and everything else (numbers, strings, lists,
+#dictionaries) as JSON text under 'meta'. It is written to a temporary file first and then renamed, so a run killed while saving leaves
+#the previous checkpoint intact, and processes writing the same path at once never mix their files.
+def write_checkpoint(path, meta, arrays):
+    fd, temp = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(os.path.abspath(path)))
+    try:
+        with os.fdopen(fd, 'wb') as file:
+            np.savez_compressed(file, meta=np.array(json.dumps(meta, default=_to_json)), **arrays)
+        os.replace(temp, path)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+#Read a checkpoint written by write_checkpoint. Returns meta and a dictionary of the arrays.
+def read_checkpoint(path):
+    with np.load(path) as file:
+        arrays = {name: file[name] for name in file.files}
+    return json.loads(str(arrays.pop('meta'))), arrays
+
+def _to_json(x):
+    if isinstance(x, (np.generic, np.ndarray)):
+        return x.tolist()
+    if isinstance(x, np.dtype):
+        return x.str
+    raise TypeError('can not save %r in a checkpoint' % (x,))
+
+
+class GrowableTrace:
+    '''
+    History array that extend() can make longer without copying it every time. The rows live in a bigger buffer and the trace is a view of the
+    rows used so far. When the buffer is full it is replaced with one twice as big, so a run extended over and over copies each row only a few
+    times in total instead of once per extension.
+
+    array: the starting history, a numpy array or a np.memmap. A memory-mapped buffer grows its file instead of being copied.
+    '''
+
+    def __init__(self, array):
+        self.buffer = array
+        self.rows = len(array)
+
+    #The rows used so far, a view of the buffer
+    @property
+    def view(self):
+        return self.buffer[:self.rows]
+
+    #Add rows rows of zeros at the end and return the new view
+    def grow(self, rows):
+        if self.rows + rows > len(self.buffer):
+            shape = (max(self.rows + rows, 2*len(self.buffer)),) + self.buffer.shape[1:]
+            if isinstance(self.buffer, np.memmap):
+                self.buffer.flush()
+                with open(self.buffer.filename, 'r+b') as file:
+                    file.truncate(int(np.prod(shape))*self.buffer.dtype.itemsize) #the new part of the file reads as zeros
+                self.buffer = np.memmap(self.buffer.filename, dtype=self.buffer.dtype, mode='r+', shape=shape)
+            else:
+                buffer = np.zeros(shape, dtype=self.buffer.dtype)
+                buffer[:self.rows] = self.buffer[:self.rows]
+                self.buffer = buffer
+        self.rows += rows
+        return self.view
+
+    #Keep only the first rows rows and return the new view. The buffer keeps its size, so growing again is cheap.
+    def truncate(self, rows):
+        self.buffer[rows:self.rows] = 0
+        self.rows = rows
+        return self.view
+
+    def flush(self):
+        if isinstance(self.buffer, np.memmap):
+            self.buffer.flush()
+
+    #Write a memory-mapped buffer out and let go of it. numpy closes the file once nothing else refers to it, so views of the trace that
+    #are still around keep it open until they are gone.
+    def close(self):
+        self.flush()
+        self.buffer = np.zeros((0,) + self.buffer.shape[1:], dtype=self.buffer.dtype)
+        self.rows = 0
+
+
+class SteadyState:
+    '''
+    Steady-state test that runs alongside the simulation. It is the same test as Cell.is_steadystate, a straight-line fit to the last window
+    lengths with a slope below eps, but the sums for the fit are updated with each new length instead of refitting the whole window, so it
+    can be checked every time step.
+
+    window: number of time steps in the fit
+    eps: largest slope (length per time step) that counts as steady
+    '''
+
+    def __init__(self, window, eps=5e-6):
+        self.window = window
+        self.eps = eps
+        self.lengths = np.zeros(window) #the last window lengths, oldest at position count % window
+        self.count = 0 #number of lengths seen
+        self.sum_y = 0. #sum of the lengths in the window
+        self.sum_xy = 0. #sum of x*length with x = 0 for the oldest length in the window
+        self.steady = False #result of the last update
+
+    #Fitted slope of the lengths in the window
+    @property
+    def slope(self):
+        n = min(self.count, self.window)
+        if n < 2:
+            return np.nan
+        sum_x, sum_xx = n*(n-1)/2, (n-1)*n*(2*n-1)/6
+        return (n*self.sum_xy - sum_x*self.sum_y)/(n*sum_xx - sum_x**2)
+
+    #The test's sums and lengths, to save in a checkpoint, and to put them back
+    @property
+    def state(self):
+        return dict(count=self.count, sum_y=self.sum_y, sum_xy=self.sum_xy, steady=self.steady), self.lengths.copy()
+
+    @state.setter
+    def state(self, value):
+        sums, self.lengths = value
+        self.count, self.sum_y, self.sum_xy, self.steady = sums['count'], sums['sum_y'], sums['sum_xy'], sums['steady']
+
+    #Add the next length. Returns True if the window is full and its slope is below eps.
+    def update(self, L):
+        n, k = self.window, self.count % self.window
+        if self.count < n:
+            self.sum_xy += self.count*L
+            self.sum_y += L
+        else: #L replaces the oldest length and everything else moves down one x
+            oldest = self.lengths[k]
+            self.sum_xy += (n-1)*L - (self.sum_y - oldest)
+            self.sum_y += L - oldest
+        self.lengths[k] = L
+        self.count += 1
+        if k == n-1: #the window is in order, so recompute the sums exactly to keep rounding errors from piling up
+            self.sum_y = self.lengths.sum()
+            self.sum_xy = self.lengths.dot(np.arange(n))
+        self.steady = self.count >= n and abs(self.slope) < self.eps
+        return self.steady
+
+
+class SimStats:
+    '''
+    Where the time of Cell.sim goes, kept when a cell is made with stats=True (cell.stats). Each time step of the agent engines is split into
+    phases, and each phase adds up its time and how often it ran:
+        avalanche: avalanche()
+        decay: length decay and the steady-state test
+        motors: IFT and diffusion of every motor
+        record: writing flux and base for the recorded time steps (see trace_every)
+    It also counts the time steps, the seconds spent in sim altogether (wall, which includes what isn't in any phase, like stats itself and
+    the hook), and motor-steps in each state, so mean_motors is the average number of motors in each state.
+    The 'ode' engine has no motors and is not counted, and neither is the mean-field start of hybrid runs, which takes no time steps.
+    '''
+
+    PHASES = ('avalanche', 'decay', 'motors', 'record')
+
+    def __init__(self):
+        self.seconds = dict.fromkeys(self.PHASES, 0.)
+        self.calls = dict.fromkeys(self.PHASES, 0)
+        self.steps = 0
+        self.wall = 0.
+        self.motor_steps = np.zeros(len(STATES), dtype=np.int64) #motor_steps[s] is the sum over time steps of the number of motors in state s
+        self._last = 0. #when the last phase ended
+
+    #The counts and times so far, to save in a checkpoint, and to put them back
+    @property
+    def state(self):
+        return dict(seconds=self.seconds, calls=self.calls, steps=self.steps, wall=self.wall), self.motor_steps.copy()
+
+    @state.setter
+    def state(self, value):
+        sums, self.motor_steps = value
+        self.seconds, self.calls, self.steps, self.wall = dict(sums['seconds']), dict(sums['calls']), sums['steps'], sums['wall']
+
+    #Start a time step
+    def start(self):
+        self._last = time.perf_counter()
+
+    #End a phase: add the time since the last one ended to it
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.seconds[phase] += now - self._last
+        self.calls[phase] += 1
+        self._last = now
+
+    #End a time step with counts[s] motors in state s
+    def end_step(self, counts):
+        self.steps += 1
+        self.motor_steps += counts
+
+    @property
+    def steps_per_s(self):
+        return self.steps/self.wall if self.wall else np.nan
+
+    #Average number of motors in each state, by state name
+    @property
+    def mean_motors(self):
+        return dict(zip(STATES, (self.motor_steps/max(self.steps, 1)).tolist()))
+
+    def __repr__(self):
+        lines = ['%d time steps in %.3f s, %.1f steps/s' % (self.steps, self.wall, self.steps_per_s)]
+        for phase in self.PHASES:
+            lines.append('%-10s %9.3f s %5.1f%% %9d calls' % (phase, self.seconds[phase], 100*self.seconds[phase]/self.wall if self.wall else 0,
+                                                               self.calls[phase]))
+        lines.append('mean motors: ' + ', '.join('%s %.1f' % item for item in self.mean_motors.items()))
+        return '\n'.join(lines)
+
+
+class Histograms:
+    '''
+    Binned statistics collected while a cell runs (Cell(histograms=True), cell.histograms), so avalanche sizes, where the diffusing motors
+    are and how many motors are in each state can be studied without keeping motor histories or running a KDE over them. Each time step adds:
+        avalanche: avalanche[k] is the number of time steps with an avalanche of k motors (k = 0: none)
+        density: diffusing motors by position relative to the length, x/L, in bins equal bins over [0, 1] (edges in bin_edges).
+                density/steps is the mean number of diffusing motors in each bin.
+        occupancy: occupancy[s, n] is the number of time steps with n motors in state s (s indexes STATES)
+    N is the number of motors. With groups (one per flagellum in the two-flagella Cell), every array has one more axis in front, one per group.
+    positions: False if the motors' positions aren't simulated (diffusion='first_passage'). density then stays zero.
+    The 'ode' engine has no motors and adds nothing.
+    '''
+
+    def __init__(self, N, bins=50, groups=None, positions=True):
+        n = 1 if groups is None else groups
+        self.bins = bins
+        self.positions = positions
+        self.bin_edges = np.linspace(0, 1, bins+1)
+        self.steps = 0
+        self._avalanche = np.zeros((n, N+1), dtype=np.int64)
+        self._density = np.zeros((n, bins), dtype=np.int64)
+        self._occupancy = np.zeros((n, len(STATES), N+1), dtype=np.int64)
+        if groups is None: #views without the group axis
+            self.avalanche, self.density, self.occupancy = self._avalanche[0], self._density[0], self._occupancy[0]
+        else:
+            self.avalanche, self.density, self.occupancy = self._avalanche, self._density, self._occupancy
+
+    #The number of time steps and the counts so far, to save in a checkpoint, and to put them back
+    @property
+    def state(self):
+        return self.steps, dict(avalanche=self._avalanche.copy(), density=self._density.copy(), occupancy=self._occupancy.copy())
+
+    @state.setter
+    def state(self, value):
+        self.steps, counts = value
+        self._avalanche[:], self._density[:], self._occupancy[:] = counts['avalanche'], counts['density'], counts['occupancy']
+
+    #Add one time step. released: avalanche size, counts: motors in each state, x: positions of the diffusing motors, L: length.
+    #With groups, released and L have one value per group, counts one row per group, and group gives the group of each motor in x.
+    #weights, if given, is the number of motors at each x.
+    def update(self, released, counts, x, L, group=None, weights=None):
+        n = len(self._avalanche)
+        self.steps += 1
+        self._avalanche[np.arange(n), released] += 1
+        self._occupancy[np.arange(n)[:,None], np.arange(len(STATES)), np.reshape(counts, (n, -1))] += 1
+        if not self.positions:
+            return
+        x, L = np.asarray(x, dtype=float), np.broadcast_to(L, n)
+        group = np.zeros(len(x), dtype=int) if group is None else group
+        with np.errstate(divide='ignore', invalid='ignore'):
+            where = x/L[group] #nan while the flagellum has no length
+        kept = np.isfinite(where)
+        b = np.minimum((np.maximum(where[kept], 0)*self.bins).astype(int), self.bins-1)
+        weights = None if weights is None else np.asarray(weights)[kept]
+        self._density += np.bincount(group[kept]*self.bins + b, weights, minlength=n*self.bins).reshape(n, self.bins).astype(np.int64)
+
+    #Fraction of time steps with each avalanche size
+    def avalanche_distribution(self):
+        return self.avalanche/max(self.steps, 1)
+
+    #Mean number of diffusing motors per unit of relative position x/L, at the bin centers. Multiply by 1/L for motors per micron.
+    def profile(self):
+        return (self.bin_edges[:-1] + self.bin_edges[1:])/2, self.density*self.bins/max(self.steps, 1)
+
+    #Fraction of time steps with each number of motors in each state
+    def occupancy_distribution(self):
+        return self.occupancy/max(self.steps, 1)
+
+
+class SimFuture:
+    '''
+    A cell being made in the background, returned by Cell.start and Cell.submit (of either model), so a long run doesn't block a notebook.
+    The cell runs in a thread and is made exactly as Cell(**params) would make it, with the same results for the same seed.
+
+    While it runs, step, L, progress and eta tell how far it has got. cancel() asks it to stop after the time step it is in: the engine
+    then finishes the step and writes its state back as at the end of any run, and the traces are cut to the steps that were run. The
+    partial cell is the result, as usable as a finished one, e.g. cell.extend() goes on from where it stopped.
+    result(), done(), exception() and add_done_callback() work like those of concurrent.futures.Future, and the handle can be awaited in
+    asyncio: cell = await Cell.start(t=5000).
+
+    cell: the cell being made. Its attributes appear as its constructor gets to them, so read them through the handle until it is done.
+    steps: time steps the run is due to take (more with ss=True)
+    '''
+
+    def __init__(self, cls, params, steps, executor=None):
+        self.cell = cls.__new__(cls)
+        self.steps = steps
+        self._params = params
+        self._began = None #perf_counter when the run started
+        self._cancel = False
+        self._finished = False #the constructor has returned (or raised). Set together with clearing the stop request, under _lock
+        self._lock = threading.Lock()
+        if executor is None:
+            self._future = Future()
+            threading.Thread(target=self._run_into, daemon=True).start()
+        else:
+            self._future = executor.submit(self._run)
+
+    #What the thread runs: make the cell, then clear the stop request so the cell can be extended later. cancel() takes the same lock, so
+    #a request that comes too late is never left behind on the finished cell.
+    def _run(self):
+        self._began = time.perf_counter()
+        try:
+            self.cell.__init__(**self._params)
+        finally:
+            with self._lock:
+                self._finished = True
+                self.cell.__dict__.pop('_stop', None)
+        return self.cell
+
+    def _run_into(self):
+        if not self._future.set_running_or_notify_cancel():
+            return
+        try:
+            self._future.set_result(self._run())
+        except BaseException as error:
+            self._future.set_exception(error)
+
+    #Last time step run so far
+    @property
+    def step(self):
+        return getattr(self.cell, 'current_time', 0)
+
+    #Length (or lengths, one per flagellum) after it
+    @property
+    def L(self):
+        return np.copy(getattr(self.cell, 'L', np.nan))
+
+    #Fraction of steps run so far, 1 once done
+    @property
+    def progress(self):
+        return 1. if self.done() else min(self.step/self.steps, 1.) if self.steps else 0.
+
+    #Seconds left at the speed so far, None before the first time step and once it is past steps (ss=True)
+    @property
+    def eta(self):
+        if self.done():
+            return 0.
+        if self._began is None or not self.step or self.step >= self.steps:
+            return None
+        return (time.perf_counter() - self._began)*(self.steps - self.step)/self.step
+
+    #Ask the run to stop after the current time step. Returns False if it is already done. The partial cell is then the result.
+    def cancel(self):
+        with self._lock:
+            if self._finished or self.done():
+                return False
+            self._cancel = True
+            self.cell._stop = True
+        self._future.cancel() #only works if it hasn't started (in an executor), and then it never will and result() raises CancelledError
+        return True
+
+    #True if cancel() stopped the run before it was done
+    def cancelled(self):
+        return self._cancel
+
+    def running(self):
+        return self._future.running()
+
+    def done(self):
+        return self._future.done()
+
+    #The cell, once done. Waits up to timeout seconds (None: as long as it takes).
+    def result(self, timeout=None):
+        return self._future.result(timeout)
+
+    def exception(self, timeout=None):
+        return self._future.exception(timeout)
+
+    #Call fn(handle) once done
+    def add_done_callback(self, fn):
+        self._future.add_done_callback(lambda _: fn(self))
+
+    def __await__(self):
+        import asyncio
+        return asyncio.wrap_future(self._future).__await__()
+
+    def __repr__(self):
+        if self._future.cancelled(): #cancelled in an executor before it started: there is no cell and no exception to show
+            return '<SimFuture cancelled before it started>'
+        if self.done():
+            return '<SimFuture %s: %r>' % ('cancelled' if self._cancel else 'done', self._future.result() if self._future.exception() is None
+                                           else self._future.exception())
+        eta = self.eta
+        return '<SimFuture running: step %d of %d, L %s, %s>' % (self.step, self.steps, self.L, 'eta unknown' if eta is None else 'eta %.0f s' % eta)
+
+
 class Cell:
-    cells = []
+    cells = None #set to a weakref.WeakSet() to keep track of every cell made. Off by default so a process that makes many cells doesn't hold on to them
+    _stop = False #set on a cell to make sim stop after the time step it is in, see SimFuture.cancel
 
 
     def __init__(self, t=3000, L=0, N=200, v=2, k_on=0, k_off=0,
              avalanche_on=True, thresh=30,
              build_size=.00125, decay_size=.01, D=1.75, ava_power=2.85, retro=False,
-             L_hog=0,ss=False, t_step=.1, give_flagella_authentic_feelings = False):  
+             L_hog=0,ss=False, t_step=.1, give_flagella_authentic_feelings = False, engine='vector', diffusion='walk',
+             trace_dir=None, trace_dtype='float64', trace_every=1, ss_window=1000, ss_eps=5e-6, seed=None, hybrid=False, hybrid_tol=.001,
+             stats=False, hook=None, histograms=False):  
 
         '''
         t: simulation time (seconds)
@@ -25,21 +556,86 @@ class Cell:
         D: diffusion coefficient of motors. um^2/s. Default value comes from Alex Chien and Ahmet Yildiz 2017. "Ciliary dynamics at the tip..."
         ava_power: avalanching parameter for weibull distrubtion
         L_hog: Hand Of God: manually change length. Only used in one figure panel, mostly set to False.
-        ss: if True, keep simulation until steady state is reached
+        ss: if True, keep simulation until steady state is reached. After the first t seconds, the simulation goes on until the time step
+                where a straight-line fit to the last ss_window seconds of length has a slope below ss_eps microns per time step (see SteadyState).
+        ss_window, ss_eps: the steady-state test used with ss=True
+        seed: seed of the cell's random numbers (cell.random, see RandomStream). The same seed gives the same run with any engine.
+        hybrid: if True, the run starts where the mean-field model (as engine='ode') gets close to steady state: the model is solved from L
+                until its growth rate is within hybrid_tol*decay_size of zero, without using up any of the run's t seconds, and the motors are
+                spread out as it has them there (see _jump). The engine then runs all of t from there, so the growth phase is skipped. Only a new
+                cell's first run starts this way, forks never do.
         t_step: Units of seconds. Conversion between number of time steps and duration. 
         give_flagella_authentic_feelings: If TRUE, simulation is unethical to turn off. Be VERY CAREFUL
+        engine: 'vector' (default) keeps motor positions and states in numpy arrays and updates them all at once each time step.
+                'object' is the original loop over every Motor object, much slower but with the same results as 'vector' for the same seed.
+                'event' only touches the IFT motors that reach the tip and fills in motor tracks when they are read (see _sim_event).
+                'ode' follows the mean-field model (see mean_field_rate) without simulating motors, so there are no tracks.
+                'lattice' keeps the diffusing motors as counts on the walk's lattice, for very large N, with diffusion='walk' only (see _sim_lattice).
+        diffusion: 'walk' (default) moves every diffusing motor one rms_disp step left or right each time step.
+                'first_passage' draws a motor's time back to the base when it reaches the tip instead of walking it (see _first_passage_rate).
+                Diffusing motors then have no positions: their tracks are nan until they are back at the base.
+                'gaussian' moves diffusing motors by Brownian steps (see gaussian_step), which keeps the diffusion right for large t_step.
+                Every engine but 'lattice' takes every mode. ift_validation.py compares the modes and measures how far they are off.
+        trace_dir: if given, L_trace, flux, base and the motor tracks are memory-mapped files in a new folder inside trace_dir (its path is
+                cell.trace_path) instead of arrays in memory, so a long run doesn't need its whole history in RAM. They are indexed like the
+                arrays (cell.L_trace[i], cell.motors[j].track). release() (or the end of a with block) closes them and deletes the folder,
+                otherwise the files are left on disk after the cell is gone.
+        trace_dtype: data type of those traces, e.g. 'float32' for half the size
+        trace_every: only record every trace_every-th time step. Row r of the traces is time step r*trace_every, and cell.time is thinned the same way.
+        stats: if True, time the phases of every time step and count motors in each state, in cell.stats (see SimStats). Off by default
+                because the timing itself costs a few microseconds per step.
+        histograms: if True, collect the avalanche-size distribution, the density of diffusing motors along the flagellum and the number of
+                motors in each state as the cell runs, in cell.histograms (see Histograms). A number instead of True sets the density bins (default 50).
+        hook: function called as hook(cell, i) at the end of every time step i, e.g. to print cell.stats or cell.L as a long run goes.
+                The array engines only copy motor positions back into cell.motors at the end of sim, so read the motors from cell.stats or
+                cell.tracks rather than cell.motors inside the hook. With engine='event' cell.tracks is incomplete there too: a motor's track
+                since its last change of state is only written when sim ends. cell.hook can also be set or changed later, before extend().
+
+        A run can be saved with save_checkpoint and picked up again, possibly in another process, with Cell.load_checkpoint. The loaded cell goes
+        on exactly as the saved one would have, e.g. with extend(). fork() starts new runs from the state a cell has reached.
+        Cell.start(...) makes the cell in the background instead, with progress and cancellation, see SimFuture.
         '''
 
+        self.params = {k: v for k, v in locals().items() if k != 'self'} #the arguments the cell was made with, for save_checkpoint
+
+        if engine not in ENGINES:
+            raise ValueError('engine must be one of %s, not %r' % (ENGINES, engine))
+        if diffusion not in DIFFUSION_MODES:
+            raise ValueError('diffusion must be one of %s, not %r' % (DIFFUSION_MODES, diffusion))
+        if engine == 'lattice' and diffusion != 'walk':
+            raise ValueError("engine='lattice' only works with diffusion='walk', not %r" % diffusion)
+        self.engine = engine
+        self.diffusion = diffusion
+        self.random = RandomStream(seed)
+        self.hybrid = hybrid
+        self.hybrid_tol = hybrid_tol
+        self._hybrid_pending = hybrid and engine != 'ode' #the mean-field jump of a hybrid run is still to come, see sim
+        self.stats = SimStats() if stats else None
+        self.hook = hook
+        self.histograms = Histograms(N, 50 if histograms is True else histograms, positions=diffusion != 'first_passage') if histograms else None
+
         # Initiate parameters
         self.t_step = t_step #seconds
         self.t = t #seconds
         self.num_of_timesteps = int(self.t/self.t_step)
-        self.time = np.linspace(0,self.t, self.num_of_timesteps)
+        self.trace_every = trace_every
+        self.trace_dtype = np.dtype(trace_dtype)
+        self.trace_path = tempfile.mkdtemp(prefix='cell_', dir=trace_dir) if trace_dir is not None else None
+        self.time = np.linspace(0,self.t, self.num_of_timesteps)[::trace_every]
         self.L = L
         self.k_on = k_on
         self.k_off = k_off
         self.N = N
-        self.motors = [Motor(self) for i in range(N)] #initiate N motors using the Motor() class designed below
+        self._trace_buffers = {} #the buffers behind L_trace, flux, base and tracks, see _new_trace
+        self._released = False #set by release()
+        self._tracks = self._new_trace('tracks', (0 if engine in NO_TRACKS else N,)) #position history of every motor, see the tracks property. Column j is motors[j].track
+        self._segments = [] #parts of motor tracks the event engine hasn't written yet, see _fill_tracks
+        self._step0 = 0 #time step recorded in row 0 of the traces. Only run_iter changes it, for its short buffers
+        self.motors = [Motor(self, j) for j in range(N)] #initiate N motors using the Motor() class designed below
+        if Cell.cells is not None:
+            Cell.cells.add(self)
+        self.fp_left = np.zeros(N) #diffusion='first_passage' only: how much of each diffusing motor's trip to the base is left, in units of L**2/D
+        self._step_random = None #each motor's uniform numbers for the time step being run, see _draw_step
         self.v = v #actually a distance
  
         self.D = D
@@ -62,14 +658,15 @@ class Cell:
 
         self.L_hog = L_hog #hand of god -- change length manually. 
 
-        self.L_trace = np.zeros(self.num_of_timesteps) #Length of flagellum over time
-        self.flux = np.zeros(self.num_of_timesteps) #number of motors beginning their active transport (IFT)
-        self.base = np.zeros(self.num_of_timesteps) #number of motors in the base at each time step
+        self.L_trace = self._new_trace('L_trace') #Length of flagellum over time
+        self.flux = self._new_trace('flux') #number of motors beginning their active transport (IFT)
+        self.base = self._new_trace('base') #number of motors in the base at each time step
         # self.track_active = np.zeros(t)
 
         self.retro=retro
         self.current_time=0
         self.ss=ss
+        self.steady = SteadyState(int(ss_window/t_step), ss_eps) if ss else None #checked every time step, see SteadyState
         
         #self.give_flagella_authentic_feelings = give_flagella_authentic_feelings
         
@@ -78,42 +675,137 @@ class Cell:
         
    
         
-        self.L_predict = -1*self.D/self.v + np.sqrt(-4*self.D + (self.D/self.v)**2 + 2*self.D*(self.N-self.thresh)*self.build_size/decay_size)
+        self.L_predict = L_predict(self.D, self.v, self.N, self.thresh, self.build_size, decay_size)
 
         if t: #if you'd like to run a simulation
             self.sim(self.num_of_timesteps) #simulation function that will go through each motor and each time step and simulate
+            if self._stop: #stopped early (SimFuture.cancel): keep only the steps that were run
+                self._trim_traces()
+                self.time = self.time[:len(self.L_trace)]
 
             if self.ss: #if you'd like to ensure that the flagellum reaches steady state, keep simulating until its length doesn't change much each time step
-                while not self.is_steadystate(): #if it's not in steady state...
+                while not self.steady.steady and not self._stop: #if it's not in steady state...
                     # print('not ss')
-                    self.extend(int(self.t/self.t_step))# keep simulating
+                    self.extend(int(self.t/self.t_step), until_steady=True)# keep simulating, but stop at the first steady time step
             # self.time2ss = np.argmax(self.L_trace>(self.L-.1))
             #self.L=np.mean(self.L_trace[-3000:])  #make final length the average over some points in steady state instead of the end result
-            self.time2ss = np.argmax(self.L_trace>self.L)*self.t_step #when was the first time that the length was greater than the steady state length? Implies flagellum has reached steady state
+            self.time2ss = np.argmax(self.L_trace>self.L)*self.t_step*self.trace_every #when was the first time that the length was greater than the steady state length? Implies flagellum has reached steady state
 
 
 
 
     #extend: If you'd like to extend the simulation to simulate more, some lists and arrays must lengthen. Then continue the simulation.
-    def extend(self,extend_time): 
+    #With until_steady (needs ss=True), stop as soon as the steady-state test passes and shorten the traces to the steps that were run.
+    def extend(self,extend_time,until_steady=False): 
+        self._check_released()
         # self.avaT = np.concatenate((self.avaT,np.zeros(extend_time)))
-        self.L_trace = np.concatenate((self.L_trace,np.zeros(extend_time-1)))
-        self.flux = np.concatenate((self.flux,np.zeros(extend_time-1)))
-        self.base = np.concatenate((self.base,np.zeros(extend_time-1)))
-        for p in self.motors:
-            p.track = np.concatenate((p.track,np.zeros(extend_time-1)))
-            # p.activetrack = np.concatenate((p.activetrack,np.zeros(extend_time-1)))
-            # p.boundtrack = np.concatenate((p.boundtrack,np.zeros(extend_time-1)))
+        rows = -(-(self.current_time+extend_time)//self.trace_every) - len(self.L_trace) #rows for time steps up to current_time+extend_time
+        self.L_trace = self._trace_buffers['L_trace'].grow(rows)
+        self.flux = self._trace_buffers['flux'].grow(rows)
+        self.base = self._trace_buffers['base'].grow(rows)
+        self._tracks = self._trace_buffers['tracks'].grow(rows)
         # self.sim(self=self,t=extend_time,start=self.t)
-        self.sim(self.current_time+extend_time,start=self.current_time)
+        self.sim(self.current_time+extend_time,start=self.current_time,until_steady=until_steady)
+        self._trim_traces()
+
+    #Shorten the traces to the time steps up to current_time, after a run that stopped early
+    def _trim_traces(self):
+        rows = -(-(self.current_time+1)//self.trace_every)
+        if rows < len(self.L_trace):
+            self.L_trace = self._trace_buffers['L_trace'].truncate(rows)
+            self.flux = self._trace_buffers['flux'].truncate(rows)
+            self.base = self._trace_buffers['base'].truncate(rows)
+            self._tracks = self._trace_buffers['tracks'].truncate(rows)
+
+    #Run the cell on from where it is, chunk time steps at a time, as a generator that yields a snapshot (a small dictionary) after each chunk.
+    #Nothing is kept between chunks unless record is True, so an unbounded run takes constant memory and can be stopped any time, e.g.
+    #    for snap in Cell(t=0).run_iter(chunk=100):
+    #        if snap['L'] > 5:
+    #            break
+    #steps: number of time steps to run, or None to go on until the caller stops
+    #record: if False (default), the steps leave no history: L_trace, flux, base, tracks and avaT stay as they were, and a later extend() has
+    #        zeros for these steps. If True, the traces grow as with extend().
+    #positions: also put the motor positions at the end of each chunk in the snapshots
+    #Each snapshot has:
+    #    step, time: the last time step run and its time (s)
+    #    L: length after it
+    #    lengths, flux, base: the traces for the time steps of the chunk that the traces record (see trace_every)
+    #    avalanches: size of the avalanche at every time step of the chunk
+    #    counts: number of motors in each state after the chunk, by state name
+    #    steady: result of the steady-state test after the chunk (ss=True only, otherwise None)
+    #    pos: motor positions after the chunk, only with positions=True
+    #Like extend(), the first chunk runs time step current_time again. L_hog changes the length halfway to current_time + steps, as extend()
+    #would, and not at all when steps is None.
+    def run_iter(self, steps=None, chunk=1, positions=False, record=False):
+        self._check_released()
+        i, end = self.current_time, None if steps is None else self.current_time + steps
+        half = -1 if end is None else np.floor(end/2) #L_hog acts once, halfway through the whole run, not in every chunk
+        te = self.trace_every
+        if not record:
+            self._fill_tracks() #the event engine's unwritten tracks go in the real traces, before they are swapped out
+            saved = self.L_trace, self.flux, self.base, self._tracks, self._trace_buffers, self.avaT
+            size = -(-(chunk + te - 1)//te) #rows a chunk can need
+            buffers = [np.zeros(size, dtype=self.trace_dtype) for _ in range(3)] + [np.zeros((size, self._tracks.shape[1]), dtype=self.trace_dtype)]
+            self._trace_buffers = {}
+        try:
+            while end is None or i < end:
+                n = chunk if end is None else min(chunk, end - i)
+                if record:
+                    rows = -(-(i+n)//te) - len(self.L_trace)
+                    self.L_trace = self._trace_buffers['L_trace'].grow(rows)
+                    self.flux = self._trace_buffers['flux'].grow(rows)
+                    self.base = self._trace_buffers['base'].grow(rows)
+                    self._tracks = self._trace_buffers['tracks'].grow(rows)
+                    first = -(-i//te)
+                else:
+                    self._step0 = i - i % te
+                    rows = -(-(i+n - self._step0)//te)
+                    self.L_trace, self.flux, self.base, self._tracks = [b[:rows] for b in buffers]
+                    self.avaT = []
+                    first = -(-i//te) - self._step0//te
+                num_ava = len(self.avaT)
+                self.sim(i+n, start=i, half=half)
+                if not record:
+                    self._segments = []
+                i += n
+                pos, state = self._gather_motors()
+                snap = dict(step=i-1, time=(i-1)*self.t_step, L=self.L, lengths=np.array(self.L_trace[first:]), flux=np.array(self.flux[first:]),
+                            base=np.array(self.base[first:]), avalanches=np.array(self.avaT[num_ava:], dtype=int),
+                            counts=dict(zip(STATES, np.bincount(state, minlength=len(STATES)).tolist())),
+                            steady=None if self.steady is None else self.steady.steady)
+                if positions:
+                    snap['pos'] = pos
+                yield snap
+        finally:
+            if not record:
+                self.L_trace, self.flux, self.base, self._tracks, self._trace_buffers, self.avaT = saved
+                self._step0 = 0
+
+    #Zeros for a history with one row per recorded time step (see trace_every) and the given columns, of trace_dtype. With trace_dir it is a
+    #memory-mapped file named after the trace in trace_path. It is kept in a GrowableTrace so extend() can lengthen it cheaply.
+    #rows is the number of rows, by default enough for num_of_timesteps.
+    def _new_trace(self, name, columns=(), rows=None):
+        shape = (-(-self.num_of_timesteps//self.trace_every) if rows is None else rows,) + tuple(columns)
+        if self.trace_path is None:
+            array = np.zeros(shape, dtype=self.trace_dtype)
+        else:
+            array = np.memmap(os.path.join(self.trace_path, name + '.dat'), dtype=self.trace_dtype, mode='w+', shape=shape)
+        self._trace_buffers[name] = GrowableTrace(array)
+        return array
+
+    #Position history of every motor, one column per motor. The event engine writes some of it only when it is asked for.
+    @property
+    def tracks(self):
+        self._fill_tracks()
+        return self._tracks
 
     #is_steadystate: Check if flagellum has reached steady state. Fit range is the number of time points you're examining. Take the last fit_range lengths, do a line fit and see if the slope is lower than eps. If so, it's steady state because it's not growing any more.
     def is_steadystate(self,fit_range=1000, eps=5e-6): 
-        fit_range = int(fit_range/self.t_step)
+        fit_range = int(fit_range/(self.t_step*self.trace_every))
         if len(self.L_trace) < fit_range:
             return False
         slope,intercept = np.polyfit(range(fit_range),self.L_trace[-1*fit_range:],1)
-        return abs(slope)<eps
+        return abs(slope)<eps*self.trace_every #slope is per recorded row
 
     # #distr: returns the spatial distribution of 
     # def distr(self,time=None):
@@ -121,20 +813,49 @@ class Cell:
             # time = self.current_time
         # return [p.track[time] for p in self.motors if (p.activetrack[time] and not p.boundtrack[time])]
 
-    # Run simulation. See line comments.
-    def sim(self,t,start=0):
+    # Run simulation from time step start up to time step t, using whichever engine the cell was made with.
+    # With until_steady, stop after the first time step where the steady-state test (self.steady) passes. Every engine also stops after the
+    # time step it is in once self._stop is set (see SimFuture).
+    # A hybrid cell's first sim starts with the mean-field jump (see _jump), which takes none of the time steps.
+    # half: the time step where L_hog changes the length, by default halfway to t. run_iter gives the halfway step of all its chunks.
+    def sim(self,t,start=0,until_steady=False,half=None):
+        self._hog_step = np.floor(t/2) if half is None else half
+        if self._hybrid_pending:
+            self._jump()
+        began = time.perf_counter()
+        if self.engine == 'ode':
+            self._sim_ode(t,start,until_steady)
+        elif self.engine == 'vector':
+            self._sim_vector(t,start,until_steady)
+        elif self.engine == 'event':
+            self._sim_event(t,start,until_steady)
+        elif self.engine == 'lattice':
+            self._sim_lattice(t,start,until_steady)
+        else:
+            self._sim_object(t,start,until_steady)
+        if self.stats is not None and self.engine != 'ode':
+            self.stats.wall += time.perf_counter() - began
+        for trace in self._trace_buffers.values():
+            trace.flush()
+
+    # Object engine: the original simulation, one method call per motor per time step. See line comments.
+    def _sim_object(self,t,start=0,until_steady=False):
+        stats, hist = self.stats, self.histograms
     
         for i in range(start,t): #Iterate through time steps.
+            if stats: stats.start()
             self.current_time=i
+            row, skip = divmod(i - self._step0, self.trace_every) #traces only record the steps with skip == 0, in this row
             
             #Hand of God case. Mostly not used. If you want to change length manually...
-            if i==np.floor(t/2) and self.L_hog: #...do so at the halfway mark.
+            if i==self._hog_step and self.L_hog: #...do so at the halfway mark.
                 self.L *= self.L_hog #multiply length by whatever you want
 
 
             #Avalanching. This is the way the simulation sends motors into active transport. Usually set to TRUE.
             if self.avalanche_on:
                 self.avalanche() #method for avalanching described below
+            if stats: stats.lap('avalanche')
 
             #Flagellar decay
             if self.L >= self.decay_size: #This ensures that the length never gets negative.
@@ -144,8 +865,12 @@ class Cell:
             elif self.L < self.decay_size: #Instead of letting the flagellum go negative...
                 self.L = 0 #... set its length to zero.
 
-            self.L_trace[i] = self.L #update growth curve array. plt.plot(L_trace) plots the length over time if matplotlib.pyplot is imported
+            steady = self.steady is not None and self.steady.update(self.L) #steady-state test on the same lengths as L_trace
+            if not skip:
+                self.L_trace[row] = self.L #update growth curve array. plt.plot(L_trace) plots the length over time if matplotlib.pyplot is imported
+            if stats: stats.lap('decay')
 
+            self._draw_step() #the random numbers every motor may use this step
             #Iterate over each motor
             for p in self.motors:
 
@@ -159,13 +884,523 @@ class Cell:
                 elif p.state == 'diffusion':
                     p.diffuse()
                         
-                p.track[i] = p.pos #update the position history vector for the motor
+                if not skip:
+                    self._tracks[row,p.index] = p.pos #update the position history vector for the motor
                 # p.activetrack[i]=p.isactive #update the boolean vector of when this motor was in the flagellum (IFT/diffusion)
                 # p.boundtrack[i]=p.isbound #update the boolean vector of when this motor was in IFT
+            if stats: stats.lap('motors')
 
-            self.flux[i] = sum([1 for j in self.motors if (j.pos < 1 and j.state == 'IFT')]) #count how many motors are starting IFT. Must be bound and active.
-            self.base[i]= sum([1 for j in self.motors if not j.state == 'base']) #count how many motors are in the base, add to history
+            if not skip:
+                self.flux[row] = sum([1 for j in self.motors if (j.pos < 1 and j.state == 'IFT')]) #count how many motors are starting IFT. Must be bound and active.
+                self.base[row]= sum([1 for j in self.motors if not j.state == 'base']) #count how many motors are in the base, add to history
+                if stats: stats.lap('record')
             # self.track_active[i] = self.count_active()
+            if stats: stats.end_step(np.bincount([STATES.index(p.state) for p in self.motors], minlength=len(STATES)))
+            if hist: hist.update(self.avaT[-1] if self.avalanche_on else 0, np.bincount([STATES.index(p.state) for p in self.motors], minlength=len(STATES)),
+                                 [p.pos for p in self.motors if p.state == 'diffusion'], self.L)
+            if self.hook is not None: self.hook(self, i)
+
+            if (steady and until_steady) or self._stop:
+                t = i+1 #the last step run
+                break
+
+    # Mean-field engine: the same time steps with the length following mean_field_rate instead of motors, so L_trace comes out in milliseconds.
+    # flux and base hold the mean-field numbers of motors. There are no tracks: cell.tracks has no columns and motor tracks are zeros.
+    def _sim_ode(self,t,start=0,until_steady=False):
+        for i in range(start,t):
+            rate = self._mean_field_rate(self.L)
+            self.current_time=i
+            row, skip = divmod(i - self._step0, self.trace_every)
+
+            if i==self._hog_step and self.L_hog:
+                self.L *= self.L_hog
+                rate = self._mean_field_rate(self.L)
+
+            self.L = max(self.L + self.t_step*rate, 0)
+            steady = self.steady is not None and self.steady.update(self.L)
+            if not skip:
+                self.L_trace[row] = self.L
+                cycle = cycle_time(self.L, self.D, self.v)
+                self.flux[row] = (self.N-self.thresh)/cycle/self.v #motors in the first micron of IFT: arrival rate at the tip times 1/v
+                self.base[row] = (self.N-self.thresh)*(1 - 2/cycle) #motors in the flagellum
+            if self.hook is not None: self.hook(self, i)
+
+            if (steady and until_steady) or self._stop:
+                break
+
+    #Growth rate of the mean-field model at length L with this cell's parameters (um/s)
+    def _mean_field_rate(self, L):
+        if not self.avalanche_on: #no motors ever leave the base
+            return -self.decay_sizeMS
+        return mean_field_rate(L, self.D, self.v, self.N, self.thresh, self.build_size, self.decay_sizeMS)
+
+    #The mean-field start of a hybrid run. The mean-field model is solved from the current length, one t_step at a time like engine='ode'
+    #but without running any of the cell's time steps, until its growth rate is within hybrid_tol*decay_size of zero (or the length is 0 and
+    #shrinking). The motors are then spread out as the mean-field model has them, and the engine takes over from there.
+    def _jump(self):
+        self._hybrid_pending = False
+        rate = self._mean_field_rate(self.L)
+        while abs(rate) >= self.hybrid_tol*self.decay_sizeMS and not (self.L == 0 and rate < 0):
+            self.L = max(self.L + self.t_step*rate, 0)
+            rate = self._mean_field_rate(self.L)
+        self._place_motors()
+
+    #Spread the motors out as the mean-field model has them at the current length: thresh in the base, and of the rest, a share in IFT
+    #and in diffusion in proportion to the time the cycle spends there. IFT motors are anywhere along the flagellum, diffusing motors are
+    #denser towards the tip (density proportional to distance from the base, as for motors that enter at the tip and leave at the base).
+    def _place_motors(self):
+        L, cycle = self.L, cycle_time(self.L, self.D, self.v)
+        moving = max(self.N - self.thresh, 0)
+        num_ift = int(round(moving*L/self.v/cycle))
+        num_diffusing = int(round(moving*L**2/(2*self.D)/cycle))
+        pos, state = np.zeros(self.N), np.full(self.N, BASE, dtype=np.int8)
+        ift, diffusing = np.arange(num_ift), np.arange(num_ift, num_ift+num_diffusing)
+        state[ift], pos[ift] = IFT, L*self.random.rand(num_ift)
+        state[diffusing], pos[diffusing] = DIFFUSION, L*np.sqrt(self.random.rand(num_diffusing))
+        if self.diffusion == 'first_passage': #what's left of their trips, roughly: a random part of a whole one
+            pos[diffusing] = np.nan
+            self.fp_left[diffusing] = self.random.rand(num_diffusing)*first_passage_time(num_diffusing, self.random.rand)
+        self._scatter_motors(pos, state)
+
+    # Vector engine: same time step as _sim_object, but motor positions and states live in arrays and every motor is updated at once.
+    # The object engine updates motors one after another, so a motor arriving at the tip lengthens the flagellum for every motor after it in the list.
+    # To give exactly the same result, tip arrivals (rare, only motors within one IFT step of the tip) are handled in motor order in a short loop,
+    # and each diffusing motor then sees the length that the object engine would have shown it.
+    def _sim_vector(self,t,start=0,until_steady=False):
+        pos, state = self._gather_motors()
+        dv = self.t_step*self.v #distance an IFT motor moves in one time step
+        stats, hist = self.stats, self.histograms
+
+        for i in range(start,t):
+            if stats: stats.start()
+            self.current_time=i
+            row, skip = divmod(i - self._step0, self.trace_every)
+
+            if i==self._hog_step and self.L_hog:
+                self.L *= self.L_hog
+
+            if self.avalanche_on:
+                self._avalanche_vector(state)
+            if stats: stats.lap('avalanche')
+
+            if self.L >= self.decay_size:
+                self.L -= self.decay_size
+            elif self.L < self.decay_size:
+                self.L = 0
+
+            steady = self.steady is not None and self.steady.update(self.L)
+            if not skip:
+                self.L_trace[row] = self.L
+            if stats: stats.lap('decay')
+
+            self._draw_step()
+            diffusing = (state == DIFFUSION).nonzero()[0] #motors that diffuse this step. Motors that reach the tip this step start diffusing next step.
+
+            #IFT. Motors that can't reach the tip this step just move forward, the rest go through the tip in motor order.
+            ift = (state == IFT).nonzero()[0]
+            reach = pos[ift] + dv >= self.L
+            pos[ift[~reach]] += dv
+            arrived, L_after, left = self._tip_arrivals(ift[reach], pos, state, dv)
+
+            self._diffuse_vector(pos, state, diffusing, arrived, L_after, left)
+            if stats: stats.lap('motors')
+
+            if not skip:
+                self._tracks[row] = pos
+                self.flux[row] = np.count_nonzero((pos < 1) & (state == IFT))
+                self.base[row] = np.count_nonzero(state != BASE)
+                if stats: stats.lap('record')
+            if stats: stats.end_step(np.bincount(state, minlength=len(STATES)))
+            if hist: hist.update(self.avaT[-1] if self.avalanche_on else 0, np.bincount(state, minlength=len(STATES)), pos[state == DIFFUSION], self.L)
+            if self.hook is not None: self.hook(self, i)
+
+            if (steady and until_steady) or self._stop:
+                t = i+1 #the last step run
+                break
+
+        self._scatter_motors(pos, state)
+
+    #Tip arrivals for the vector engines. reach are the IFT motors, in motor order, that can get to the tip this step. Going through them in motor
+    #order, each one moves forward and, if it gets to the tip, builds, which makes the flagellum longer for the ones after it. A motor ending the step
+    #at y arrives if y is at least the length after the builds before it, so with lengths[k] = length after k builds it arrives if the number of
+    #arrivals before it is at most most_builds = (largest k with lengths[k] <= y). Usually they all arrive, otherwise the count goes in a short loop.
+    #Returns the motors that arrived, the lengths: L_after[0] is the length before any of them built, L_after[k] right after the k-th one built,
+    #and, for diffusion='gaussian', how much of the step each arrived motor has left after getting to the tip (s).
+    def _tip_arrivals(self, reach, pos, state, dv):
+        n = len(reach)
+        y = pos[reach] + dv #the object engine only moves a motor if it's below the tip, but one at or past the tip arrives either way
+        lengths = np.add.accumulate(np.concatenate(([self.L], np.full(n, self.build_size)))) #the same additions as L += build_size, one at a time
+        most_builds = np.searchsorted(lengths, y, side='right') - 1
+        arrives = most_builds >= np.arange(n)
+        if not arrives.all():
+            #past the first motor that doesn't arrive, count them one at a time, stopping once no later motor can arrive
+            first = arrives.argmin()
+            arrives[first:] = False
+            later_max = np.maximum.accumulate(most_builds[::-1])[::-1].tolist()
+            count = first
+            for j, k in enumerate(most_builds[first:].tolist(), first):
+                if count > later_max[j]:
+                    break
+                if count <= k:
+                    arrives[j] = True
+                    count += 1
+        num_before = np.cumsum(arrives) - arrives
+        left = np.zeros(0)
+        if self.diffusion == 'gaussian':
+            moved = np.where(pos[reach] < lengths[num_before], y, pos[reach]) #where the object engine has it
+            left = (np.minimum(moved - lengths[num_before], dv)/self.v)[arrives]
+        pos[reach] = np.where(arrives, lengths[num_before + 1], y)
+        arrived = reach[arrives]
+        state[arrived] = DIFFUSION
+        if self.diffusion == 'first_passage':
+            self.fp_left[arrived] = first_passage_from_uniform(self._step_random[arrived, 0])
+        L_after = lengths[:len(arrived)+1]
+        self.L = L_after[-1].item()
+        return arrived, L_after, left
+
+    #Diffusion step for the vector engines. Each diffusing motor sees the length after every tip arrival earlier in the motor list.
+    #With diffusion='gaussian', the motors that arrived at the tip this step also diffuse for the time they have left.
+    def _diffuse_vector(self, pos, state, diffusing, arrived, L_after, left):
+        if len(arrived):
+            L_seen = L_after[np.searchsorted(arrived, diffusing)]
+        else:
+            L_seen = np.full(len(diffusing), self.L)
+        if self.diffusion == 'first_passage':
+            self._first_passage_vector(pos, state, diffusing, L_seen)
+            return
+        if self.diffusion == 'gaussian':
+            self._gaussian_vector(pos, state, diffusing, L_seen, arrived, left)
+            return
+        x = np.minimum(pos[diffusing], L_seen) #in case it's past the tip because the flagellum decayed
+        at_tip = x == L_seen
+        walk = ~at_tip
+        x[at_tip] -= self.rms_disp #motors at the tip can only go towards the base
+        r = self._step_random[diffusing[walk], 0] #each motor's own number for this step, as the object engine uses them
+        step = np.where(r < .5, x[walk] - self.rms_disp, x[walk] + self.rms_disp)
+        x[walk] = np.minimum(np.maximum(step, 0), L_seen[walk]) #keep it between 0 and the length
+        pos[diffusing] = x
+        state[diffusing[x <= 0]] = BASE
+
+    #Part of a first-passage trip (see first_passage_time) used up in one time step with the flagellum at length L. Works on numbers or arrays.
+    #With diffusion='first_passage' a motor draws its trip, in units of L**2/D, when it reaches the tip, and each time step uses up this much
+    #of it for the length of the moment, so a flagellum that grows or shrinks during the trip stretches or shortens it.
+    #A walking motor leaves the tip straight down and is back in the base after M = ceil(L/rms_disp) steps down, which takes M**2 steps on
+    #average, so the trip is scaled to (M*rms_disp)**2/D rather than L**2/D. The walk's lengths stick just above whole multiples of rms_disp,
+    #where its trips get a step longer, and the walk doesn't always leave the tip straight down when the flagellum is growing, so first_passage
+    #gets close to the walk's lengths but not exactly, see ift_validation.compare_diffusion.
+    def _first_passage_rate(self, L):
+        return self.D*self.t_step/(self.rms_disp*np.maximum(np.ceil(L/self.rms_disp), 1))**2
+
+    #diffusion='gaussian' for the vector engines. Each motor uses its own three uniform numbers of the step, like the object engine.
+    #A motor that just arrived starts at the tip, which is its position, and diffuses for the time it has left.
+    def _gaussian_vector(self, pos, state, diffusing, L_seen, arrived, left):
+        movers = np.concatenate((diffusing, arrived))
+        u = self._step_random[movers]
+        x = np.concatenate((np.minimum(pos[diffusing], L_seen), pos[arrived])) #in case it's past the tip because the flagellum decayed
+        L = np.concatenate((L_seen, pos[arrived]))
+        tau = np.concatenate((np.full(len(diffusing), self.t_step), left))
+        x = gaussian_step(x, L, tau, self.D, u)
+        pos[movers] = x
+        state[movers[x <= 0]] = BASE
+
+    #diffusion='first_passage' for the vector engines: use up one step of every diffusing motor's trip, and put the ones done back in the base
+    def _first_passage_vector(self, pos, state, diffusing, L_seen):
+        left = self.fp_left[diffusing] - self._first_passage_rate(L_seen)
+        self.fp_left[diffusing] = left
+        pos[diffusing] = np.where(left <= 0, 0, np.nan)
+        state[diffusing[left <= 0]] = BASE
+
+    # Event engine. Every motor in IFT moves dv per step until it reaches the tip, so after step i its position is key + dv*(i+1), where key is fixed
+    # when it is injected. The motors injected by one avalanche are kept together as a cohort, oldest cohort first. A motor injected at step i0 starts
+    # at or just below 0, so its key is at most -dv*i0: going from the oldest cohort, once one is too far back to reach the tip, so are all the rest.
+    # For flux, each cohort also keeps the lowest key among it and all older cohorts: going from the youngest, once that is past position 1, stop.
+    # So each step only touches the few cohorts near the tip or near the base.
+    # IFT motors already in flight when sim starts are kept apart in the same form and always checked.
+    # Tracks of IFT and base motors are straight lines, so they are saved as segments and only written into tracks when someone reads them.
+    # With diffusion='first_passage', diffusing motors aren't touched every step either. The cell keeps one clock that advances one step of a
+    # trip (_first_passage_rate) per step, with the length at the end of the step, and a heap of the clock readings at which each motor gets back to the base. Motors that
+    # come before a tip arrival in the motor list see a length shorter by a few build_size for that one step in the other engines, so here
+    # first-passage runs agree with them statistically rather than number for number.
+    def _sim_event(self,t,start=0,until_steady=False):
+        self._fill_tracks() #segments of an earlier run end at step start, which this run writes again
+        pos, state = self._gather_motors()
+        dv = self.t_step*self.v
+        in_flight = (state == IFT).nonzero()[0]
+        in_flight = [in_flight, pos[in_flight] - dv*start] #motors and keys of the IFT motors from before this sim
+        cohorts = [] #[injection step, lowest key of this and older cohorts, motors, keys] of each avalanche still in IFT, oldest first
+        seg_start = np.full(self.N, start) #first time step of each motor's current IFT trip or stay in the base
+        seg_a = np.where(state == IFT, pos + dv*(1 - start), pos) #track of that trip or stay is seg_a + seg_b*(time step)
+        seg_b = np.where(state == IFT, dv, 0.)
+        first_passage = self.diffusion == 'first_passage'
+        if first_passage:
+            clock = 0.
+            diffusing = (state == DIFFUSION).nonzero()[0]
+            returns = list(zip(self.fp_left[diffusing].tolist(), diffusing.tolist())) #(clock reading when it's back at the base, motor)
+            heapq.heapify(returns)
+            seg_a[diffusing] = np.nan
+        stats, hist = self.stats, self.histograms
+
+        for i in range(start,t):
+            if stats: stats.start()
+            self.current_time=i
+            row, skip = divmod(i - self._step0, self.trace_every)
+
+            if i==self._hog_step and self.L_hog:
+                self.L *= self.L_hog
+
+            if self.avalanche_on:
+                released = self._avalanche_vector(state)
+                if len(released):
+                    keys = pos[released] - dv*i
+                    cohorts.append([i, min(keys.min(), cohorts[-1][1]) if cohorts else keys.min(), released, keys])
+                    self._segments.append((released, seg_start[released], i-1, seg_a[released], 0.)) #end of their stay in the base
+                    seg_start[released], seg_a[released], seg_b[released] = i, pos[released] + dv*(1 - i), dv
+            if stats: stats.lap('avalanche')
+
+            if self.L >= self.decay_size:
+                self.L -= self.decay_size
+            elif self.L < self.decay_size:
+                self.L = 0
+
+            steady = self.steady is not None and self.steady.update(self.L)
+            if not skip:
+                self.L_trace[row] = self.L
+            if stats: stats.lap('decay')
+
+            self._draw_step()
+            if not first_passage:
+                diffusing = (state == DIFFUSION).nonzero()[0]
+
+            #IFT. Take out the motors that can reach the tip this step (key >= L - dv*(i+1)), from the oldest cohorts.
+            lowest_key = self.L - dv*(i+1)
+            groups = [in_flight]
+            for c in cohorts:
+                if -dv*c[0] < lowest_key: #this cohort and every younger one is too far back
+                    break
+                groups.append(c)
+            reach, keys = [], []
+            for g in groups:
+                near = g[-1] >= lowest_key
+                if near.any():
+                    reach.append(g[-2][near])
+                    keys.append(g[-1][near])
+            if reach:
+                reach, keys = np.concatenate(reach), np.concatenate(keys)
+                order = np.argsort(reach)
+                reach = reach[order]
+                pos[reach] = keys[order] + dv*i #where they are at the start of this step
+                arrived, L_after, left = self._tip_arrivals(reach, pos, state, dv)
+                for g in groups: #arrived motors leave their cohort
+                    still = state[g[-2]] == IFT
+                    g[-2], g[-1] = g[-2][still], g[-1][still]
+                while cohorts and not len(cohorts[0][2]):
+                    cohorts.pop(0)
+                self._segments.append((arrived, seg_start[arrived], i-1, seg_a[arrived], seg_b[arrived])) #end of their IFT trips
+                if not skip:
+                    self._tracks[row, arrived] = pos[arrived]
+            else:
+                arrived, L_after, left = np.zeros(0, dtype=int), np.array([self.L]), np.zeros(0)
+
+            if first_passage:
+                clock += self._first_passage_rate(self.L)
+                returned = []
+                while returns and returns[0][0] <= clock:
+                    returned.append(heapq.heappop(returns)[1])
+                returned = np.array(returned, dtype=int)
+                self._segments.append((returned, seg_start[returned], i-1, np.nan, 0.)) #end of their trips
+                pos[returned], state[returned] = 0, BASE
+                if not skip:
+                    self._tracks[row, returned] = 0
+                if len(arrived):
+                    for tau, j in zip((clock + self.fp_left[arrived]).tolist(), arrived.tolist()):
+                        heapq.heappush(returns, (tau, j))
+                    seg_start[arrived], seg_a[arrived], seg_b[arrived] = i+1, np.nan, 0.
+            else:
+                self._diffuse_vector(pos, state, diffusing, arrived, L_after, left)
+                moved = np.concatenate((diffusing, arrived)) #with diffusion='gaussian' the arrived motors have moved too
+                if not skip:
+                    self._tracks[row, moved] = pos[moved]
+                returned = moved[state[moved] == BASE] #back at the base
+            seg_start[returned], seg_a[returned], seg_b[returned] = i+1, pos[returned], 0.
+            if stats: stats.lap('motors')
+
+            #flux: IFT motors below position 1, that is key < 1 - dv*(i+1). Only the youngest cohorts can have any.
+            if not skip:
+                highest_key = 1 - dv*(i+1)
+                flux = np.count_nonzero(in_flight[1] < highest_key)
+                for c in reversed(cohorts):
+                    if c[1] >= highest_key: #this cohort and every older one is too far along
+                        break
+                    flux += len(c[2]) if -dv*c[0] < highest_key else np.count_nonzero(c[3] < highest_key)
+                self.flux[row] = flux
+                self.base[row] = np.count_nonzero(state != BASE)
+                if stats: stats.lap('record')
+            if stats: stats.end_step(np.bincount(state, minlength=len(STATES)))
+            if hist: hist.update(self.avaT[-1] if self.avalanche_on else 0, np.bincount(state, minlength=len(STATES)), pos[state == DIFFUSION], self.L)
+            if self.hook is not None: self.hook(self, i)
+
+            if (steady and until_steady) or self._stop:
+                t = i+1 #the last step run
+                break
+
+        #IFT motors' positions after the last step, and the open segments up to the last step
+        for g in [in_flight] + cohorts:
+            pos[g[-2]] = g[-1] + dv*t
+        if first_passage: #what's left of each trip, for the next sim
+            diffusing = np.array([j for _, j in returns], dtype=int)
+            self.fp_left[diffusing] = [tau - clock for tau, _ in returns]
+            pos[diffusing] = np.nan
+        waiting = (state != DIFFUSION).nonzero()[0] if not first_passage else np.arange(self.N)
+        self._segments.append((waiting, seg_start[waiting], t-1, seg_a[waiting], seg_b[waiting]))
+        self._scatter_motors(pos, state)
+
+    #Write the track segments saved by the event engine into the tracks array. Each segment is a batch of motors with, for each one, the first and
+    #last time step of the segment and the track a + b*(time step) in between. Only the time steps the traces record (see trace_every) are written.
+    def _fill_tracks(self):
+        for j, first, last, a, b in self._segments:
+            n = np.maximum(np.broadcast_to(last, np.shape(j)) - first + 1, 0) #number of time steps for each motor
+            steps = np.repeat(first, n) + np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n)
+            a, b = np.broadcast_to(a, np.shape(j)), np.broadcast_to(b, np.shape(j))
+            motors, track = np.repeat(j, n), np.repeat(a, n) + np.repeat(b, n)*steps
+            if self.trace_every > 1:
+                kept = steps % self.trace_every == 0
+                steps, motors, track = steps[kept], motors[kept], track[kept]
+            self._tracks[(steps - self._step0)//self.trace_every, motors] = track
+        self._segments = []
+
+    # Lattice engine, see engine='lattice' in Cell. The walk's diffusing motors are counts n[k] of motors k steps from the base, that is between
+    # (k-1)*rms_disp and k*rms_disp, and tip motors at the length itself. A motor leaving the tip is in the highest site below the length,
+    # ceil(L/rms_disp) - 1, as in the walk. Each site's count splits into left and right with one binomial draw per step. IFT motors are
+    # cohorts, one per avalanche, oldest first, with their position and count. A time step then costs about L/rms_disp + L/(v*t_step)
+    # operations whatever N is.
+    # Motors lose their identity: there are no tracks (as with 'ode'), and cell.motors only has the right numbers in each state and at each
+    # position at the end. Motors in the site just below the tip are all taken to be at the tip, and all tip arrivals of a step see the length
+    # at the end of the step. So it agrees with the other engines statistically, not number for number, and its lengths are a little long,
+    # see ift_validation.compare_engines.
+    def _sim_lattice(self,t,start=0,until_steady=False):
+        h, dv, b = self.rms_disp, self.t_step*self.v, self.build_size
+        stats, hist = self.stats, self.histograms
+        pos, state = self._gather_motors()
+        cohort_pos, cohort_count = np.unique(pos[state == IFT], return_counts=True)
+        cohort_pos, cohort_count = cohort_pos[::-1], cohort_count[::-1] #furthest along is oldest
+        x = pos[state == DIFFUSION]
+        k = np.maximum(np.ceil(x/h).astype(int), 1)
+        at_tip = (x >= self.L) | (k*h >= self.L)
+        tip = np.count_nonzero(at_tip)
+        n = np.bincount(k[~at_tip], minlength=int(self.L/h) + 2)
+        num_base = np.count_nonzero(state == BASE)
+
+        for i in range(start,t):
+            if stats: stats.start()
+            self.current_time=i
+            row, skip = divmod(i - self._step0, self.trace_every)
+
+            if i==self._hog_step and self.L_hog:
+                self.L *= self.L_hog
+
+            if self.avalanche_on:
+                release = self._avalanche_size(num_base)
+                if release:
+                    num_base -= release
+                    cohort_pos, cohort_count = np.append(cohort_pos, 0.), np.append(cohort_count, release)
+            if stats: stats.lap('avalanche')
+
+            if self.L >= self.decay_size:
+                self.L -= self.decay_size
+            elif self.L < self.decay_size:
+                self.L = 0
+
+            steady = self.steady is not None and self.steady.update(self.L)
+            if not skip:
+                self.L_trace[row] = self.L
+            if stats: stats.lap('decay')
+
+            #IFT. Every cohort moves dv. In a cohort that gets to the tip, motors build one at a time until the length passes them.
+            cohort_pos = cohort_pos + dv
+            arrived = 0
+            for j in (cohort_pos >= self.L).nonzero()[0].tolist():
+                builds = min(int(cohort_count[j]), int((cohort_pos[j] - self.L)/b) + 1) if cohort_pos[j] >= self.L else 0
+                self.L += builds*b
+                cohort_count[j] -= builds
+                arrived += builds
+            if arrived:
+                kept = cohort_count > 0
+                cohort_pos, cohort_count = cohort_pos[kept], cohort_count[kept]
+
+            #Diffusion on the lattice below the length after this step's builds. Motors past it go to the tip first, as the walk clamps them.
+            K = max(int(np.ceil(self.L/h)) - 1, 0) #sites below the length are 1..K, none at L = 0
+            if len(n) < K + 2:
+                n = np.concatenate((n, np.zeros(K + 2 - len(n), dtype=n.dtype)))
+            tip += n[K+1:].sum()
+            n[K+1:] = 0
+            down = self.random.binomial(n[1:K+1], .5)
+            new = np.zeros_like(n)
+            new[:K] += down
+            new[2:K+1] += (n[1:K+1] - down)[:-1]
+            new_tip = n[K] - down[-1] if K >= 1 else 0
+            new[K] += tip #tip motors step down. With K = 0 the flagellum is shorter than one step and they get to the base.
+            num_base += new[0]
+            new[0] = 0
+            n, tip = new, new_tip + arrived
+            if stats: stats.lap('motors')
+
+            if not skip:
+                self.flux[row] = cohort_count[cohort_pos < 1].sum()
+                self.base[row] = self.N - num_base
+                if stats: stats.lap('record')
+            counts = (num_base, cohort_count.sum(), n.sum() + tip) if stats or hist else None
+            if stats: stats.end_step(counts)
+            if hist: hist.update(self.avaT[-1] if self.avalanche_on else 0, counts, np.append((np.arange(len(n)) - .5)*h, self.L), self.L,
+                                 weights=np.append(n, tip))
+            if self.hook is not None: self.hook(self, i)
+
+            if (steady and until_steady) or self._stop:
+                t = i+1 #the last step run
+                break
+
+        #hand the counts back to the motors: IFT, then diffusing, then base
+        pos = np.concatenate((np.repeat(cohort_pos, cohort_count), np.repeat(np.arange(len(n))*h, n), np.full(tip, self.L), np.zeros(num_base)))
+        state = np.repeat(np.array([IFT, DIFFUSION, BASE], dtype=np.int8), [cohort_count.sum(), n.sum() + tip, num_base])
+        self._scatter_motors(pos, state)
+
+    #Copy motor positions and states from the Motor objects into arrays for the vector engine
+    def _gather_motors(self):
+        pos = np.array([p.pos for p in self.motors], dtype=float)
+        state = np.array([STATES.index(p.state) for p in self.motors], dtype=np.int8)
+        return pos, state
+
+    #Copy the vector engine's arrays back into the Motor objects so cell.motors looks the same as after an object engine run
+    def _scatter_motors(self, pos, state):
+        for p, x, s in zip(self.motors, pos.tolist(), state.tolist()):
+            p.pos = x
+            p.state = STATES[s]
+
+    #Draw the uniform numbers of one time step for the agent engines, one row per motor, into _step_random. A diffusing motor uses its row:
+    #three numbers with diffusion='gaussian' (see gaussian_step), otherwise one, for its step of the walk or, at the tip, its first-passage
+    #time. Every motor gets a row whether it uses it or not, and the avalanche draws its number every step too, so every time step takes the
+    #same count of numbers whatever the motors do. Two cells with the same seed then give each motor the same numbers at the same step even
+    #after their motors have gone different ways, which keeps forks with common random numbers in step (see ift_sensitivity.py).
+    def _draw_step(self):
+        k = 3 if self.diffusion == 'gaussian' else 1
+        self._step_random = self.random.rand(k*self.N).reshape(self.N, k)
+
+    #Avalanching for the vector engines. Same as avalanche() but on the array of motor states. Returns the motors released.
+    def _avalanche_vector(self, state):
+        base_motors = (state == BASE).nonzero()[0]
+        release = self._avalanche_size(len(base_motors))
+        state[base_motors[:release]] = IFT
+        return base_motors[:release]
+
+    #Number of motors an avalanche releases with num_base motors in the base (0 unless over thresh), also added to avaT.
+    #The random number is drawn every step, avalanche or not, see _draw_step.
+    def _avalanche_size(self, num_base):
+        release = 0
+        w = self.random.weibull(1)
+        if num_base > self.thresh:
+            distr = int((num_base-self.thresh+10) * w + 1)
+            release = min(distr, num_base)
+        self.avaT.append(release)
+        return release
 
     #Avalanching method
     def avalanche(self):
@@ -175,10 +1410,11 @@ class Cell:
         
         
         base_motors = [p for p in self.motors if p.state == 'base'] #get list of which motors are in the base
+        w = self.random.weibull(1) #drawn every step, avalanche or not, see _draw_step
 
         if num_base > self.thresh: #If the number of motors in the base exceeds the threshold require for avalanching
  
-            distr = int((num_base-self.thresh+10) * np.random.weibull(1) + 1) #determine number of motors to inject into IFT
+            distr = int((num_base-self.thresh+10) * w + 1) #determine number of motors to inject into IFT
             release = min(distr, num_base) #make sure you don't inject more motors than you have in the base
 
             #self.ava.append(release)
@@ -227,25 +1463,151 @@ class Cell:
         # plt.figure(2)
         # self.plot_growth_rate()
 
+    #Save everything needed to go on with this run to a checkpoint file at path (see write_checkpoint): the arguments the cell was made with,
+    #its length, motors, recorded traces, random numbers, steady-state test, and stats and histograms so far.
+    def save_checkpoint(self, path):
+        self._check_released()
+        pos, state = self._gather_motors()
+        random_state, uniform = self.random.state
+        meta = dict(params=dict(self.params, seed=None, trace_dtype=self.trace_dtype, hook=None), t=self.t, num_of_timesteps=self.num_of_timesteps,
+                    L=self.L, current_time=self.current_time, time2ss=getattr(self, 'time2ss', None), random=random_state,
+                    hybrid_pending=self._hybrid_pending)
+        arrays = dict(L_trace=self.L_trace, flux=self.flux, base=self.base, tracks=self.tracks, time=self.time, avaT=np.array(self.avaT, dtype=int),
+                      pos=pos, state=state, fp_left=self.fp_left, uniform=uniform)
+        if self.steady is not None:
+            meta['steady'], arrays['steady_lengths'] = self.steady.state
+        if self.stats is not None:
+            meta['stats'], arrays['stats_motor_steps'] = self.stats.state
+        if self.histograms is not None:
+            meta['histogram_steps'], counts = self.histograms.state
+            arrays.update(('histogram_' + name, counts[name]) for name in counts)
+        write_checkpoint(path, meta, arrays)
+
+    #Make the cell saved in the checkpoint file at path by save_checkpoint, ready to go on where it stopped
+    @classmethod
+    def load_checkpoint(cls, path):
+        meta, arrays = read_checkpoint(path)
+        cell = cls(**dict(meta['params'], t=0)) #t=0: make the cell without running it
+        cell.t, cell.num_of_timesteps, cell.time = meta['t'], meta['num_of_timesteps'], arrays['time']
+        cell.L, cell.current_time = meta['L'], meta['current_time']
+        cell._hybrid_pending = meta.get('hybrid_pending', False) #only a hybrid cell saved before its first run still jumps
+        if meta['time2ss'] is not None:
+            cell.time2ss = meta['time2ss']
+        for name in ('L_trace', 'flux', 'base', 'tracks'):
+            trace = cell._new_trace(name, arrays[name].shape[1:], len(arrays[name]))
+            trace[:] = arrays[name]
+            setattr(cell, '_tracks' if name == 'tracks' else name, trace)
+        cell.avaT = arrays['avaT'].tolist()
+        cell._scatter_motors(arrays['pos'], arrays['state'])
+        cell.fp_left = arrays['fp_left']
+        cell.random.state = meta['random'], arrays['uniform']
+        if cell.steady is not None:
+            cell.steady.state = meta['steady'], arrays['steady_lengths']
+        if cell.stats is not None:
+            cell.stats.state = meta['stats'], arrays['stats_motor_steps']
+        if cell.histograms is not None:
+            cell.histograms.state = meta['histogram_steps'], {name: arrays['histogram_' + name] for name in ('avalanche', 'density', 'occupancy')}
+        return cell
+
+    #A new cell that starts from this cell's length and motors, without its history, for perturbation experiments: run one cell to steady
+    #state, fork it as often as needed, change each fork (e.g. fork.L *= .5) and extend() it. The fork has its own random numbers, from
+    #seed or by default spawned from this cell's (see RandomStream.spawn), and counts its time steps from 0.
+    #changes are constructor arguments that are different in the fork, e.g. D=1 or v=3. N can't change.
+    def fork(self, seed=None, **changes):
+        self._check_released()
+        if 'N' in changes:
+            raise ValueError('a fork has the same motors as its cell, N can not change')
+        cell = type(self)(**dict(self.params, t=0, seed=self.random.spawn() if seed is None else seed, **changes))
+        if 'L' not in changes:
+            cell.L = self.L
+        cell._scatter_motors(*self._gather_motors())
+        cell.fp_left = self.fp_left.copy()
+        cell._hybrid_pending = False #the fork goes on from this cell's motors, not from a mean-field start
+        return cell
+
+    #Make Cell(**params) in a background thread and return a SimFuture for it straight away, so a notebook stays free while it runs:
+    #    run = Cell.start(t=20000)
+    #    run.progress, run.eta, run.L    #while it runs
+    #    run.cancel()                    #stop it, keeping the steps it has run
+    #    cell = run.result()             #or, in asyncio, cell = await run
+    @classmethod
+    def start(cls, **params):
+        return cls.submit(None, **params)
+
+    #Same as start(), but run in executor, a concurrent.futures.ThreadPoolExecutor (not a process pool: the handle reads the cell as it
+    #runs), so a pool limits how many run at once. executor=None starts a new thread.
+    @classmethod
+    def submit(cls, executor, **params):
+        args = inspect.signature(cls).bind(**params)
+        args.apply_defaults()
+        return SimFuture(cls, params, int(args.arguments['t']/args.arguments['t_step']), executor)
+
+    #Free the history arrays (L_trace, flux, base, tracks, avaT) so a process that makes many cells doesn't keep them all until the garbage
+    #collector gets to them. With trace_dir, the memory-mapped files are closed and the folder the cell made for them (trace_path) is deleted.
+    #The cell keeps its final state (L, motors), but extend(), run_iter(), fork() and save_checkpoint() raise RuntimeError from then on.
+    #Used on its own or as
+    #    with Cell(...) as cell:
+    #        L = cell.L
+    def release(self):
+        self._released = True
+        for trace in self._trace_buffers.values():
+            trace.close()
+        self._trace_buffers = {}
+        self._segments = []
+        self.L_trace, self.flux, self.base = np.zeros(0), np.zeros(0), np.zeros(0)
+        self._tracks = np.zeros((0, self.N))
+        self.avaT = []
+        self.time = np.zeros(0)
+        if self.trace_path is not None:
+            shutil.rmtree(self.trace_path, ignore_errors=True) #ignore_errors: on Windows a file still mapped by a view can't go yet
+            self.trace_path = None
+
+    #extend(), run_iter(), fork() and save_checkpoint() go on from the history that release() frees
+    def _check_released(self):
+        if self._released:
+            raise RuntimeError('cell was released')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    #Bytes of memory the cell holds: history arrays (memory-mapped ones are on disk and don't count), motors and per-motor arrays
+    @property
+    def nbytes(self):
+        traces = sum(trace.buffer.nbytes for trace in self._trace_buffers.values() if not isinstance(trace.buffer, np.memmap))
+        motors = sys.getsizeof(self.motors) + sum(sys.getsizeof(p) for p in self.motors)
+        return traces + motors + sys.getsizeof(self.avaT) + self.fp_left.nbytes + self.random._uniform.nbytes
+
     def __repr__(self):
         string = 'Cell of length %s microns and populated by %d motors' % (self.L, self.N)
         return string
 
 
 class Motor:
-    instances = [] #list of motors
+    instances = None #set to a weakref.WeakSet() to keep track of every motor made, see Cell.cells
+    __slots__ = ('pos', 'state', 'cell', 'index', '__weakref__') #no per-motor __dict__, a cell has hundreds of motors
 
-    def __init__(self, cell):
+    def __init__(self, cell, index=0):
         self.pos = 0 #initial position
         self.state = 'base' #can be 'base', 'IFT', or 'diffusion'
-        Motor.instances.append(self)
+        if Motor.instances is not None:
+            Motor.instances.add(self)
         self.cell = cell
-        self.track = np.zeros(self.cell.num_of_timesteps) #position over time
+        self.index = index #which motor of the cell this is
         #self.activetrack = np.zeros(self.cell.t) #tracker of when it's in the flagellum
         #self.boundtrack = np.zeros(self.cell.t) #tracker of when it's in IFT
         
 
     def diffuse(self):
+        if self.cell.diffusion == 'first_passage':
+            self.first_passage()
+            return
+        if self.cell.diffusion == 'gaussian':
+            self.gaussian(self.cell.t_step)
+            return
+
         #If its position is great than the base, put it back at the tip. This can happen if its at the tip and then the flagellum decays.
         if self.pos > self.cell.L:  # for length decay
             self.pos = self.cell.L
@@ -256,7 +1618,7 @@ class Motor:
 
         #If it is not at the tip, change its position randomly left or right
         else:
-            r=np.random.rand() #pick a random number between zero and one
+            r=self.cell._step_random[self.index, 0] #this motor's random number between zero and one for this step, see Cell._draw_step
             if r<.5: #if it's less than .5, decrease its position by the amount predicted by its diffusion coefficient
                 self.pos -= self.cell.rms_disp
             else: #otherwise, increase its position
@@ -274,6 +1636,24 @@ class Motor:
             self.state = 'base'  # keep this for later, using avalanche model
 
 
+    #diffusion='first_passage': instead of a step, use up one step of the trip back to the base drawn at the tip
+    def first_passage(self):
+        cell = self.cell
+        cell.fp_left[self.index] -= cell._first_passage_rate(cell.L)
+        if cell.fp_left[self.index] <= 0:
+            self.pos = 0
+            self.state = 'base'
+        else:
+            self.pos = np.nan
+
+    #diffusion='gaussian': diffuse for tau seconds by a Brownian step, see gaussian_step
+    def gaussian(self, tau):
+        cell = self.cell
+        u = cell._step_random[self.index:self.index+1] #this motor's three numbers for this step
+        self.pos = gaussian_step(np.array([min(self.pos, cell.L)]), cell.L, tau, cell.D, u).item()
+        if self.pos <= 0:
+            self.state = 'base'
+
     #Method for IFT, or active transport
     def IFT(self):
         if self.pos < self.cell.L: #if it is not yet at the tip
@@ -281,9 +1661,14 @@ class Motor:
             #self.pos = min(self.pos, self.cell.L) #make sure it is not past the tip
         #         if self.pos == self.cell.L:
         if self.pos >= self.cell.L: #if it arrives at the tip, lengthen the flagellum
+            left = min(self.pos - self.cell.L, self.cell.t_step*self.cell.v)/self.cell.v #time left in this step after reaching the tip
             self.cell.L += self.cell.build_size
             self.state = 'diffusion'
             self.pos = self.cell.L #in case it goes past the length, put it at the tip
+            if self.cell.diffusion == 'first_passage':
+                self.cell.fp_left[self.index] = first_passage_from_uniform(self.cell._step_random[self.index, 0]) #how long the trip back to the base will take
+            elif self.cell.diffusion == 'gaussian':
+                self.gaussian(left)
         #         self.track.append(self.pos)
 
     # #In case you want motors to be able to stick and get unstuck
@@ -303,6 +1688,13 @@ class Motor:
             #                 print('unbound!')
 
             #         return self.isbound #return the updated bound state
+    #position over time. A view of the cell's tracks array, or zeros for the engines that don't record tracks
+    @property
+    def track(self):
+        if self.cell.engine in NO_TRACKS:
+            return np.zeros(len(self.cell.tracks))
+        return self.cell.tracks[:,self.index]
+
     #plot motor's position over time
     def trace(self):
         plt.plot(self.track);
@@ -3,25 +3,37 @@ import numpy as np
 # import matplotlib.pyplot as plt
 import scipy.stats as st
 # import random
+import inspect
+import sys
 import time
 
+from ift_diffusion_model_nlh import STATES, GrowableTrace, Histograms, RandomStream, SimFuture, SteadyState, write_checkpoint, read_checkpoint
+
 
 '''
 The difference between this simulation and the single-flagellum simulation is that this one simulated two flagella. It does this by keeping track of each flagellum separately.
 In each time step, each flagellum goes through the simulation process including a potential injection event. They share a common pool of material, the variable "tubulin".
 When a motor is injected, the amount of tubulin it takes with it is proportional (through the constant k_tub) to the remaining tubulin in the pool (tubulin-L0-L1).
-A potential advancement of this program would be to generalize it to any number of flagella. I was more interested in just the two-flagellum case, so I hard coded in two.
+It was written for two flagella but now works for any number (num_flagella). Lengths are kept in the array L, one entry per flagellum, and each motor
+belongs to one flagellum. L0, L1, L0_trace and L1_trace still work for the first two flagella.
 
 The mechanics of this program are an extention of the simulation in ift_diffusion_model_nlh.py. That file has a more complete description in the comments on how it works.
 This essentially does the same task but with two flagella that share building material from a common pool.l
 
+Like the single-flagellum file, there are two engines. engine='vector' (default) keeps the motors in numpy arrays and updates all motors of all
+flagella at once, so the cost of a time step doesn't grow with one Python branch per flagellum per motor. engine='object' loops over the Motor
+objects like the original program. They give the same results for the same random numbers.
+
 Also, this uses an old naming scheme for variables, sorry for the confusion. The motor's property isactive means if it is in the flagellum, and isbound means if it is bound to the axoneme.
 So if a motor is active and bound, it is in IFT. If it is active and not bound, it is in diffusion. If it is not active, it is in the base. I cleaned this up to be clearer in the one-flagellum 
 file but not here.
 '''
 
+ENGINES = ('vector', 'object')
+
 class Cell:
-    cells = []
+    cells = None #set to a weakref.WeakSet() to keep track of every cell made, as in ift_diffusion_model_nlh.py
+    _stop = False #set on a cell to make sim stop after the time step it is in, see SimFuture in ift_diffusion_model_nlh.py
 
     # def __init__(self, t=0, L=0, N=200, trans_speed=1.8 / 10, k_on=.2, k_off=.2,
     #              avalanche_on=True, thresh=5, num_release=5,
@@ -31,16 +43,58 @@ class Cell:
     def __init__(self, t=20000, L0=0, L1=0, N=400, trans_speed=2, k_on=0, k_off=0,
              avalanche_on=True, thresh=30, num_release=5,
              L_mod=True, build_size=.003, decay_size=.01, D=1.75, ava_power=2.85, ava_const=1, retro=False,
-             L_hog=0,ss=False, t_step=.1, num_flagella=2, tubulin=30, k_tub = .000125):  # L is length, N is number of particles
-
+             L_hog=0,ss=False, t_step=.1, num_flagella=2, tubulin=30, k_tub = .000125, L=None, engine='vector', track_motors=False, seed=None, histograms=False,
+             ss_window=1000, ss_eps=5e-6):  # L is length, N is number of particles
+
+        '''
+        t is the number of time steps here, not seconds. Parameters are the same as the single-flagellum Cell, plus:
+        num_flagella: number of flagella sharing the tubulin pool. The N motors are split evenly between them.
+        L0, L1: starting lengths of the first two flagella
+        L: starting lengths of all flagella, a number or one value per flagellum. Overrides L0 and L1.
+        tubulin: total amount of tubulin in the cell, in the flagella, in IFT, or in the pool
+        k_tub: each injected motor carries k_tub*(tubulin left in the pool) of cargo
+        engine: 'vector' (default) or 'object', see the description at the top of this file
+        track_motors: if True, record each motor's position (track), whether it's in the flagellum (activetrack) and whether it's in IFT (boundtrack)
+                at every time step. Needed for distr(). Off by default because it takes a lot of memory.
+        ss: if True, keep simulating after the first t time steps until the first time step where every flagellum is steady: a straight-line
+                fit to its last ss_window seconds of length has a slope below ss_eps microns per time step (SteadyState in ift_diffusion_model_nlh.py,
+                updated every time step)
+        ss_window, ss_eps: the steady-state test used with ss=True
+        seed: seed of the cell's random numbers (cell.random, see RandomStream in ift_diffusion_model_nlh.py). The same seed gives the same run.
+        histograms: if True (or a number of density bins), collect avalanche sizes, the density of diffusing motors along each flagellum and
+                the number of motors in each state as the cell runs, one row per flagellum, in cell.histograms (see Histograms in
+                ift_diffusion_model_nlh.py). Much lighter than track_motors and distr() for the spatial profile.
+
+        save_checkpoint and Cell.load_checkpoint save a run and pick it up again exactly where it stopped, as in the single-flagellum Cell.
+        fork() starts new runs, e.g. cut() experiments, from the state a cell has reached.
+        Cell.start(...) makes the cell in the background instead, with progress and cancellation, see SimFuture in ift_diffusion_model_nlh.py.
+        '''
+
+        self.params = {k: v for k, v in locals().items() if k != 'self'} #the arguments the cell was made with, for save_checkpoint
+
+        if engine not in ENGINES:
+            raise ValueError('engine must be one of %s, not %r' % (ENGINES, engine))
+        self.engine = engine
+        self.random = RandomStream(seed)
         self.t = t
-        self.L0 = L0
-        self.L1 = L1
+        self.num_flagella = num_flagella
+        if L is None:
+            L = [L0, L1][:num_flagella] + [0]*(num_flagella-2)
+        self.L = np.zeros(num_flagella) + L #length of each flagellum
         # self.trans_speed = trans_speed
         self.k_on = k_on
         self.k_off = k_off
         self.N = N
-        self.motors = [Motor(self, flagellum=round(i/(N-1))) for i in range(N)] #this line distributes the motors evenly between the two flagella
+        self.track_motors = track_motors
+        if track_motors:
+            self.tracks = np.zeros((t, N)) #column j is motors[j].track
+            self.activetracks = np.zeros((t, N), dtype=bool)
+            self.boundtracks = np.zeros((t, N), dtype=bool)
+            self._trace_buffers = dict(tracks=GrowableTrace(self.tracks), activetracks=GrowableTrace(self.activetracks),
+                                       boundtracks=GrowableTrace(self.boundtracks))
+        self.motors = [Motor(self, flagellum=i*num_flagella//N, index=i) for i in range(N)] #this line distributes the motors evenly between the flagella
+        if Cell.cells is not None:
+            Cell.cells.add(self)
         self.ava_power=ava_power
         self.ava_const = ava_const
         # self.wholecell = wholecell
@@ -56,13 +110,17 @@ class Cell:
         # self.rms_disp = rms_disp
         self.ava_power = ava_power
         self.ava = []
+        self.released = np.zeros(num_flagella, dtype=int) #motors injected into each flagellum in the last avalanche step
+        self._avalanches = None #a list that gets a copy of released every time step, only while run_iter collects them for its snapshots
+        self.histograms = Histograms(N, 50 if histograms is True else histograms, num_flagella) if histograms else None
         # self.avaT = np.zeros(t, num_flagella)
         # self.avaT=[]
         self.D = D # 1.75 from Alex Chien and Ahmet Yildiz
         self.L_hog = L_hog #hand of god -- change length manually
 
-        self.L0_trace = np.zeros(t)
-        self.L1_trace = np.zeros(t)
+        self.L_trace = np.zeros((t, num_flagella)) #column f is the length of flagellum f over time
+        self._L_trace_buffer = GrowableTrace(self.L_trace) #so extend() doesn't copy the whole history every time
+        self._released = False #set by release()
         # self.flux = np.zeros(t)
         # self.base = np.zeros(t)
         # self.N_diffuse = np.zeros(t)
@@ -70,7 +128,9 @@ class Cell:
 
         self.retro=retro
         self.current_time=0
+        self._step0 = 0 #time step recorded in row 0 of the traces. Only run_iter changes it, for its short buffers
         self.ss=ss
+        self.steady = [SteadyState(int(ss_window/t_step), ss_eps) for _ in range(num_flagella)] if ss else None #one test per flagellum
 
         self.t_step = t_step #s
 
@@ -91,11 +151,13 @@ class Cell:
 
         if t:
             self.sim(self.t)
+            if self._stop: #stopped early (SimFuture.cancel): keep only the steps that were run
+                self._trim_traces()
 
             if self.ss:
-                while not self.is_steadystate():
+                while not self._stop and not all(test.steady for test in self.steady):
                     # print('not ss')
-                    self.extend(int(500/self.t_step))
+                    self.extend(int(500/self.t_step), until_steady=True) #keep simulating, but stop at the first steady time step
             # self.time2ss = np.argmax(self.L_trace>(self.L-.1))
             # self.L=np.mean(self.L_trace[-3000:])
             # self.time2ss = np.argmax(self.L_trace>self.L)*self.t_step
@@ -109,31 +171,128 @@ class Cell:
 
 
 
+    #Lengths of the first two flagella, the names used before this worked for any number of flagella
+    @property
+    def L0(self):
+        return self.L[0]
+
+    @L0.setter
+    def L0(self, value):
+        self.L[0] = value
+
+    @property
+    def L1(self):
+        return self.L[1]
+
+    @L1.setter
+    def L1(self, value):
+        self.L[1] = value
+
+    @property
+    def L0_trace(self):
+        return self.L_trace[:,0]
+
+    @property
+    def L1_trace(self):
+        return self.L_trace[:,1]
+
     def cut(self, flagellum=1):
-        if flagellum==0:
-            self.L0 = 0
-        if flagellum==1:
-            self.L1 = 0
+        self.L[flagellum] = 0
         self.extend(20000)
 
 
     def count_active(self):
         return sum([p.isactive for p in self.motors])
 
-    def extend(self,extend_time):
+    #With until_steady (needs ss=True), stop as soon as every flagellum is steady and shorten the traces to the steps that were run.
+    def extend(self,extend_time,until_steady=False):
+        self._check_released()
         # self.avaT = np.concatenate((self.avaT,np.zeros(extend_time)))
-        self.L0_trace = np.concatenate((self.L0_trace,np.zeros(extend_time-1)))
-        self.L1_trace = np.concatenate((self.L1_trace,np.zeros(extend_time-1)))
+        self.L_trace = self._L_trace_buffer.grow(extend_time-1)
         # self.flux = np.concatenate((self.flux,np.zeros(extend_time-1,num_flagella)))
         # self.base = np.concatenate((self.base,np.zeros(extend_time-1,num_flagella)))
         # self.N_diffuse = np.concatenate((self.N_diffuse,np.zeros(extend_time-1,num_flagella)))
         # self.avaT = np.concatenate((self.avaT,np.zeros(extend_time-1,num_flagella)))
-        for p in self.motors:
-            p.track = np.concatenate((p.track,np.zeros(extend_time-1)))
-            p.activetrack = np.concatenate((p.activetrack,np.zeros(extend_time-1)))
-            p.boundtrack = np.concatenate((p.boundtrack,np.zeros(extend_time-1)))
+        if self.track_motors:
+            self.tracks = self._trace_buffers['tracks'].grow(extend_time-1)
+            self.activetracks = self._trace_buffers['activetracks'].grow(extend_time-1)
+            self.boundtracks = self._trace_buffers['boundtracks'].grow(extend_time-1)
+            for p in self.motors:
+                p.bind_tracks()
         # self.sim(self=self,t=extend_time,start=self.t)
-        self.sim(self.current_time+extend_time,start=self.current_time)
+        self.sim(self.current_time+extend_time,start=self.current_time,until_steady=until_steady)
+        self._trim_traces()
+
+    #Shorten the traces to the time steps up to current_time, after a run that stopped early
+    def _trim_traces(self):
+        rows = self.current_time + 1
+        if rows < len(self.L_trace):
+            self.L_trace = self._L_trace_buffer.truncate(rows)
+            if self.track_motors:
+                self.tracks = self._trace_buffers['tracks'].truncate(rows)
+                self.activetracks = self._trace_buffers['activetracks'].truncate(rows)
+                self.boundtracks = self._trace_buffers['boundtracks'].truncate(rows)
+                for p in self.motors:
+                    p.bind_tracks()
+
+    #Run the cell on from where it is, chunk time steps at a time, as a generator that yields a snapshot (a small dictionary) after each chunk.
+    #Same as run_iter in ift_diffusion_model_nlh.py: nothing is kept between chunks unless record is True, so an unbounded run takes constant memory.
+    #steps: number of time steps to run, or None to go on until the caller stops
+    #record: if True, L_trace (and the motor tracks with track_motors) grow as with extend(). Otherwise the steps leave no history.
+    #positions: also put the motor positions and flagella at the end of each chunk in the snapshots
+    #Each snapshot has:
+    #    step: the last time step run
+    #    L: lengths after it, one per flagellum
+    #    lengths: L_trace for the time steps of the chunk (with L_mod)
+    #    avalanches: size of the avalanche at every time step of the chunk, one row per time step and one column per flagellum
+    #    counts: number of motors in each state after the chunk, by state name, one number per flagellum
+    #    pos, flagellum: motor positions and the flagellum of each motor, only with positions=True
+    #L_hog changes the lengths halfway to current_time + steps, as extend() would, and not at all when steps is None.
+    def run_iter(self, steps=None, chunk=1, positions=False, record=False):
+        self._check_released()
+        i, end = self.current_time, None if steps is None else self.current_time + steps
+        half = -1 if end is None else np.floor(end/2) #L_hog acts once, halfway through the whole run, not in every chunk
+        names = ('tracks', 'activetracks', 'boundtracks') if self.track_motors else ()
+        if not record:
+            saved = self.L_trace, [getattr(self, name) for name in names]
+            buffer = np.zeros((chunk, self.num_flagella))
+            track_buffers = [np.zeros((chunk, self.N), dtype=getattr(self, name).dtype) for name in names]
+        try:
+            while end is None or i < end:
+                n = chunk if end is None else min(chunk, end - i)
+                if record:
+                    rows = i + n - len(self.L_trace)
+                    self.L_trace = self._L_trace_buffer.grow(rows)
+                    for name in names:
+                        setattr(self, name, self._trace_buffers[name].grow(rows))
+                    first = i
+                else:
+                    self._step0, first = i, 0
+                    self.L_trace = buffer[:n]
+                    for name, b in zip(names, track_buffers):
+                        setattr(self, name, b[:n])
+                for p in self.motors:
+                    p.bind_tracks()
+                self._avalanches = []
+                self.sim(i+n, start=i, half=half)
+                i += n
+                m = self._gather_motors()
+                counts = self._state_counts(m['isactive'], m['isbound'], m['flagellum'])
+                snap = dict(step=i-1, L=self.L.copy(), lengths=np.array(self.L_trace[first:]),
+                            avalanches=np.array(self._avalanches, dtype=int).reshape(-1, self.num_flagella), counts=dict(zip(STATES, counts.T.tolist())))
+                if positions:
+                    snap['pos'], snap['flagellum'] = m['pos'], m['flagellum']
+                yield snap
+        finally:
+            self._avalanches = None
+            if not record:
+                self.L_trace, tracks = saved
+                for name, trace in zip(names, tracks):
+                    setattr(self, name, trace)
+                for p in self.motors:
+                    p.bind_tracks()
+                self._step0 = 0
+
     #
     # def is_steadystate(self,fit_range=1000, eps=5e-6):
     #     fit_range = int(fit_range/self.t_step)
@@ -145,42 +304,48 @@ class Cell:
 
         # return abs(slope)<eps
 
+    #positions of the diffusing motors at a time step. Needs track_motors=True
     def distr(self,time=None):
         if time == None:
             time = self.current_time
         return [p.track[time] for p in self.motors if (p.activetrack[time] and not p.boundtrack[time])]
 
-    # def sim(self, t):
-    def sim(self,t,start=0):
+    #Run the simulation from time step start up to time step t, using whichever engine the cell was made with
+    #Run time steps start up to t with the cell's engine. Either engine stops after the time step it is in once self._stop is set, and with
+    #until_steady, after the first time step where the steady-state test of every flagellum (self.steady) passes.
+    #half: the time step where L_hog changes the lengths, by default halfway to t. run_iter gives the halfway step of all its chunks.
+    def sim(self,t,start=0,until_steady=False,half=None):
+        self._hog_step = np.floor(t/2) if half is None else half
+        if self.engine == 'vector':
+            self._sim_vector(t,start,until_steady)
+        else:
+            self._sim_object(t,start,until_steady)
+
+    #Length decay of every flagellum. A flagellum shorter than one decay step goes to zero instead of negative.
+    def decay_step(self):
+        self.L[:] = np.where(self.L >= self.decay_size, self.L - self.decay_size, 0)
+
+    # Object engine: one method call per motor per time step
+    def _sim_object(self,t,start=0,until_steady=False):
         # t_step = .1 #s
         # self.rms_disp = (2*self.D*t_step)**.5 #um
         # self.rms_disp /= 10 #update to account for 1/10 s simulation JK I was multiplying by t_step
         for i in range(start,t):
             self.current_time=i
-            if i==np.floor(t/2) and self.L_hog:
+            if i==self._hog_step and self.L_hog:
                 self.L *= self.L_hog
 
 
             #         print(self.count_active())
             if self.avalanche_on:
                 self.avalanche()
+                if self._avalanches is not None:
+                    self._avalanches.append(self.released.copy())
 
             if self.L_mod:
-                if self.L0 >= self.decay_size:
-                    self.L0 -= self.decay_size
-
-                if self.L1 >= self.decay_size:
-                    self.L1 -= self.decay_size
-
-                # new may 27
-                elif self.L0 < self.decay_size:
-                    self.L0 = 0
-
-                elif self.L1 < self.decay_size:
-                    self.L1 = 0
-
-                self.L0_trace[i] = self.L0
-                self.L1_trace[i] = self.L1
+                self.decay_step()
+                self.L_trace[i - self._step0] = self.L
+            steady = self.steady is not None and all([test.update(L) for test, L in zip(self.steady, self.L)]) #every test updated
 
             for p in self.motors:
 
@@ -190,75 +355,215 @@ class Cell:
                     else:
                         p.diffuse()
 
-                # p.track[i] = p.pos
-                # p.activetrack[i]=p.isactive
-                # p.boundtrack[i]=p.isbound
+                if self.track_motors:
+                    p.track[i - self._step0] = p.pos
+                    p.activetrack[i - self._step0]=p.isactive
+                    p.boundtrack[i - self._step0]=p.isbound
+
+            if self.histograms:
+                m = self._gather_motors()
+                diffusing = m['isactive'] & ~m['isbound']
+                self.histograms.update(self.released, self._state_counts(m['isactive'], m['isbound'], m['flagellum']), m['pos'][diffusing],
+                                       self.L, m['flagellum'][diffusing])
+
+            if (steady and until_steady) or self._stop:
+                break
 
             # self.flux[i] = sum([1 for j in self.motors if (j.pos < 1 and j.isbound and j.isactive)])
             # self.base[i]= sum([1 for j in self.motors if not j.isactive])
             # self.N_diffuse[i] = sum([j.isactive and not j.isbound for j in self.motors])
             # self.track_active[i] = self.count_active()
 
+    #Vector engine: same time step as _sim_object, but the motors of every flagellum are in numpy arrays and updated all at once.
+    #As in the single-flagellum file, a motor reaching the tip lengthens its flagellum for the motors after it in the list. Tip arrivals (only motors
+    #within one IFT step of the tip) go through a short loop in motor order, and each diffusing motor then sees the length the object engine would show it.
+    def _sim_vector(self,t,start=0,until_steady=False):
+        m = self._gather_motors()
+        pos, isactive, isbound, flagellum, built, cargo = m['pos'], m['isactive'], m['isbound'], m['flagellum'], m['built'], m['build_size']
+
+        for i in range(start,t):
+            self.current_time=i
+            if i==self._hog_step and self.L_hog:
+                self.L *= self.L_hog
+
+            if self.avalanche_on:
+                self._avalanche_vector(m)
+                if self._avalanches is not None:
+                    self._avalanches.append(self.released.copy())
+
+            if self.L_mod:
+                self.decay_step()
+                self.L_trace[i - self._step0] = self.L
+            steady = self.steady is not None and all([test.update(L) for test, L in zip(self.steady, self.L)]) #every test updated
+
+            L = self.L
+            L_start = L.copy()
+            diffusing = (isactive & ~isbound).nonzero()[0] #motors that diffuse this step. Motors that reach the tip this step start diffusing next step.
+
+            #IFT. Motors that can't reach the tip this step just move forward, the rest go through the tip in motor order.
+            ift = (isactive & isbound).nonzero()[0]
+            #shortest each flagellum can get this step. Cargo is negative when the pool is used up, and then builds shorten the flagellum.
+            unbuilt = ift[~built[ift]]
+            L_min = L + np.bincount(flagellum[unbuilt], np.minimum(cargo[unbuilt], 0), minlength=self.num_flagella)
+            reach = pos[ift] + self.trans_speed >= L_min[flagellum[ift]]
+            pos[ift[~reach]] += self.trans_speed
+            arrived, L_after = self._tip_arrivals(ift[reach], m)
+
+            #Diffusion. Each motor sees the length left by the last tip arrival earlier in the motor list on its own flagellum.
+            L_seen = L_start[flagellum[diffusing]]
+            if len(arrived):
+                key = flagellum[arrived]*self.N + arrived #sort arrivals by flagellum, then motor
+                order = np.argsort(key)
+                last = np.searchsorted(key[order], flagellum[diffusing]*self.N + diffusing) - 1 #last arrival before each diffusing motor in this sort order...
+                same = (last >= 0) & (flagellum[arrived[order[last]]] == flagellum[diffusing]) #...if it's on the same flagellum
+                L_seen[same] = L_after[order[last[same]]]
+            x = np.minimum(pos[diffusing], L_seen) # for length decay
+            at_tip = x == L_seen
+            walk = ~at_tip
+            x[at_tip] -= self.rms_disp
+            r = self.random.rand(np.count_nonzero(walk)) #one random number per motor not at the tip, in the order the object engine draws them
+            step = np.where(r < .5, x[walk] - self.rms_disp, x[walk] + self.rms_disp)
+            x[walk] = np.where(step < 0, 0, np.minimum(step, L_seen[walk])) #between 0 and the length, 0 wins if the length went negative
+            pos[diffusing] = x
+            isactive[diffusing[x <= 0]] = False
+
+            if self.histograms:
+                diffusing = (isactive & ~isbound).nonzero()[0]
+                self.histograms.update(self.released, self._state_counts(isactive, isbound, flagellum), pos[diffusing], self.L, flagellum[diffusing])
+
+            if self.track_motors:
+                self.tracks[i - self._step0] = pos
+                self.activetracks[i - self._step0] = isactive
+                self.boundtracks[i - self._step0] = isbound
+
+            if (steady and until_steady) or self._stop:
+                break
+
+        self._scatter_motors(m)
+
+    #Tip arrivals for the vector engine. reach are the IFT motors, in motor order, that might get to the tip this step.
+    #Going through them in motor order, each one moves, and if it gets to the tip it builds (once per trip) and starts diffusing. A build makes the
+    #flagellum longer for the motors after it, so one motor can stop the next from arriving. This starts by assuming they all arrive, computes the
+    #length each one would see with running sums along each flagellum, and then fixes the first motor on each flagellum that wouldn't make it,
+    #until nothing changes. Usually that is zero or one round.
+    #Returns the motors that arrived and the length of their flagellum right after each arrival.
+    def _tip_arrivals(self, reach, m):
+        pos, isbound, flagellum, built, cargo = m['pos'], m['isbound'], m['flagellum'], m['built'], m['build_size']
+        L = self.L
+        if not len(reach):
+            return reach, np.zeros(0)
+
+        #put the motors in a table: one row per flagellum, motors in order along the row
+        reach = reach[np.argsort(flagellum[reach], kind='stable')]
+        group, row = np.unique(flagellum[reach], return_inverse=True)
+        rank = np.arange(len(reach)) - np.searchsorted(row, row)
+        builds = np.zeros((len(group), rank.max()+2))
+        builds[:,0] = L[group]
+        x = pos[reach]
+
+        arrives = np.ones(len(reach), dtype=bool)
+        while True:
+            builds[row, rank+1] = np.where(arrives & ~built[reach], cargo[reach], 0)
+            lengths = np.add.accumulate(builds, axis=1) #left to right along each row, the same additions a loop over the motors would do
+            L_before = lengths[row, rank]
+            bad = arrives & (x + self.trans_speed < L_before)
+            if not bad.any():
+                break
+            first_bad = bad.nonzero()[0][np.unique(row[bad], return_index=True)[1]] #first motor on each flagellum that doesn't make it
+            arrives[first_bad] = False
+
+        pos[reach] = np.where(arrives, np.maximum(x, L_before), x + self.trans_speed)
+        arrived = reach[arrives]
+        new_build = np.sort(arrived[~built[arrived]])
+        if len(new_build):
+            self.tubulin_in_IFT = np.subtract.reduce(np.concatenate(([self.tubulin_in_IFT], cargo[new_build]))) #one motor at a time, in motor order
+        built[arrived] = True
+        isbound[arrived] = False
+        L[group] = lengths[:,-1]
+        return arrived, lengths[row, rank+1][arrives]
+
+    #Copy the Motor objects' attributes into arrays for the vector engine
+    def _gather_motors(self):
+        return dict(pos=np.array([p.pos for p in self.motors], dtype=float),
+                    isactive=np.array([p.isactive for p in self.motors], dtype=bool),
+                    isbound=np.array([p.isbound for p in self.motors], dtype=bool),
+                    flagellum=np.array([p.flagellum for p in self.motors], dtype=int),
+                    built=np.array([p.built for p in self.motors], dtype=bool),
+                    build_size=np.array([p.build_size for p in self.motors], dtype=float))
+
+    #Number of motors in each state (column, as in STATES) on each flagellum (row)
+    def _state_counts(self, isactive, isbound, flagellum):
+        state = np.where(isactive, np.where(isbound, 1, 2), 0)
+        return np.bincount(flagellum*len(STATES) + state, minlength=self.num_flagella*len(STATES)).reshape(self.num_flagella, -1)
+
+    #Copy the vector engine's arrays back into the Motor objects
+    def _scatter_motors(self, m):
+        for j, p in enumerate(self.motors):
+            p.pos = m['pos'][j].item()
+            p.isactive = m['isactive'][j].item()
+            p.isbound = m['isbound'][j].item()
+            p.built = m['built'][j].item()
+            p.build_size = m['build_size'][j].item()
+
+    #How much cargo each motor injected now takes: proportional to the tubulin left in the pool
+    def cargo_size(self):
+        return self.k_tub * (self.tubulin - self.L.sum() - self.tubulin_in_IFT)
+
     def avalanche(self):
         # distr = floor(1/np.random.power(self.ava_power))
 
-        # num_inactive = self.N - self.count_active()
-        inactive0 = [p for p in self.motors if ((not p.isactive) and p.flagellum==0)]
-        num_inactive0 = len(inactive0)
-
-        inactive1 = [p for p in self.motors if ((not p.isactive) and p.flagellum==1)]
-        num_inactive1 = len(inactive1)
-        
         cargo_this_tstep = 0
-        
-        if num_inactive0 > self.thresh:
-            #             release = min(floor(1/np.random.power(3)),num_inactive)
-            # distr = int(5 * np.random.weibull(1) + 1)  # parameters are totally arbitrary
-            distr0 = int((num_inactive0-self.thresh+10) * np.random.weibull(self.ava_power) + self.ava_const)
-            release0 = min(distr0, num_inactive0)
-            # release = num_inactive #big avalanches
-            # self.ava.append(release)
-            # self.avaT.append(release)
-            # self.avaT[self.current_time]=release
-
-            for i in range(release0):  # commented out to try power law
-                #             for i in range(1/np.random.power(3))
-                inactive0[i].isactive = True
-                inactive0[i].isbound = True
-                inactive0[i].build_size = self.k_tub * (self.tubulin - self.L0 - self.L1 - self.tubulin_in_IFT)
-                cargo_this_tstep += inactive0[i].build_size
-
-                if self.L_mod:
-                    inactive0[i].built = False
-            # self.recruited += self.num_release
-
-        # else:
-            # self.avaT[self.current_time]=0
-            # self.avaT.append(0)
-
-
-        if num_inactive1 > self.thresh:
-            #             release = min(floor(1/np.random.power(3)),num_inactive)
-            # distr = int(5 * np.random.weibull(1) + 1)  # parameters are totally arbitrary
-            distr1 = int((num_inactive1-self.thresh+10) * np.random.weibull(2.85) + 1)
-            release1 = min(distr1, num_inactive1)
-            # release = num_inactive #big avalanches
-            # self.ava.append(release)
-            # self.avaT.append(release)
-            # self.avaT[self.current_time]=release
-
-            for i in range(release1):  # commented out to try power law
-                #             for i in range(1/np.random.power(3))
-                inactive1[i].isactive = True
-                inactive1[i].isbound = True
-                inactive1[i].build_size = self.k_tub * (self.tubulin - self.L0 - self.L1 - self.tubulin_in_IFT)
-                cargo_this_tstep += inactive1[i].build_size
-
-                if self.L_mod:
-                    inactive1[i].built = False
-                    
+        cargo = self.cargo_size() #every motor injected this time step takes the same amount, the pool is updated after all of them are injected
+        self.released[:] = 0
+
+        for f in range(self.num_flagella):
+            inactive = [p for p in self.motors if ((not p.isactive) and p.flagellum==f)]
+            num_inactive = len(inactive)
+
+            if num_inactive > self.thresh:
+                #             release = min(floor(1/np.random.power(3)),num_inactive)
+                # distr = int(5 * np.random.weibull(1) + 1)  # parameters are totally arbitrary
+                distr = int((num_inactive-self.thresh+10) * self.random.weibull(self.ava_power) + self.ava_const)
+                release = min(distr, num_inactive)
+                self.released[f] = release
+                # release = num_inactive #big avalanches
+
+                for i in range(release):  # commented out to try power law
+                    inactive[i].isactive = True
+                    inactive[i].isbound = True
+                    inactive[i].build_size = cargo
+                    cargo_this_tstep += cargo
+
+                    if self.L_mod:
+                        inactive[i].built = False
+
         self.tubulin_in_IFT += cargo_this_tstep #this keeps track of how much tubulin is currently in IFT. This way the tubulin pool is changed when the motor is injected, not when the cargo is deposited at the tip.
 
+    #Avalanching for the vector engine. Same as avalanche() for all flagella at once.
+    def _avalanche_vector(self, m):
+        inactive = (~m['isactive']).nonzero()[0]
+        inactive = inactive[np.argsort(m['flagellum'][inactive], kind='stable')] #grouped by flagellum, in motor order within each flagellum
+        num_inactive = np.bincount(m['flagellum'][inactive], minlength=self.num_flagella)
+        ava = (num_inactive > self.thresh).nonzero()[0] #flagella that avalanche this step
+        self.released[:] = 0
+        if not len(ava):
+            return
+        distr = ((num_inactive[ava]-self.thresh+10) * self.random.weibull(self.ava_power, len(ava)) + self.ava_const).astype(int)
+        release = np.zeros(self.num_flagella, dtype=int)
+        release[ava] = np.minimum(distr, num_inactive[ava])
+        self.released[:] = release
+        group_start = np.cumsum(num_inactive) - num_inactive
+        rank = np.arange(len(inactive)) - group_start[m['flagellum'][inactive]] #place of each inactive motor in its flagellum's line
+        injected = inactive[rank < release[m['flagellum'][inactive]]]
+
+        cargo = self.cargo_size()
+        m['isactive'][injected] = True
+        m['isbound'][injected] = True
+        m['build_size'][injected] = cargo
+        if self.L_mod:
+            m['built'][injected] = False
+        self.tubulin_in_IFT += sum([cargo]*len(injected)) #added one motor at a time, like avalanche()
+
     # def L_plot(self):
     #     plt.plot(self.L0_trace)
     #     plt.plot(self.L1_trace)
@@ -266,100 +571,191 @@ class Cell:
     #     plt.ylabel('length')
     #     plt.show()
 
+    #Save everything needed to go on with this run to a checkpoint file at path: the arguments the cell was made with, lengths, tubulin in IFT,
+    #motors, recorded traces, random numbers and histograms so far. See write_checkpoint in ift_diffusion_model_nlh.py for the format.
+    def save_checkpoint(self, path):
+        self._check_released()
+        random_state, uniform = self.random.state
+        meta = dict(params=dict(self.params, seed=None), t=self.t, current_time=self.current_time, tubulin_in_IFT=self.tubulin_in_IFT,
+                    random=random_state)
+        arrays = dict(L=self.L, L_trace=self.L_trace, uniform=uniform, **self._gather_motors())
+        if self.track_motors:
+            arrays.update(tracks=self.tracks, activetracks=self.activetracks, boundtracks=self.boundtracks)
+        if self.steady is not None:
+            states = [test.state for test in self.steady]
+            meta['steady'], arrays['steady_lengths'] = [sums for sums, _ in states], np.array([lengths for _, lengths in states])
+        if self.histograms is not None:
+            meta['histogram_steps'], counts = self.histograms.state
+            arrays.update(('histogram_' + name, counts[name]) for name in counts)
+        write_checkpoint(path, meta, arrays)
+
+    #Make the cell saved in the checkpoint file at path by save_checkpoint, ready to go on where it stopped
+    @classmethod
+    def load_checkpoint(cls, path):
+        meta, arrays = read_checkpoint(path)
+        cell = cls(**dict(meta['params'], t=0)) #t=0: make the cell without running it
+        cell.t, cell.current_time, cell.tubulin_in_IFT = meta['t'], meta['current_time'], meta['tubulin_in_IFT']
+        cell.L = arrays['L']
+        cell.L_trace = arrays['L_trace']
+        cell._L_trace_buffer = GrowableTrace(cell.L_trace)
+        if cell.track_motors:
+            cell.tracks, cell.activetracks, cell.boundtracks = arrays['tracks'], arrays['activetracks'], arrays['boundtracks']
+            cell._trace_buffers = dict(tracks=GrowableTrace(cell.tracks), activetracks=GrowableTrace(cell.activetracks),
+                                       boundtracks=GrowableTrace(cell.boundtracks))
+        for p, f in zip(cell.motors, arrays['flagellum'].tolist()):
+            p.flagellum = f
+            p.bind_tracks()
+        cell._scatter_motors(arrays)
+        cell.random.state = meta['random'], arrays['uniform']
+        if cell.steady is not None:
+            for test, sums, lengths in zip(cell.steady, meta['steady'], arrays['steady_lengths']):
+                test.state = sums, lengths
+        if cell.histograms is not None:
+            cell.histograms.state = meta['histogram_steps'], {name: arrays['histogram_' + name] for name in ('avalanche', 'density', 'occupancy')}
+        return cell
+
+    #A new cell that starts from this cell's lengths, tubulin and motors, without its history, for perturbation experiments, e.g.
+    #    for k in range(100):
+    #        cell.fork(seed=k).cut()
+    #The fork has its own random numbers, from seed or by default spawned from this cell's, and counts its time steps from 0.
+    #changes are constructor arguments that are different in the fork, e.g. D=1. N and num_flagella can't change.
+    def fork(self, seed=None, **changes):
+        self._check_released()
+        if 'N' in changes or 'num_flagella' in changes:
+            raise ValueError('a fork has the same motors and flagella as its cell, N and num_flagella can not change')
+        cell = type(self)(**dict(self.params, t=0, seed=self.random.spawn() if seed is None else seed, **changes))
+        if not {'L', 'L0', 'L1'} & set(changes):
+            cell.L = self.L.copy()
+        cell.tubulin_in_IFT = self.tubulin_in_IFT
+        m = self._gather_motors()
+        for p, f in zip(cell.motors, m['flagellum'].tolist()):
+            p.flagellum = f
+        cell._scatter_motors(m)
+        #one row for time step 0, which extend() runs again
+        cell.L_trace = cell._L_trace_buffer.grow(1)
+        if cell.track_motors:
+            cell.tracks = cell._trace_buffers['tracks'].grow(1)
+            cell.activetracks = cell._trace_buffers['activetracks'].grow(1)
+            cell.boundtracks = cell._trace_buffers['boundtracks'].grow(1)
+            for p in cell.motors:
+                p.bind_tracks()
+        return cell
+
+    #Make Cell(**params) in a background thread and return a SimFuture for it straight away, see start() in ift_diffusion_model_nlh.py
+    @classmethod
+    def start(cls, **params):
+        return cls.submit(None, **params)
+
+    #Same as start(), but run in executor, a concurrent.futures.ThreadPoolExecutor. executor=None starts a new thread.
+    @classmethod
+    def submit(cls, executor, **params):
+        args = inspect.signature(cls).bind(**params)
+        args.apply_defaults()
+        return SimFuture(cls, params, args.arguments['t'], executor)
+
+    #Free the history arrays (L_trace and, with track_motors, the motor tracks). The cell keeps its final state, but extend(), run_iter(),
+    #fork() and save_checkpoint() raise RuntimeError from then on.
+    #Works as a context manager too, see release() in ift_diffusion_model_nlh.py
+    def release(self):
+        self._released = True
+        self.L_trace = np.zeros((0, self.num_flagella))
+        self._L_trace_buffer = None
+        if self.track_motors:
+            self.tracks = np.zeros((0, self.N))
+            self.activetracks = np.zeros((0, self.N), dtype=bool)
+            self.boundtracks = np.zeros((0, self.N), dtype=bool)
+            self._trace_buffers = {}
+            for p in self.motors:
+                p.bind_tracks()
+
+    #extend(), run_iter(), fork() and save_checkpoint() go on from the history that release() frees
+    def _check_released(self):
+        if self._released:
+            raise RuntimeError('cell was released')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    #Bytes of memory the cell holds: history arrays and motors
+    @property
+    def nbytes(self):
+        traces = [self._L_trace_buffer] + (list(self._trace_buffers.values()) if self.track_motors else [])
+        motors = sys.getsizeof(self.motors) + sum(sys.getsizeof(p) for p in self.motors)
+        return sum(trace.buffer.nbytes for trace in traces if trace is not None) + motors + self.random._uniform.nbytes
+
     def __repr__(self):
-        string = 'Cell of lengths %s, %s' %(self.L0,self.L1)
+        string = 'Cell of lengths %s' % ', '.join(str(x) for x in self.L)
         return string
 
 
 class Motor:
-    instances = []
+    instances = None #set to a weakref.WeakSet() to keep track of every motor made
+    __slots__ = ('pos', 'isactive', 'isbound', 'cell', 'index', 'built', 'flagellum', 'build_size', 'track', 'activetrack', 'boundtrack',
+                 '__weakref__')
 
-    def __init__(self, cell, isactive=False, isbound=False, flagellum=0, build_size=.00125):
+    def __init__(self, cell, isactive=False, isbound=False, flagellum=0, build_size=.00125, index=0):
         self.pos = 0
         self.isactive = isactive
         self.isbound = isbound
-        Motor.instances.append(self)
+        if Motor.instances is not None:
+            Motor.instances.add(self)
         self.cell = cell
-        # self.track = np.zeros(self.cell.t)
-        # self.activetrack = np.zeros(self.cell.t)
-        # self.boundtrack = np.zeros(self.cell.t)
+        self.index = index #which motor of the cell this is
+        self.bind_tracks()
         self.built = False
         self.flagellum = flagellum
         self.build_size = build_size
 
-    def diffuse(self):
-        if self.flagellum == 0:
-            if self.pos > self.cell.L0:  # for length decay
-                self.pos = self.cell.L0
-
-            if self.pos == self.cell.L0:
-                if not self.isbound:
-                    self.pos -= self.cell.rms_disp
+    #point track, activetrack and boundtrack at this motor's column of the cell's history arrays, if the cell records them
+    def bind_tracks(self):
+        if self.cell.track_motors:
+            self.track = self.cell.tracks[:,self.index]
+            self.activetrack = self.cell.activetracks[:,self.index]
+            self.boundtrack = self.cell.boundtracks[:,self.index]
 
+    def diffuse(self):
+        L = self.cell.L
+        f = self.flagellum
+        if self.pos > L[f]:  # for length decay
+            self.pos = L[f]
+
+        if self.pos == L[f]:
+            if not self.isbound:
+                self.pos -= self.cell.rms_disp
+
+        else:
+            r=self.cell.random.rand()
+            if r<.5:
+                self.pos -= self.cell.rms_disp
             else:
-                r=np.random.rand()
-                if r<.5:
-                    self.pos -= self.cell.rms_disp
-                else:
-                    self.pos += self.cell.rms_disp
-
-                if self.pos < 0:
-                    self.pos = 0
-                elif self.pos > self.cell.L0:
-                    self.pos = self.cell.L0
-
-            if self.pos <= 0:
-                self.isactive = False  # keep this for later, using avalanche model
-###
-        elif self.flagellum == 1:
-                if self.pos > self.cell.L1:  # for length decay
-                    self.pos = self.cell.L1
-
-                if self.pos == self.cell.L1:
-                    if not self.isbound:
-                        self.pos -= self.cell.rms_disp
-
-                else:
-                    r=np.random.rand()
-                    if r<.5:
-                        self.pos -= self.cell.rms_disp
-                    else:
-                        self.pos += self.cell.rms_disp
+                self.pos += self.cell.rms_disp
 
-                    if self.pos < 0:
-                        self.pos = 0
-                    elif self.pos > self.cell.L1:
-                        self.pos = self.cell.L1
+            if self.pos < 0:
+                self.pos = 0
+            elif self.pos > L[f]:
+                self.pos = L[f]
 
-                if self.pos <= 0:
-                    self.isactive = False  # keep this for later, using avalanche model
+        if self.pos <= 0:
+            self.isactive = False  # keep this for later, using avalanche model
 
     def active_trans(self):
-        if self.flagellum == 0:
-            if self.pos < self.cell.L0:
-                self.pos += self.cell.trans_speed
-                self.pos = min(self.pos, self.cell.L0)
-            #         if self.pos == self.cell.L:
-            if self.pos >= self.cell.L0:
-                if not self.built:
-                    self.cell.L0 += self.build_size
-                    self.built = True
-                    self.cell.tubulin_in_IFT -= self.build_size
-                    # print(self.cell.tubulin_in_IFT)
-                    
-                self.isbound = False
-
-        if self.flagellum == 1:
-            if self.pos < self.cell.L1:
-                self.pos += self.cell.trans_speed
-                self.pos = min(self.pos, self.cell.L1)
-            #         if self.pos == self.cell.L:
-            if self.pos >= self.cell.L1:
-                if not self.built:
-                    self.cell.L1 += self.build_size
-                    self.built = True
-                    self.cell.tubulin_in_IFT -= self.build_size
-                self.isbound = False
+        L = self.cell.L
+        f = self.flagellum
+        if self.pos < L[f]:
+            self.pos += self.cell.trans_speed
+            self.pos = min(self.pos, L[f])
+        #         if self.pos == self.cell.L:
+        if self.pos >= L[f]:
+            if not self.built:
+                L[f] += self.build_size
+                self.built = True
+                self.cell.tubulin_in_IFT -= self.build_size
+                # print(self.cell.tubulin_in_IFT)
+
+            self.isbound = False
 
 
 
@@ -0,0 +1,214 @@
+from __future__ import division, print_function
+import numpy as np
+import matplotlib.pyplot as plt
+
+from ift_diffusion_model_nlh import BASE, IFT, DIFFUSION, L_predict, RandomStream
+
+
+'''
+Runs many independent single-flagellum cells at once. It simulates the same model as Cell in ift_diffusion_model_nlh.py, but motor positions and
+states are 2-D arrays (cell x motor) and lengths are 1-D arrays (one per cell), so one Python-level time step moves every motor of every cell.
+This makes hundreds or thousands of replicates about as expensive as a handful of Cell runs.
+
+Each cell can have its own D, v, N, thresh, build_size, decay_size and starting L. Cells with fewer motors than the largest N are padded with
+motors that never leave the base and are never counted.
+
+Motors that reach the tip in the same time step build one at a time in motor order, as in Cell, so each one only arrives if it is past the length
+the ones before it built. The ensemble draws its random numbers in a different order, so it agrees with Cell statistically, not number for number.
+'''
+
+ABSENT = -1 #state code for the padding motors of cells with fewer than the largest N motors
+
+
+class Ensemble:
+
+    def __init__(self, t=3000, L=0, N=200, v=2, thresh=30, build_size=.00125, decay_size=.01, D=1.75,
+                 avalanche_on=True, L_hog=0, t_step=.1, replicates=1, seed=None):
+
+        '''
+        t: simulation time (seconds). Shared by all cells
+        t_step: Units of seconds. Shared by all cells
+        L, N, v, thresh, build_size, decay_size, D, L_hog: same meaning as in Cell. Each can be a number (same for every cell) or a list/array with
+                one value per cell. All lists must be the same length.
+        avalanche_on: if True, enable avalanching (default true)
+        replicates: number of independent cells to simulate for each parameter set. Cells for the same parameter set are next to each other,
+                so with 3 parameter sets and replicates=100, cells 0-99 are the first set.
+        seed: seed of the ensemble's random numbers (self.random, see RandomStream in ift_diffusion_model_nlh.py). The same seed gives the same
+                run, so ensembles can run in parallel workers with seeds spawned from one master seed, as in ift_sweep.py.
+        '''
+
+        params = dict(L=L, N=N, v=v, thresh=thresh, build_size=build_size, decay_size=decay_size, D=D, L_hog=L_hog)
+        sizes = set(np.size(p) for p in params.values() if np.ndim(p) > 0)
+        if len(sizes) > 1:
+            raise ValueError('parameter lists must all be the same length, got lengths %s' % sorted(sizes))
+        num_sets = sizes.pop() if sizes else 1
+        self.num_cells = num_sets*replicates
+        self.replicates = replicates
+
+        #one value per cell for each parameter
+        self.params = {k: np.repeat(np.broadcast_to(np.asarray(p, dtype=float), num_sets), replicates) for k, p in params.items()}
+        self.params['N'] = self.params['N'].astype(int)
+        self.params['thresh'] = self.params['thresh'].astype(int)
+
+        self.random = RandomStream(seed)
+        self.t = t
+        self.t_step = t_step
+        self.num_of_timesteps = int(self.t/self.t_step)
+        self.time = np.linspace(0,self.t, self.num_of_timesteps)
+        self.avalanche_on = avalanche_on
+        self.current_time = 0
+
+        self.L = self.params['L'].copy()
+        self.N = self.params['N']
+        self.v = self.params['v']
+        self.D = self.params['D']
+        self.thresh = self.params['thresh']
+        self.build_size = self.params['build_size']
+        self.decay_sizeMS = self.params['decay_size'] #m/s
+        self.decay_size = t_step*self.params['decay_size'] #meters in one time step
+        self.rms_disp = (2*self.D*self.t_step)**.5 #um
+        self.L_hog = self.params['L_hog']
+
+        #motor arrays, one row per cell
+        max_N = self.N.max() if self.num_cells else 0
+        self.pos = np.zeros((self.num_cells, max_N))
+        self.state = np.full((self.num_cells, max_N), BASE, dtype=np.int8)
+        self.state[np.arange(max_N) >= self.N[:,None]] = ABSENT
+
+        #histories. Stored time-major so each time step writes one contiguous row. L_trace, flux, base and avaT are transposed views: row k is cell k.
+        self._L_trace = np.zeros((self.num_of_timesteps, self.num_cells))
+        self._flux = np.zeros((self.num_of_timesteps, self.num_cells))
+        self._base = np.zeros((self.num_of_timesteps, self.num_cells))
+        self._avaT = np.zeros((self.num_of_timesteps, self.num_cells), dtype=int)
+
+        self.L_predict = L_predict(self.D, self.v, self.N, self.thresh, self.build_size, self.decay_sizeMS)
+
+        if t:
+            self.sim(self.num_of_timesteps)
+            self.time2ss = np.argmax(self.L_trace > self.L[:,None], axis=1)*self.t_step #per cell, see Cell.time2ss
+
+    @property
+    def L_trace(self):
+        return self._L_trace.T
+
+    @property
+    def flux(self):
+        return self._flux.T
+
+    @property
+    def base(self):
+        return self._base.T
+
+    @property
+    def avaT(self):
+        return self._avaT.T
+
+    def sim(self,t,start=0):
+        #Work on flat views of the motor arrays and only touch the motors that move, so the cost per step follows the number of moving motors
+        pos, state = self.pos.ravel(), self.state.ravel()
+        max_N = self.pos.shape[1]
+        dv = self.t_step*self.v #distance an IFT motor moves in one time step
+
+        for i in range(start,t):
+            self.current_time=i
+
+            if i==np.floor(t/2):
+                hog = self.L_hog != 0
+                self.L[hog] *= self.L_hog[hog]
+
+            if self.avalanche_on:
+                self._avaT[i] = self.avalanche()
+
+            self.L = np.where(self.L >= self.decay_size, self.L - self.decay_size, 0)
+            self._L_trace[i] = self.L
+            L = self.L
+
+            diffusing = (state == DIFFUSION).nonzero()[0] #flat indices of motors that diffuse this step
+            d_cell = diffusing // max_N
+
+            #IFT: move forward, and every motor that gets to the tip builds and starts diffusing
+            ift = (state == IFT).nonzero()[0]
+            ift_cell = ift // max_N
+            x = pos[ift]
+            x = x + dv[ift_cell] #a motor left past the tip by the arrivals before it goes on too, as in Cell
+            pos[ift] = x
+            arrive = x >= L[ift_cell]
+            L_seen = L[d_cell]
+            if arrive.any():
+                arrive[arrive] = self._arrivals(ift_cell[arrive], x[arrive] - L[ift_cell[arrive]])
+            if arrive.any():
+                #motors build one after another in motor order: number each arrival within its cell
+                arrived, a_cell = ift[arrive], ift_cell[arrive]
+                num_before = np.arange(len(arrived)) - np.searchsorted(a_cell, a_cell) #arrivals earlier in the same cell
+                pos[arrived] = L[a_cell] + self.build_size[a_cell]*(num_before + 1)
+                state[arrived] = DIFFUSION
+                self.L = L + self.build_size*np.bincount(a_cell, minlength=self.num_cells)
+                #each diffusing motor sees the length built by the arrivals before it in its cell's motor list. Only cells with arrivals need this.
+                near = np.bincount(a_cell, minlength=self.num_cells)[d_cell] > 0
+                L_seen[near] += self.build_size[d_cell[near]]*(np.searchsorted(arrived, diffusing[near]) - np.searchsorted(a_cell, d_cell[near]))
+
+            #Diffusion
+            x = np.minimum(pos[diffusing], L_seen)
+            rms = self.rms_disp[d_cell]
+            at_tip = x == L_seen
+            step = np.where(self.random.rand(len(diffusing)) < .5, -rms, rms)
+            x = np.where(at_tip, x - rms, np.minimum(np.maximum(x + step, 0), L_seen))
+            pos[diffusing] = x
+            state[diffusing[x <= 0]] = BASE
+
+            still_ift = ~arrive
+            self._flux[i] = np.bincount(ift_cell[still_ift & (pos[ift] < 1)], minlength=self.num_cells)
+            self._base[i] = self.N - np.count_nonzero(self.state == BASE, axis=1)
+
+    #Which of the IFT motors that got to the tip this step arrive, as in Cell: going through them in motor order, each one builds, so the next
+    #one only arrives if it is past the length after those builds. cells are their cells, in order, and past how far past the length at
+    #the start of the step they are. Usually they all arrive, otherwise the cells where one doesn't are gone through a motor at a time, the
+    #k-th motor of every such cell at once.
+    def _arrivals(self, cells, past):
+        most_builds = np.floor(past/self.build_size[cells])
+        rank = np.arange(len(cells)) - np.searchsorted(cells, cells) #motors before it in its cell
+        arrives = most_builds >= rank
+        if not arrives.all():
+            redo = np.isin(cells, cells[~arrives]).nonzero()[0]
+            count = np.zeros(self.num_cells, dtype=int) #arrivals so far in each cell
+            for k in range(rank[redo].max() + 1):
+                j = redo[rank[redo] == k]
+                arrives[j] = most_builds[j] >= count[cells[j]]
+                count[cells[j]] += arrives[j]
+        return arrives
+
+    #Avalanche in every cell whose base holds more than thresh motors. Returns the number of motors released in each cell.
+    def avalanche(self):
+        num_base = self.N - np.count_nonzero(self.state > BASE, axis=1)
+        ava = (num_base > self.thresh).nonzero()[0] #cells that avalanche this step
+        distr = ((num_base[ava]-self.thresh[ava]+10) * self.random.weibull(1, len(ava)) + 1).astype(int)
+        release = np.zeros(self.num_cells, dtype=int)
+        release[ava] = np.minimum(distr, num_base[ava])
+        in_base = self.state[ava] == BASE
+        first = in_base & (np.cumsum(in_base, axis=1) <= release[ava,None]) #the first release motors in the base, in motor order
+        self.state[ava] = np.where(first, IFT, self.state[ava])
+        return release
+
+    #Final length of each parameter set, shape (parameter sets, replicates)
+    def L_by_set(self):
+        return self.L.reshape(-1, self.replicates)
+
+    #Plot length over time for every cell
+    def L_plot(self):
+        plt.plot(self.time, self.L_trace.T);
+        plt.xlabel('time (s)');
+        plt.ylabel('flagellar length (um)');
+        plt.title('Flagellar growth');
+        plt.show()
+
+    def __len__(self):
+        return self.num_cells
+
+    def __repr__(self):
+        string = 'Ensemble of %d cells, mean length %s microns' % (self.num_cells, self.L.mean() if self.num_cells else 0)
+        return string
+
+
+if __name__ == '__main__':
+    a=Ensemble(D=[1,2,10], replicates=100)
+    print(a.L_by_set().mean(axis=1))
@@ -0,0 +1,190 @@
+from __future__ import division, print_function
+import inspect
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from ift_diffusion_model_nlh import Cell, L_predict
+
+
+'''
+Fits parameters of the single-flagellum Cell (ift_diffusion_model_nlh.py) to measured flagellar lengths by sequential Monte Carlo ABC
+(approximate Bayesian computation): a population of parameter sets (particles) is drawn from the prior, simulated, and the ones whose
+simulated length distribution is closest to the data are kept. Each following generation perturbs the kept particles and only accepts
+simulations closer than a tolerance that shrinks from one generation to the next. The final population is a sample of the posterior.
+
+The distance between a simulation and the data is the mean difference of their quantiles (5% to 95%), relative to the mean measured length.
+The data are lengths of many cells, so each candidate is simulated as several independent cells (cells), and their length traces after
+settling are pooled. One cell's length over a long enough time samples the same steady-state distribution as many cells at one time, but
+its length is correlated over hundreds of seconds, so a single cell's window of a few thousand seconds covers much less than the spread
+between cells. Independent cells make up for that. Measured cells also differ in their parameters, which the model doesn't, so part of
+that spread ends up in the posterior's width.
+
+settle has to cover the growth phase and the relaxation to the cell's own steady state, which is slow: from L=0 the default cell's length
+is within 1% of its steady state only after about 1400 s, and at D=.5 after about 2800 s. Lengths measured before that make every distance
+wrong.
+
+Simulations are expensive, so three things cut the ones that can't be accepted:
+    - L_predict: a candidate whose predicted length is further than predict_tol (relative) from the mean measured length is never simulated
+    - hybrid=True (default): each run skips the growth phase and starts where the mean-field model gets close to steady state, see Cell.
+      The mean-field model only gets to about L_predict, a few percent short of the cell's own steady state, so the motors still need part
+      of settle to relax: the length is within 1% after about 400 s with the default cell, but only after about 2000 s at D=.5, which the
+      default settle covers.
+    - early rejection: each run goes chunk by chunk (Cell.run_iter) and stops as soon as the lengths so far are further than reject times
+      the tolerance from the data. The first generation has no tolerance yet and runs in full.
+Candidates are simulated in parallel by a pool of worker processes, in batches, and accepted in the order they were drawn, so the same seed
+gives the same posterior with any number of workers.
+
+Example:
+    posterior = abc_smc(measured_lengths, dict(D=(.5, 5), thresh=(10, 60)), seed=0)
+    print(posterior['names'], posterior['samples'].mean(axis=0))
+'''
+
+INTEGERS = ('N', 'thresh') #parameters that only take whole numbers
+QUANTILES = np.linspace(.05, .95, 19) #quantiles compared by the distance
+
+
+#Distance between simulated lengths and the quantiles of the measured ones (data_q, at QUANTILES), relative to the mean measured length
+def distance(lengths, data_q, data_mean):
+    return np.mean(np.abs(np.quantile(lengths, QUANTILES) - data_q))/data_mean
+
+
+#Simulate one candidate as cells independent cells and return the distance of their pooled lengths from the data. This is what each worker
+#process runs. settle and measure are numbers of time steps, chunk divides settle. The cells run side by side, one chunk each at a time.
+#With epsilon, stop once the distance of the lengths so far is over reject*epsilon, after at least two chunks of them.
+def run_particle(params, seed, data_q, data_mean, settle, measure, chunk, epsilon=None, reject=2., cells=1):
+    entropy, spawn_key = seed
+    seeds = np.random.SeedSequence(entropy, spawn_key=spawn_key).spawn(cells)
+    lengths = []
+    runs = [Cell(t=0, seed=s, **params) for s in seeds]
+    try:
+        for snaps in zip(*[cell.run_iter(steps=settle+measure, chunk=chunk) for cell in runs]):
+            step = snaps[0]['step']
+            if step < settle:
+                continue
+            lengths.extend(snap['lengths'] for snap in snaps)
+            if epsilon is not None and len(lengths) >= 2*cells and step < settle+measure-1:
+                d = distance(np.concatenate(lengths), data_q, data_mean)
+                if d > reject*epsilon:
+                    return dict(distance=d, steps=cells*(step+1), early=True)
+        return dict(distance=distance(np.concatenate(lengths), data_q, data_mean), steps=cells*(settle+measure), early=False)
+    finally:
+        for cell in runs:
+            cell.release()
+
+def abc_smc(data, priors, fixed=None, particles=200, generations=5, quantile=.5, settle=2500, measure=1000, chunk=200, cells=10, reject=2.,
+            predict_tol=.5, seed=None, workers=None, batch=64, max_draws=10000, verbose=False):
+    '''
+    Posterior samples of the parameters in priors given measured lengths.
+
+    data: measured flagellar lengths (microns)
+    priors: dictionary of parameter name: (low, high), a uniform prior for each Cell argument to fit, e.g. dict(D=(.5, 5), v=(1, 4))
+    fixed: other Cell arguments, the same for every simulation. hybrid is True unless given.
+    particles: size of the population kept in each generation
+    generations: number of generations, including the first one from the prior
+    quantile: each generation's tolerance is this quantile of the distances the generation before accepted
+    settle, measure, chunk: seconds of simulation skipped before the lengths are kept, seconds kept, and seconds per chunk for early rejection.
+            settle is rounded up to whole chunks, and has to reach steady state, see the top of this file.
+    cells: number of independent cells simulated for each candidate, their lengths pooled
+    reject: a run stops early once its distance so far is over reject times the tolerance
+    predict_tol: candidates whose L_predict is further than this from the mean measured length, relative to it, are not simulated. None
+            turns the pre-filter off.
+    seed: master seed for the candidates and every simulation
+    workers: number of worker processes. Default is the number of cores.
+    batch: number of candidates drawn and simulated at a time. The results depend on it but not on workers, so keep it at least workers.
+    max_draws: ValueError after this many draws in a row without a candidate, e.g. when no parameters in the priors pass predict_tol
+    verbose: print a line per generation
+
+    Returns a dictionary with:
+        names: the fitted parameters, in the order of the columns of samples
+        samples: the final population, shape (particles, number of parameters)
+        weights: importance weight of each sample, summing to 1
+        history: one dictionary per generation with epsilon (its tolerance, None for the first), simulations (runs started), early
+                (runs stopped early), prefiltered (candidates never simulated), steps (time steps simulated, over all cells) and acceptance (accepted per run)
+    '''
+
+    data = np.asarray(data, dtype=float)
+    data_q, data_mean = np.quantile(data, QUANTILES), data.mean()
+    names = list(priors)
+    low = np.array([priors[k][0] for k in names], dtype=float)
+    high = np.array([priors[k][1] for k in names], dtype=float)
+    fixed = dict(dict(hybrid=True), **(fixed or {}))
+    defaults = {k: p.default for k, p in inspect.signature(Cell).parameters.items()}
+    t_step = fixed.get('t_step', defaults['t_step'])
+    chunk = max(int(round(chunk/t_step)), 1)
+    settle, measure = -(-int(round(settle/t_step))//chunk)*chunk, int(round(measure/t_step))
+
+    rng = np.random.default_rng(seed)
+    seeds = np.random.SeedSequence(seed).spawn(1)[0] #simulation seeds are spawned from this one, one per candidate, in the order drawn
+    executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count())
+    history = []
+    samples = weights = epsilon = cov = None
+    try:
+        for generation in range(generations):
+            record = dict(epsilon=epsilon, simulations=0, early=0, prefiltered=0, steps=0)
+            accepted, distances = [], []
+            while len(accepted) < particles:
+                #draw candidates that pass the pre-filter, one batch at a time
+                candidates, misses = [], 0
+                while len(candidates) < batch:
+                    if misses >= max_draws:
+                        raise ValueError('%d draws in a row without a candidate: the priors have next to no parameters within predict_tol=%s of the '
+                                         'data (or inside the priors, after generation 0)' % (max_draws, predict_tol))
+                    misses += 1
+                    if samples is None:
+                        theta = rng.uniform(low, high)
+                    else:
+                        theta = rng.multivariate_normal(samples[rng.choice(len(samples), p=weights)], cov)
+                        if ((theta < low) | (theta > high)).any():
+                            continue
+                    theta = np.array([round(x) if k in INTEGERS else x for k, x in zip(names, theta)])
+                    params = dict(fixed, **{k: x.item() if k not in INTEGERS else int(x) for k, x in zip(names, theta)})
+                    if predict_tol is not None:
+                        p = dict(defaults, **params)
+                        L = L_predict(p['D'], p['v'], p['N'], p['thresh'], p['build_size'], p['decay_size'])
+                        if not abs(L - data_mean) <= predict_tol*data_mean: #also catches nan, when N <= thresh
+                            record['prefiltered'] += 1
+                            continue
+                    candidates.append((theta, params))
+                    misses = 0
+                futures = []
+                for theta, params in candidates:
+                    s = seeds.spawn(1)[0]
+                    futures.append(executor.submit(run_particle, params, (s.entropy, s.spawn_key), data_q, data_mean, settle, measure, chunk,
+                                                   epsilon, reject, cells))
+                for (theta, params), f in zip(candidates, futures):
+                    result = f.result()
+                    record['simulations'] += 1
+                    record['early'] += result['early']
+                    record['steps'] += result['steps']
+                    if len(accepted) < particles and (epsilon is None or result['distance'] <= epsilon):
+                        accepted.append(theta)
+                        distances.append(result['distance'])
+
+            accepted = np.array(accepted)
+            if samples is None:
+                new_weights = np.ones(len(accepted))
+            else: #uniform prior over the kernel density the candidates were drawn from
+                inv = np.linalg.inv(cov)
+                diff = accepted[:,None,:] - samples[None,:,:]
+                kernel = np.exp(-.5*np.einsum('ijk,kl,ijl->ij', diff, inv, diff))
+                new_weights = 1/kernel.dot(weights)
+            samples, weights = accepted, new_weights/new_weights.sum()
+            epsilon = np.quantile(distances, quantile)
+            cov = 2*np.atleast_2d(np.cov(samples, rowvar=False, aweights=weights)) + np.diag((1e-6*(high - low))**2)
+            record['acceptance'] = particles/record['simulations']
+            history.append(record)
+            if verbose:
+                print('generation %d: epsilon %s, %d simulations (%d stopped early, %d prefiltered), acceptance %.2f' % (
+                    generation, 'none' if record['epsilon'] is None else '%.4f' % record['epsilon'], record['simulations'], record['early'],
+                    record['prefiltered'], record['acceptance']))
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+    return dict(names=names, samples=samples, weights=weights, history=history)
+
+
+if __name__ == '__main__':
+    data = [Cell(t=2500, D=2.5, seed=k).L for k in range(100)] #stand-in for measured lengths, one per cell
+    posterior = abc_smc(data, dict(D=(.5, 5)), particles=50, generations=3, seed=0, verbose=True)
+    print(dict(zip(posterior['names'], posterior['weights'].dot(posterior['samples']).tolist())))
@@ -0,0 +1,167 @@
+from __future__ import division, print_function
+import inspect
+import os
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+from ift_diffusion_model_nlh import Cell, L_predict
+from ift_sweep import sweep
+
+
+'''
+How the steady-state length of the single-flagellum Cell (ift_diffusion_model_nlh.py) responds to its parameters, by finite differences
+with common random numbers.
+
+Differencing independent runs needs huge numbers of replicates, because the noise of each run swamps the small change in length. Here every
+replicate first runs one cell to steady state, then forks it (Cell.fork) into a cell with the parameter a little lower and one with it a
+little higher. Both forks start from the same motors and length and get the same seed, so they use the same random numbers and much of
+their noise cancels in the difference. Each fork first relaxes to the length of its own parameters, then its lengths are averaged. The
+derivative of the replicate is (L_plus - L_minus)/(2*step), and the estimate is the mean over the replicates with a confidence interval
+from their spread.
+
+Each result also has vrf, the variance reduction factor: the variance the difference would have with independent runs, var(L_plus) +
+var(L_minus) over the replicates, over the variance it has here. The same precision takes vrf times fewer replicates. Every time step of a Cell draws
+the same amount of random numbers, one per motor (Cell._draw_step), so the forks stay on the same numbers even where their motors differ.
+They still drift apart as avalanches release different motors over relax: with the default cell and defaults, 20 replicates measured vrf of
+about 9 for D, 7.5 for v, 4 for thresh and 1.5 for build_size and decay_size. Over short relax the forks stay closer and vrf is 10 to 40.
+Besides that, the forks save time: one warm-up serves all ten forks of a replicate, and a fork starts at steady state, while a run from
+L=0 can take several thousand seconds to settle at the length of slightly changed parameters.
+
+With diffusion='walk' the length sticks just above whole multiples of rms_disp, so it moves with decay_size (and the others but D) in
+slow jumps between those levels, and relax must be long enough for them. independent() gives the same derivatives from independent runs
+started at L=0, to check the forks against: with the default cell, 20 replicates of each give dL/dD 2.18 in both, and dL/d(decay_size)
+-66 +- 5 from the forks against -57 +- 5 from runs of 12000 s (runs of 3000 s haven't settled and give -280). The results also have the
+derivative of L_predict, for comparison with the differential-equation prediction.
+
+Example:
+    for row in sensitivity(replicates=20, seed=0):
+        print_sensitivity(row)
+    for row in independent(names=('D',), replicates=20, seed=0):
+        print_sensitivity(row)
+'''
+
+INTEGERS = ('thresh',) #parameters that only take whole numbers, stepped by at least 1
+PREDICT_ARGS = ('D', 'v', 'N', 'thresh', 'build_size', 'decay_size') #arguments of L_predict, in order
+
+
+#One replicate: run a cell with params to steady state (settle time steps), then for every parameter in steps, fork it once with the parameter
+#at value - step and once at value + step, both with the same seed. Each fork runs relax time steps to settle at the length of its
+#parameters, then measure more that are averaged. Returns {name: (L_minus, L_plus)}. This is what each worker process runs.
+def run_replicate(params, steps, seed, settle, relax, measure, chunk=1000):
+    entropy, spawn_key = seed
+    warm_seed, fork_seed = np.random.SeedSequence(entropy, spawn_key=spawn_key).spawn(2)
+    lengths = {}
+    with Cell(**dict(params, t=settle*params.get('t_step', .1), seed=warm_seed)) as cell:
+        for name, (value, step) in steps.items():
+            pair = []
+            for x in (value - step, value + step):
+                fork = cell.fork(seed=fork_seed, **{name: x})
+                for snap in fork.run_iter(steps=relax, chunk=chunk):
+                    pass
+                total = count = 0
+                for snap in fork.run_iter(steps=measure, chunk=chunk):
+                    total, count = total + snap['lengths'].sum(), count + len(snap['lengths'])
+                pair.append(total/count)
+            lengths[name] = tuple(pair)
+    return lengths
+
+
+def sensitivity(params=None, names=('D', 'v', 'thresh', 'build_size', 'decay_size'), rel_step=.05, replicates=20, settle=3000, relax=2000,
+                measure=1000, seed=None, workers=None, confidence=1.96):
+    '''
+    Derivatives of the steady-state length with respect to each parameter in names, with confidence intervals.
+
+    params: keyword dictionary for Cell, the point the derivatives are taken at. Default is the default Cell.
+    names: parameters to differentiate by. Not N: a fork keeps the motors of its cell.
+    rel_step: the finite-difference step, relative to each parameter's value (at least 1 for whole-number parameters)
+    replicates: number of replicates. Each one is a warm-up run and two forks per parameter.
+    settle: seconds of the warm-up run, long enough to reach steady state
+    relax: seconds each fork runs before its lengths are kept, to settle at the length of its parameters, see the top of this file
+    measure: seconds of each fork's lengths that are averaged
+    seed: master seed. Replicate k gets the k-th seed spawned from it.
+    workers: number of worker processes. Default is the number of cores.
+    confidence: half-width of the confidence intervals in standard errors (1.96 for 95%)
+
+    Returns one dictionary per parameter with:
+        name, value, step: the parameter, its value and the finite-difference step
+        dL: mean derivative dL/d(parameter) (microns per unit of the parameter), and ci: (low, high) confidence interval of it
+        elasticity: relative sensitivity (dL/L)/(dparameter/parameter)
+        vrf: variance reduction factor over independent runs, see the top of this file
+        predicted: derivative of L_predict at the same point, nan for parameters L_predict doesn't take
+    '''
+
+    params = dict(params or {})
+    point, steps = _steps(params, names, rel_step)
+    t_step = point['t_step']
+    settle, relax, measure = int(round(settle/t_step)), int(round(relax/t_step)), int(round(measure/t_step))
+    seeds = np.random.SeedSequence(seed).spawn(replicates)
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = [executor.submit(run_replicate, params, steps, (s.entropy, s.spawn_key), settle, relax, measure) for s in seeds]
+        results = [f.result() for f in futures]
+
+    rows = []
+    for name in names:
+        pairs = np.array([r[name] for r in results]) #replicates x (minus, plus)
+        var_paired = np.var(pairs[:,1] - pairs[:,0], ddof=1) if replicates > 1 else np.nan
+        var_independent = pairs[:,0].var(ddof=1) + pairs[:,1].var(ddof=1) if replicates > 1 else np.nan
+        rows.append(_row(name, point, steps[name], pairs, confidence, var_independent/var_paired if var_paired > 0 else np.inf))
+    return rows
+
+
+def independent(params=None, names=('D', 'v', 'thresh', 'build_size', 'decay_size'), rel_step=.05, replicates=20, t=12000, measure=1000,
+                seed=None, workers=None, confidence=1.96):
+    '''
+    The derivatives of sensitivity() from independent runs, to check it against: every replicate runs one cell from L=0 with each parameter
+    a little lower and one with it a little higher, for t seconds, and averages the lengths of the last measure seconds. Runs go through
+    ift_sweep.sweep. The arguments and results are as in sensitivity(), with vrf 1.
+    '''
+
+    params = dict(params or {})
+    point, steps = _steps(params, names, rel_step)
+    tasks = [dict(params, t=t, **{name: x}) for name in names for x in (steps[name][0] - steps[name][1], steps[name][0] + steps[name][1])
+             for _ in range(replicates)]
+    lengths = np.zeros(len(tasks))
+    for result in sweep(tasks, seed=seed, workers=workers, traces=True):
+        trace = result['L_trace']
+        lengths[result['index']] = np.mean(trace[-max(int(len(trace)*measure/t), 1):])
+    lengths = lengths.reshape(len(names), 2, replicates)
+    return [_row(name, point, steps[name], lengths[k].T, confidence, 1.) for k, name in enumerate(names)]
+
+
+#The point the derivatives are taken at (Cell's defaults updated with params) and {name: (value, finite-difference step)} for names
+def _steps(params, names, rel_step):
+    defaults = {k: p.default for k, p in inspect.signature(Cell).parameters.items()}
+    point = dict(defaults, **params)
+    steps = {}
+    for name in names:
+        value = point[name]
+        step = max(int(round(abs(value)*rel_step)), 1) if name in INTEGERS else abs(value)*rel_step
+        steps[name] = (value, step)
+    return point, steps
+
+#One result of sensitivity or independent from the (L_minus, L_plus) pairs of the replicates
+def _row(name, point, value_step, pairs, confidence, vrf):
+    value, step = value_step
+    replicates = len(pairs)
+    d = (pairs[:,1] - pairs[:,0])/(2*step)
+    se = d.std(ddof=1)/np.sqrt(replicates) if replicates > 1 else np.nan
+    predicted = np.nan #only for the arguments of L_predict
+    if name in PREDICT_ARGS:
+        minus, plus = [point[k] for k in PREDICT_ARGS], [point[k] for k in PREDICT_ARGS]
+        minus[PREDICT_ARGS.index(name)] -= step
+        plus[PREDICT_ARGS.index(name)] += step
+        predicted = (L_predict(*plus) - L_predict(*minus))/(2*step)
+    return dict(name=name, value=value, step=step, dL=d.mean(), ci=(d.mean() - confidence*se, d.mean() + confidence*se),
+                elasticity=d.mean()*value/pairs.mean(), vrf=vrf, predicted=predicted)
+
+
+#Print one row of sensitivity
+def print_sensitivity(row):
+    print('%-10s = %-8g dL = %10.4g [%10.4g, %10.4g], elasticity %6.3f, vrf %6.1f, L_predict gives %10.4g' % (
+        row['name'], row['value'], row['dL'], row['ci'][0], row['ci'][1], row['elasticity'], row['vrf'], row['predicted']))
+
+
+if __name__ == '__main__':
+    for row in sensitivity(replicates=10, seed=0):
+        print_sensitivity(row)
@@ -0,0 +1,224 @@
+from __future__ import division, print_function
+import itertools
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+
+'''
+Parameter sweeps over Cell (ift_diffusion_model_nlh.py) or the two-flagella Cell (ift_diffusion_model_two_flagella.py) spread across all cores.
+
+Each parameter set is one task. Tasks run in separate worker processes, and every task gets its own random seed spawned from one master seed,
+so a sweep gives the same numbers no matter how many workers run it or in what order the tasks finish. Workers send back a small dictionary
+of results (lengths, L_predict, time2ss and optionally the length traces), never the Cell itself, so the Motor objects never get pickled.
+Each cell's history is freed (Cell.release) as soon as its results are taken, so long-lived workers don't grow.
+
+adaptive_sweep runs replicates of each parameter set until the standard errors of the final length, time2ss and mean flux are below a
+tolerance, so parameter sets with narrow length distributions stop after a few replicates and wide ones get more.
+
+Example:
+    for result in sweep(grid(D=[1,2,10], N=[100,200]), seed=0):
+        print(result['params'], result['L'])
+    for result in adaptive_sweep(grid(D=[1,2,10]), tol=.005, seed=0):
+        print(result['params'], result['replicates'], result['precision'])
+'''
+
+MODELS = ('single', 'two')
+STATISTICS = ('L', 'time2ss', 'flux') #statistics adaptive_sweep can bring within a tolerance
+
+
+#All combinations of the given parameter lists, as a list of keyword dictionaries. grid(D=[1,2], v=[2,3]) gives 4 parameter sets.
+def grid(**lists):
+    keys = list(lists)
+    return [dict(zip(keys, values)) for values in itertools.product(*(lists[k] for k in keys))]
+
+
+def sweep(params, model='single', seed=None, workers=None, traces=False):
+    '''
+    Simulate every parameter set in params in a pool of worker processes. This is a generator: results come out as the tasks finish.
+
+    params: list of keyword dictionaries, one per simulation, e.g. [dict(D=1), dict(D=2)]. A dictionary of lists is expanded with grid().
+            Repeat a dictionary in the list to get replicates.
+    model: 'single' for the single-flagellum Cell, 'two' for the two-flagella Cell
+    seed: master seed. Task k always gets the k-th seed spawned from it, so the same seed gives the same results. None picks a random master seed.
+    workers: number of worker processes. Default is the number of cores.
+    traces: if True, also send back the length trace(s) of each simulation
+
+    Each result is a dictionary with:
+        index: position of the parameter set in params
+        params: the parameter set
+        seed: entropy and spawn key of the task's seed, enough to rerun just this task with run_task()
+        L: final length (single) or list of final lengths, one per flagellum (two)
+        L_predict, time2ss: as in Cell. time2ss is None for a model that doesn't compute it
+        flux: mean flux over the run (single), None for the two-flagella model, which doesn't record it
+        L_trace: only if traces=True. Length over time (single) or a list of one trace per flagellum (two)
+        nbytes: memory the cell held at the end of its run, see Cell.nbytes
+    '''
+
+    if model not in MODELS:
+        raise ValueError('model must be one of %s, not %r' % (MODELS, model))
+    if isinstance(params, dict):
+        params = grid(**params)
+    params = list(params)
+    seeds = np.random.SeedSequence(seed).spawn(len(params))
+
+    executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count())
+    try:
+        futures = [executor.submit(run_task, model, p, (s.entropy, s.spawn_key), traces) for p, s in zip(params, seeds)]
+        index = {f: k for k, f in enumerate(futures)}
+        for f in as_completed(futures):
+            result = f.result()
+            result['index'] = index[f]
+            yield result
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True) #if the caller stops early, don't run the tasks that haven't started
+
+
+def adaptive_sweep(params, model='single', tol=.01, statistics=STATISTICS, relative=True, min_replicates=5, max_replicates=200, budget=None,
+                   seed=None, workers=None):
+    '''
+    Simulate replicates of every parameter set in params until the standard error of every statistic is within tol, in a pool of worker
+    processes. This is a generator: each parameter set comes out once it is done.
+
+    Replicates run in rounds. A parameter set starts with min_replicates, and after each round gets as many more as its worst standard error
+    says it needs (at most twice what it has), until it is within tol or has max_replicates. Replicate r of parameter set k always gets the
+    same seed, so the same seed gives the same results with any number of workers.
+
+    params: list of keyword dictionaries, or a dictionary of lists (expanded with grid()), one per parameter set
+    model: 'single' or 'two', see sweep()
+    tol: largest standard error allowed, a number for every statistic or a dictionary of statistic: tolerance
+    statistics: statistics that must reach tol, from STATISTICS: 'L' (final length, the mean over flagella for model='two'), 'time2ss'
+            and 'flux' (mean flux over the run). Statistics the model doesn't compute are skipped.
+    relative: if True, tol is relative to the mean of each statistic, e.g. .01 is 1%
+    min_replicates: replicates every parameter set gets, at least 2
+    max_replicates: most replicates a parameter set gets
+    budget: most simulations in total. Once the next round would go over it, what is left first brings every parameter set up to 2
+            replicates, in order, then goes to the parameter sets furthest from tol. None means no limit but max_replicates.
+    seed, workers: as in sweep()
+
+    Each result is a dictionary with:
+        index, params: as in sweep()
+        replicates: number of simulations run
+        values: dictionary of statistic: array of its value in every replicate
+        mean, se: dictionaries of statistic: mean and standard error over the replicates
+        precision: dictionary of statistic: standard error, relative to the mean if relative
+        converged: True if every statistic reached tol, False if the parameter set ran out of replicates or budget first. A statistic with
+                fewer than 2 values never reached tol.
+    '''
+
+    if model not in MODELS:
+        raise ValueError('model must be one of %s, not %r' % (MODELS, model))
+    for name in statistics:
+        if name not in STATISTICS:
+            raise ValueError('statistics must be from %s, not %r' % (STATISTICS, name))
+    if isinstance(params, dict):
+        params = grid(**params)
+    params = list(params)
+    tols = tol if isinstance(tol, dict) else {name: tol for name in statistics}
+    min_replicates = max(min_replicates, 2)
+    point_seeds = np.random.SeedSequence(seed).spawn(len(params))
+    values = [{name: [] for name in statistics} for _ in params]
+    planned = {k: min(min_replicates, max_replicates) for k in range(len(params))} #replicates to run in the next round
+    used = 0
+
+    executor = ProcessPoolExecutor(max_workers=workers or os.cpu_count())
+    try:
+        while planned:
+            if budget is not None and used + sum(planned.values()) > budget: #share what is left: 2 replicates each, then furthest from tol first
+                left = max(budget - used, 0)
+                order = sorted(planned, key=lambda k: -_worst(values[k], tols, relative))
+                share = {}
+                for k in order:
+                    share[k] = min(planned[k], max(2 - len(values[k][statistics[0]]), 0), left)
+                    left -= share[k]
+                for k in order:
+                    more = min(planned[k] - share[k], left)
+                    share[k] += more
+                    left -= more
+                planned = share
+            futures = []
+            for k, n in planned.items():
+                done = len(values[k][statistics[0]])
+                for r in range(done, done + n):
+                    s = np.random.SeedSequence(point_seeds[k].entropy, spawn_key=point_seeds[k].spawn_key + (r,))
+                    futures.append((k, executor.submit(run_task, model, params[k], (s.entropy, s.spawn_key))))
+            for k, f in futures:
+                result = f.result()
+                for name in statistics:
+                    value = result[name]
+                    values[k][name].append(np.nan if value is None else np.mean(value))
+            used += len(futures)
+
+            for k in sorted(planned):
+                n = len(values[k][statistics[0]])
+                worst = _worst(values[k], tols, relative)
+                more = min(max(int(math.ceil(n*worst**2)) - n, 1) if worst < np.inf else n, n, max_replicates - n)
+                if worst <= 1 or more <= 0 or planned[k] == 0 or (budget is not None and used >= budget):
+                    del planned[k]
+                    yield _summary(k, params[k], values[k], tols, relative)
+                else:
+                    planned[k] = more
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+#Mean, standard error and precision (standard error, relative to the mean if relative) of one statistic's values, skipping nan. All nan
+#for fewer than 2 values, or a statistic the model doesn't compute.
+def _precision(values, relative):
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if len(values) < 2:
+        return np.nan, np.nan, np.nan
+    mean, se = values.mean(), values.std(ddof=1)/np.sqrt(len(values))
+    if not relative:
+        return mean, se, se
+    return mean, se, se/abs(mean) if mean else (0. if se == 0 else np.inf)
+
+#Largest precision/tolerance ratio over the statistics of one parameter set. At most 1 means done. A statistic with fewer than 2 values
+#is infinitely far, unless the model doesn't compute it: all nan over at least 2 replicates, which is skipped.
+def _worst(values, tols, relative):
+    ratios = []
+    for name, v in values.items():
+        if len(v) >= 2 and np.isnan(v).all():
+            continue
+        r = _precision(v, relative)[2]/tols[name]
+        ratios.append(np.inf if np.isnan(r) else r)
+    return max(ratios) if ratios else 0.
+
+#The result of adaptive_sweep for one parameter set
+def _summary(index, params, values, tols, relative):
+    result = dict(index=index, params=params, replicates=len(next(iter(values.values()))), values={}, mean={}, se={}, precision={})
+    for name, v in values.items():
+        result['values'][name] = np.array(v)
+        result['mean'][name], result['se'][name], result['precision'][name] = _precision(v, relative)
+    result['converged'] = _worst(values, tols, relative) <= 1
+    return result
+
+
+#Run one simulation and return its summary. This is what each worker process runs, but it also works on its own to rerun a single task.
+def run_task(model, params, seed, traces=False):
+    entropy, spawn_key = seed
+
+    if model == 'single':
+        from ift_diffusion_model_nlh import Cell
+    else:
+        from ift_diffusion_model_two_flagella import Cell
+    with Cell(seed=np.random.SeedSequence(entropy, spawn_key=spawn_key), **params) as cell:
+        result = dict(params=params, seed=seed, L_predict=cell.L_predict, time2ss=getattr(cell, 'time2ss', None), nbytes=cell.nbytes)
+        if model == 'single':
+            result['L'] = cell.L
+            result['flux'] = float(np.mean(cell.flux))
+            if traces:
+                result['L_trace'] = np.array(cell.L_trace) #a copy, not a view of the buffer release() frees
+        else:
+            result['L'] = cell.L.tolist()
+            result['flux'] = None
+            if traces:
+                result['L_trace'] = [np.array(trace) for trace in cell.L_trace.T]
+    return result
+
+
+if __name__ == '__main__':
+    for r in sweep(grid(D=[1,2,10]), seed=0, traces=False):
+        print(r['params'], r['L'], r['L_predict'])
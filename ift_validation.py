@@ -0,0 +1,175 @@
+from __future__ import division, print_function
+import numpy as np
+
+from ift_sweep import sweep, grid
+
+
+'''
+Checks that the faster ways of simulating the single-flagellum Cell (ift_diffusion_model_nlh.py) give the same lengths as the original one.
+
+compare_diffusion runs the same parameter sets with diffusion='walk' (the step-by-step random walk) and diffusion='first_passage' (one draw of
+the time back to the base per trip) and compares their steady-state lengths with each other and with L_predict. The walk moves in steps of
+rms_disp, so its trips take a whole number of steps down and its lengths stick just above whole multiples of rms_disp. first_passage scales
+its trips to the same number of steps, but doesn't follow everything the walk does at the tip, so the two don't agree to within the noise:
+at the default t_step, first_passage is about .1% long at D=1.75 and .5% long at D=10 (z of 3 to 7 with 10 replicates). Use it where that
+bias doesn't matter, and the walk where it does.
+
+compare_engines does the same for two engines, e.g. engine='lattice' (diffusing motors as counts on the walk's lattice) against the walk
+of the vector engine. The lattice's sites are fixed from the base, while a walking motor's steps count from where it last met the tip, which
+moves as the length does. That makes the lattice's steady-state lengths a little long: about .05% with the default cell, .3% with N=1000,
+and .5 to .6% with D=10 (N=200 or 1000), several standard errors with 10 replicates of t=6000.
+
+convergence runs the same cell at several time steps with each diffusion mode and compares every steady-state length with the walk at the
+smallest time step, to show how large t_step can get before the answer moves. diffusion='gaussian' takes Brownian steps, so its
+diffusion doesn't depend on t_step while the rms step sqrt(2*D*t_step) stays well below the length (see gaussian_step). What is left comes from the rest of the model working in whole steps (IFT, avalanches once a step).
+The walk's own error only shrinks about like rms_disp/L, so the walk needs t_step well below the default to be a good reference: with the
+default cell, the gaussian mode moves by about 1% between t_step .00625 and .8, while the walk moves by 15%.
+
+Example:
+    for row in compare_diffusion(grid(D=[1.75,10]), replicates=20):
+        print_comparison(row)
+    for row in compare_engines(grid(D=[1.75,10], t=[6000]), replicates=10):
+        print_comparison(row)
+    for row in convergence(t_steps=[.025,.1,.4]):
+        print_convergence(row)
+'''
+
+
+#Mean length over the last part of a length trace, after the flagellum has settled. settle is the fraction of the trace to skip.
+def steady_length(L_trace, settle=.5):
+    return np.mean(L_trace[int(len(L_trace)*settle):])
+
+
+def compare_diffusion(params=None, replicates=20, seed=0, workers=None, settle=.5, engine='event'):
+    '''
+    Run every parameter set with both diffusion modes and compare their steady-state lengths.
+
+    params: list of keyword dictionaries for Cell, or a dictionary of lists (expanded with grid()). Default is the default Cell.
+    replicates: number of simulations of each parameter set with each mode
+    seed: master seed for sweep()
+    workers: number of worker processes, see sweep()
+    settle: fraction of each length trace skipped before averaging, see steady_length()
+    engine: Cell engine used for both modes
+
+    Returns one dictionary per parameter set with:
+        params: the parameter set
+        L_predict: predicted steady-state length
+        walk, first_passage: (mean, standard error) of the steady-state length over the replicates
+        z: difference of the two means in units of its standard error. Within about +-2 means they agree.
+    '''
+
+    if params is None:
+        params = [{}]
+    if isinstance(params, dict):
+        params = grid(**params)
+    params = list(params)
+    modes = ('walk', 'first_passage')
+    tasks = [dict(p, diffusion=mode, engine=engine) for p in params for mode in modes for _ in range(replicates)]
+
+    lengths = np.zeros(len(tasks))
+    L_pred = np.zeros(len(tasks))
+    for result in sweep(tasks, seed=seed, workers=workers, traces=True):
+        lengths[result['index']] = steady_length(result['L_trace'], settle)
+        L_pred[result['index']] = result['L_predict']
+    lengths = lengths.reshape(len(params), len(modes), replicates)
+
+    rows = []
+    for k, p in enumerate(params):
+        row = dict(params=p, L_predict=L_pred[k*len(modes)*replicates])
+        for mode, L in zip(modes, lengths[k]):
+            row[mode] = (L.mean(), L.std(ddof=1)/np.sqrt(replicates) if replicates > 1 else np.nan)
+        row['z'] = (row['first_passage'][0] - row['walk'][0])/np.hypot(row['walk'][1], row['first_passage'][1])
+        rows.append(row)
+    return rows
+
+
+def compare_engines(params=None, engines=('vector', 'lattice'), replicates=20, seed=0, workers=None, settle=.5):
+    '''
+    Run every parameter set with two engines and compare their steady-state lengths, as compare_diffusion does for the diffusion modes.
+
+    engines: the two Cell engines. z is the second one's mean length minus the first one's.
+    The other arguments and the results are as in compare_diffusion, with the engines in place of walk and first_passage.
+    '''
+
+    if params is None:
+        params = [{}]
+    if isinstance(params, dict):
+        params = grid(**params)
+    params = list(params)
+    tasks = [dict(p, engine=engine) for p in params for engine in engines for _ in range(replicates)]
+
+    lengths = np.zeros(len(tasks))
+    L_pred = np.zeros(len(tasks))
+    for result in sweep(tasks, seed=seed, workers=workers, traces=True):
+        lengths[result['index']] = steady_length(result['L_trace'], settle)
+        L_pred[result['index']] = result['L_predict']
+    lengths = lengths.reshape(len(params), len(engines), replicates)
+
+    rows = []
+    for k, p in enumerate(params):
+        row = dict(params=p, L_predict=L_pred[k*len(engines)*replicates])
+        for engine, L in zip(engines, lengths[k]):
+            row[engine] = (L.mean(), L.std(ddof=1)/np.sqrt(replicates) if replicates > 1 else np.nan)
+        row['z'] = (row[engines[1]][0] - row[engines[0]][0])/np.hypot(row[engines[0]][1], row[engines[1]][1])
+        rows.append(row)
+    return rows
+
+
+#Print one row of compare_diffusion or compare_engines
+def print_comparison(row):
+    first, second = [k for k in row if k not in ('params', 'L_predict', 'z')]
+    print('%s: L_predict %.3f, %s %.3f +- %.3f, %s %.3f +- %.3f, z = %.2f' % (
+        row['params'], row['L_predict'], first, row[first][0], row[first][1], second, row[second][0], row[second][1], row['z']))
+
+
+def convergence(params=None, t_steps=(.025, .05, .1, .2, .4), modes=('walk', 'gaussian'), replicates=10, seed=0, workers=None, settle=.5,
+                engine='vector'):
+    '''
+    Run one parameter set at every time step in t_steps with every diffusion mode in modes, and compare the steady-state lengths.
+
+    params: keyword dictionary for Cell. Default is the default Cell. Its t is kept, so larger time steps take fewer steps.
+    t_steps: time steps to try (s). The smallest one with diffusion='walk' is the reference.
+    modes: diffusion modes to try
+    replicates, seed, workers, settle: as in compare_diffusion
+    engine: Cell engine used for every run
+
+    Returns one dictionary per mode and time step, in the order of modes then t_steps, with:
+        diffusion, t_step: the mode and time step
+        L: (mean, standard error) of the steady-state length over the replicates
+        error: relative difference from the reference length
+        z: difference from the reference in units of the standard error of the difference. Within about +-2 means they agree.
+    '''
+
+    params = dict(params or {})
+    t_steps = sorted(t_steps)
+    settings = [(mode, t_step) for mode in modes for t_step in t_steps]
+    if ('walk', t_steps[0]) not in settings:
+        settings.append(('walk', t_steps[0])) #the reference
+    tasks = [dict(params, diffusion=mode, t_step=t_step, engine=engine) for mode, t_step in settings for _ in range(replicates)]
+
+    lengths = np.zeros(len(tasks))
+    for result in sweep(tasks, seed=seed, workers=workers, traces=True):
+        lengths[result['index']] = steady_length(result['L_trace'], settle)
+    lengths = lengths.reshape(len(settings), replicates)
+    mean = lengths.mean(axis=1)
+    se = lengths.std(axis=1, ddof=1)/np.sqrt(replicates) if replicates > 1 else np.full(len(settings), np.nan)
+    ref = settings.index(('walk', t_steps[0]))
+
+    rows = []
+    for k, (mode, t_step) in enumerate(settings[:len(modes)*len(t_steps)]):
+        z = (mean[k] - mean[ref])/np.hypot(se[k], se[ref]) if k != ref else 0.
+        rows.append(dict(diffusion=mode, t_step=t_step, L=(mean[k], se[k]), error=mean[k]/mean[ref] - 1, z=z))
+    return rows
+
+
+#Print one row of convergence
+def print_convergence(row):
+    print('%-13s t_step %.3f: L %.3f +- %.3f, error %+.2f%%, z = %.2f' % (
+        row['diffusion'], row['t_step'], row['L'][0], row['L'][1], 100*row['error'], row['z']))
+
+
+if __name__ == '__main__':
+    for row in compare_diffusion(grid(D=[1.75,10], N=[200,1000]), replicates=10):
+        print_comparison(row)
+    for row in convergence():
+        print_convergence(row)
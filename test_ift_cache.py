@@ -0,0 +1,37 @@
+from __future__ import division, print_function
+import os
+import numpy as np
+import pytest
+
+from ift_cache import ResultCache
+from ift_diffusion_model_nlh import Cell
+
+
+def test_hit_and_miss(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    first = cache.run(t=20, D=2, seed=0)
+    again = cache.run(t=20, D=2, seed=0)
+    other = cache.run(t=20, D=2, seed=1)
+    assert not first['cached'] and again['cached'] and not other['cached']
+    assert again['L'] == first['L'] == Cell(t=20, D=2, seed=0).L
+    assert np.array_equal(again['L_trace'], first['L_trace']) and np.array_equal(again['avaT'], first['avaT'])
+    assert len(os.listdir(str(tmp_path))) == 2
+    assert cache.key(t=20, D=2, seed=0) == cache.key(t=20, D=2, seed=0, v=2) #defaults filled in
+
+
+#keep_every thins the stored length trace, and a different keep_every is a different result
+def test_keep_every(tmp_path):
+    cache = ResultCache(str(tmp_path))
+    full = cache.run(t=20, seed=0, keep_every=1)
+    thinned = cache.run(t=20, seed=0, keep_every=7)
+    assert not thinned['cached']
+    assert np.array_equal(thinned['L_trace'], full['L_trace'][::7])
+    assert thinned['L'] == full['L']
+
+
+@pytest.mark.parametrize('seed', [None, 1.5, True, np.random.SeedSequence(0)])
+def test_seed_must_be_int(seed, tmp_path):
+    cache = ResultCache(str(tmp_path))
+    with pytest.raises(ValueError, match='seed'):
+        cache.run(t=20, seed=seed)
+    assert os.listdir(str(tmp_path)) == []
@@ -0,0 +1,176 @@
+from __future__ import division, print_function
+import os
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+import numpy as np
+import pytest
+
+from ift_diffusion_model_nlh import Cell
+
+
+#The vector engine is the object engine's time step on arrays: the same seed gives the same run, number for number
+@pytest.mark.parametrize('diffusion', ['walk', 'first_passage', 'gaussian'])
+def test_vector_matches_object(diffusion):
+    vector = Cell(t=100, seed=1, diffusion=diffusion, engine='vector')
+    objects = Cell(t=100, seed=1, diffusion=diffusion, engine='object')
+    assert vector.L == objects.L
+    assert np.array_equal(vector.L_trace, objects.L_trace)
+    assert np.array_equal(vector.flux, objects.flux)
+    assert np.array_equal(vector.tracks, objects.tracks, equal_nan=True)
+    assert np.array_equal(vector.fp_left, objects.fp_left)
+    assert [p.state for p in vector.motors] == [p.state for p in objects.motors]
+    assert vector.avaT == objects.avaT
+
+
+#A cell loaded from a checkpoint goes on exactly as the saved one would have
+@pytest.mark.parametrize('params', [dict(engine='vector'), dict(engine='object'), dict(engine='event'), dict(engine='ode'),
+                                    dict(engine='lattice'), dict(engine='vector', diffusion='first_passage'),
+                                    dict(engine='event', diffusion='gaussian'), dict(engine='vector', ss=True, ss_window=20)])
+def test_checkpoint_resumes_exactly(params, tmp_path):
+    path = str(tmp_path/'cell.npz')
+    saved = Cell(t=50, seed=2, **params)
+    saved.save_checkpoint(path)
+    saved.extend(500)
+    loaded = Cell.load_checkpoint(path)
+    loaded.extend(500)
+    assert loaded.L == saved.L
+    assert loaded.current_time == saved.current_time
+    assert np.array_equal(loaded.L_trace, saved.L_trace)
+    assert np.array_equal(loaded.tracks, saved.tracks, equal_nan=True)
+    assert loaded.avaT == saved.avaT
+    assert [p.state for p in loaded.motors] == [p.state for p in saved.motors]
+
+
+#With no avalanches the flagellum shrinks to L = 0, where the lattice has no sites and every motor ends up in the base, as with the vector engine
+@pytest.mark.parametrize('params', [dict(avalanche_on=False), dict(thresh=300)])
+def test_lattice_runs_down_to_zero(params):
+    lattice = Cell(t=50, seed=0, engine='lattice', **params)
+    vector = Cell(t=50, seed=0, engine='vector', **params)
+    assert lattice.L == vector.L == 0
+    assert lattice.base[-1] == vector.base[-1] == 0
+    assert len(lattice.L_trace) == len(vector.L_trace)
+
+
+#A run cancelled while it waits in an executor never starts, and its handle still prints
+def test_future_cancelled_before_start():
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        first = Cell.submit(executor, t=100000, seed=0)
+        waiting = Cell.submit(executor, t=10, seed=0)
+        assert waiting.cancel()
+        assert 'cancelled' in repr(waiting)
+        first.cancel()
+        assert first.result().current_time < first.steps
+    assert waiting.done() and waiting.cancelled()
+    assert 'cancelled' in repr(waiting)
+    with pytest.raises(CancelledError):
+        waiting.result()
+
+
+#release() closes memory-mapped traces and deletes the folder the cell made for them
+def test_release_deletes_trace_files(tmp_path):
+    with Cell(t=20, seed=0, trace_dir=str(tmp_path)) as cell:
+        path = cell.trace_path
+        assert sorted(os.listdir(path)) == ['L_trace.dat', 'base.dat', 'flux.dat', 'tracks.dat']
+        L = cell.L
+    assert not os.path.exists(path)
+    assert os.listdir(str(tmp_path)) == []
+    assert cell.trace_path is None and cell.L == L and len(cell.L_trace) == 0
+
+
+#A hybrid run jumps over the growth phase without using up any time steps: the agents run every step, starting near L_predict
+@pytest.mark.parametrize('params', [dict(), dict(D=10), dict(N=1000)])
+def test_hybrid_runs_agents_from_the_start(params):
+    cell = Cell(t=100, seed=0, hybrid=True, stats=True, **params)
+    assert cell.stats.steps == cell.num_of_timesteps
+    assert len(cell.avaT) == cell.num_of_timesteps and sum(cell.avaT) > 0
+    assert abs(cell.L_trace[0]/cell.L_predict - 1) < .01
+    assert sum(p.state != 'base' for p in cell.motors) > 0
+    assert not cell._hybrid_pending
+
+
+#L_hog changes the length once, halfway through the whole run, however run_iter splits it into chunks
+def test_run_iter_l_hog_once():
+    whole = Cell(t=400, seed=1, L_hog=2.0)
+    chunked = Cell(t=0, seed=1, L_hog=2.0)
+    for snap in chunked.run_iter(steps=4000, chunk=777):
+        pass
+    assert chunked.L == whole.L
+    assert whole.L != Cell(t=400, seed=1).L
+
+
+#A released cell has no history to go on from
+def test_released_cell_can_not_go_on(tmp_path):
+    cell = Cell(t=20, seed=0)
+    cell.release()
+    with pytest.raises(RuntimeError, match='released'):
+        cell.extend(10)
+    with pytest.raises(RuntimeError, match='released'):
+        next(cell.run_iter(steps=10))
+    with pytest.raises(RuntimeError, match='released'):
+        cell.fork()
+    with pytest.raises(RuntimeError, match='released'):
+        cell.save_checkpoint(str(tmp_path/'cell.npz'))
+
+
+#The hook runs once at the end of every time step, and the stats count every step: each phase once (record only on the recorded steps),
+#every motor in some state, and no more time in the phases than in sim altogether
+@pytest.mark.parametrize('engine', ['vector', 'object', 'event', 'lattice'])
+@pytest.mark.parametrize('trace_every', [1, 4])
+def test_hook_and_stats(engine, trace_every):
+    steps = []
+    cell = Cell(t=20, seed=0, engine=engine, trace_every=trace_every, stats=True, hook=lambda cell, i: steps.append(i))
+    cell.extend(100)
+    assert steps == list(range(200)) + list(range(199, 299))
+    stats = cell.stats
+    assert stats.steps == 300
+    assert [stats.calls[phase] for phase in ('avalanche', 'decay', 'motors')] == [300]*3
+    assert stats.calls['record'] == sum(i % trace_every == 0 for i in steps)
+    assert stats.motor_steps.sum() == cell.N*stats.steps
+    assert 0 < sum(stats.seconds.values()) <= stats.wall
+
+
+#A fork starts from its cell's length and motors, and changing it or its parameters leaves the cell alone
+def test_fork():
+    cell = Cell(t=50, seed=0)
+    L, states, positions = cell.L, [p.state for p in cell.motors], [p.pos for p in cell.motors]
+    same = cell.fork(seed=1)
+    changed = cell.fork(seed=1, D=5)
+    for fork in (same, changed):
+        assert fork.L == L and fork.current_time == 0
+        assert [p.state for p in fork.motors] == states and [p.pos for p in fork.motors] == positions
+    assert changed.D == 5 and same.D == cell.D == 1.75
+    same.extend(200)
+    changed.extend(200)
+    assert same.L != changed.L
+    assert cell.L == L and [p.state for p in cell.motors] == states and [p.pos for p in cell.motors] == positions
+    again = cell.fork(seed=1) #the same seed from the same cell is the same run
+    again.extend(200)
+    assert again.L == same.L and np.array_equal(again.L_trace, same.L_trace)
+    with pytest.raises(ValueError):
+        cell.fork(N=100)
+
+
+#The histograms count every time step: avalanche sizes as in avaT, each state's motor count once, and every diffusing motor in some bin
+@pytest.mark.parametrize('engine', ['vector', 'object', 'event', 'lattice'])
+def test_histograms(engine):
+    cell = Cell(t=50, seed=0, engine=engine, histograms=10, stats=True)
+    hist = cell.histograms
+    assert hist.steps == cell.num_of_timesteps
+    assert np.array_equal(hist.avalanche, np.bincount(cell.avaT, minlength=cell.N+1))
+    assert np.array_equal(hist.occupancy.sum(axis=1), [hist.steps]*3)
+    assert hist.density.shape == (10,) and hist.density.sum() == cell.stats.mean_motors['diffusion']*hist.steps
+    assert np.isclose(hist.avalanche_distribution().sum(), 1)
+
+
+#A checkpoint keeps the stats and histograms so far, so the loaded cell goes on counting from there
+def test_checkpoint_keeps_histograms_and_stats(tmp_path):
+    path = str(tmp_path/'cell.npz')
+    saved = Cell(t=50, seed=2, histograms=True, stats=True)
+    saved.save_checkpoint(path)
+    saved.extend(500)
+    loaded = Cell.load_checkpoint(path)
+    loaded.extend(500)
+    for name in ('avalanche', 'density', 'occupancy'):
+        assert np.array_equal(getattr(loaded.histograms, name), getattr(saved.histograms, name))
+    assert loaded.histograms.steps == saved.histograms.steps == 1000
+    assert loaded.stats.steps == saved.stats.steps and loaded.stats.calls == saved.stats.calls
+    assert np.array_equal(loaded.stats.motor_steps, saved.stats.motor_steps)
@@ -0,0 +1,93 @@
+from __future__ import division, print_function
+import numpy as np
+import pytest
+
+from ift_diffusion_model_two_flagella import Cell
+
+
+#The vector engine updates the motors of every flagellum at once, with the same results as the object engine for the same seed
+@pytest.mark.parametrize('num_flagella', [2, 3])
+def test_vector_matches_object(num_flagella):
+    vector = Cell(t=2000, seed=1, num_flagella=num_flagella, track_motors=True, engine='vector')
+    objects = Cell(t=2000, seed=1, num_flagella=num_flagella, track_motors=True, engine='object')
+    assert np.array_equal(vector.L, objects.L)
+    assert np.array_equal(vector.L_trace, objects.L_trace)
+    assert np.array_equal(vector.tracks, objects.tracks)
+    assert np.array_equal(vector.activetracks, objects.activetracks)
+    assert np.array_equal(vector.boundtracks, objects.boundtracks)
+    assert vector.tubulin_in_IFT == objects.tubulin_in_IFT
+
+
+#A cell loaded from a checkpoint goes on exactly as the saved one would have
+@pytest.mark.parametrize('engine', ['vector', 'object'])
+def test_checkpoint_resumes_exactly(engine, tmp_path):
+    path = str(tmp_path/'cell.npz')
+    saved = Cell(t=1000, seed=2, engine=engine, track_motors=True)
+    saved.save_checkpoint(path)
+    saved.extend(1000)
+    loaded = Cell.load_checkpoint(path)
+    loaded.extend(1000)
+    assert np.array_equal(loaded.L, saved.L)
+    assert np.array_equal(loaded.L_trace, saved.L_trace)
+    assert np.array_equal(loaded.tracks, saved.tracks)
+    assert loaded.tubulin_in_IFT == saved.tubulin_in_IFT
+
+
+#ss=True stops at the first time step where every flagellum is steady, not at the end of a chunk of extend()
+def test_ss_stops_when_steady():
+    cell = Cell(t=2000, seed=0, ss=True, ss_window=200, ss_eps=5e-5)
+    assert all(test.steady for test in cell.steady)
+    assert len(cell.L_trace) == cell.current_time + 1
+    steps = cell.current_time
+    cell.extend(5000, until_steady=True) #already steady: stops after the one step extend() runs again
+    assert cell.current_time == steps
+    assert len(cell.L_trace) == steps + 1
+
+
+#run_iter snapshots have the avalanche size of every time step of their chunk, per flagellum, the same with either engine
+def test_run_iter_avalanches():
+    vector = list(Cell(t=0, seed=0).run_iter(steps=1000, chunk=300))
+    objects = list(Cell(t=0, seed=0, engine='object').run_iter(steps=1000, chunk=300))
+    assert [len(snap['avalanches']) for snap in vector] == [300, 300, 300, 100]
+    assert all(snap['avalanches'].shape[1] == 2 for snap in vector)
+    assert sum(snap['avalanches'].sum() for snap in vector) > 0
+    for a, b in zip(vector, objects):
+        assert np.array_equal(a['avalanches'], b['avalanches'])
+
+
+#L_hog changes the lengths once, halfway through the whole run, however run_iter splits it into chunks
+def test_run_iter_l_hog_once():
+    whole = Cell(t=2000, seed=1, L_hog=2.0)
+    chunked = Cell(t=0, seed=1, L_hog=2.0)
+    for snap in chunked.run_iter(steps=2000, chunk=777):
+        pass
+    assert np.array_equal(chunked.L, whole.L)
+    assert not np.array_equal(whole.L, Cell(t=2000, seed=1).L)
+
+
+#A released cell has no history to go on from
+@pytest.mark.parametrize('track_motors', [False, True])
+def test_released_cell_can_not_go_on(track_motors, tmp_path):
+    cell = Cell(t=200, seed=0, track_motors=track_motors)
+    cell.release()
+    with pytest.raises(RuntimeError, match='released'):
+        cell.extend(10)
+    with pytest.raises(RuntimeError, match='released'):
+        next(cell.run_iter(steps=10))
+    with pytest.raises(RuntimeError, match='released'):
+        cell.fork()
+    with pytest.raises(RuntimeError, match='released'):
+        cell.save_checkpoint(str(tmp_path/'cell.npz'))
+
+
+#A checkpoint keeps the histograms so far, so the loaded cell goes on counting from there
+def test_checkpoint_keeps_histograms(tmp_path):
+    path = str(tmp_path/'cell.npz')
+    saved = Cell(t=500, seed=2, histograms=True)
+    saved.save_checkpoint(path)
+    saved.extend(500)
+    loaded = Cell.load_checkpoint(path)
+    loaded.extend(500)
+    for name in ('avalanche', 'density', 'occupancy'):
+        assert np.array_equal(getattr(loaded.histograms, name), getattr(saved.histograms, name))
+    assert loaded.histograms.steps == saved.histograms.steps == 1000
@@ -0,0 +1,24 @@
+from __future__ import division, print_function
+import numpy as np
+
+from ift_diffusion_model_nlh import Cell
+from ift_ensemble import Ensemble
+
+
+def test_seed_reproducible():
+    first = Ensemble(t=20, D=[1, 5], replicates=3, seed=0)
+    second = Ensemble(t=20, D=[1, 5], replicates=3, seed=0)
+    assert np.array_equal(first.L_trace, second.L_trace)
+    assert np.array_equal(first.avaT, second.avaT)
+    assert first.L_trace.shape == (6, 200) and first.L_by_set().shape == (2, 3)
+
+
+#Each parameter set's lengths have the mean and spread of independent Cell runs with those parameters
+def test_matches_cells():
+    D = [1.75, 5]
+    ensemble = Ensemble(t=60, D=D, replicates=100, seed=0)
+    for d, lengths in zip(D, ensemble.L_by_set()):
+        cells = np.array([Cell(t=60, D=d, seed=k).L for k in range(30)])
+        se = np.hypot(lengths.std()/np.sqrt(len(lengths)), cells.std()/np.sqrt(len(cells)))
+        assert abs(lengths.mean() - cells.mean()) < 4*se
+        assert .6 < lengths.std()/cells.std() < 1.6
@@ -0,0 +1,32 @@
+from __future__ import division, print_function
+import numpy as np
+
+from ift_inference import abc_smc, distance, run_particle, QUANTILES
+
+
+def test_run_particle():
+    data = np.linspace(5, 7, 50)
+    data_q, data_mean = np.quantile(data, QUANTILES), data.mean()
+    full = run_particle(dict(hybrid=True), (0, ()), data_q, data_mean, settle=100, measure=100, chunk=50, cells=2)
+    assert full == run_particle(dict(hybrid=True), (0, ()), data_q, data_mean, settle=100, measure=100, chunk=50, cells=2)
+    assert not full['early'] and full['steps'] == 2*200 and full['distance'] > 0
+    #a tolerance far below the distance stops the run after the first two chunks of kept lengths
+    early = run_particle(dict(hybrid=True), (0, ()), data_q, data_mean, settle=100, measure=200, chunk=50, epsilon=full['distance']/10, cells=2)
+    assert early['early'] and early['steps'] == 2*200
+    assert distance(data, data_q, data_mean) == 0
+
+
+#A small seeded fit: one population per generation, normalized weights, and the same posterior with any number of workers
+def test_abc_smc_reproducible():
+    data = np.random.default_rng(0).normal(6, .3, 100)
+    args = dict(particles=4, generations=2, settle=20, measure=10, chunk=10, cells=2, batch=4, seed=0)
+    one = abc_smc(data, dict(D=(1, 3), thresh=(20, 40)), workers=1, **args)
+    two = abc_smc(data, dict(D=(1, 3), thresh=(20, 40)), workers=2, **args)
+    assert one['names'] == ['D', 'thresh']
+    assert one['samples'].shape == (4, 2) and one['weights'].shape == (4,)
+    assert np.isclose(one['weights'].sum(), 1) and (one['weights'] > 0).all()
+    assert ((one['samples'] >= [1, 20]) & (one['samples'] <= [3, 40])).all()
+    assert np.array_equal(one['samples'][:,1], np.round(one['samples'][:,1])) #thresh is a whole number
+    assert len(one['history']) == 2 and one['history'][0]['epsilon'] is None and one['history'][1]['epsilon'] > 0
+    assert np.array_equal(one['samples'], two['samples']) and np.array_equal(one['weights'], two['weights'])
+    assert [h['simulations'] for h in one['history']] == [h['simulations'] for h in two['history']]
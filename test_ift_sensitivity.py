@@ -0,0 +1,10 @@
+from __future__ import division, print_function
+
+from ift_sensitivity import sensitivity
+
+
+#The two forks of a replicate use the same random numbers every time step, so their difference is far less noisy than independent runs'
+def test_forks_reduce_variance():
+    rows = sensitivity(names=('D', 'v', 'decay_size'), replicates=8, settle=500, relax=0, measure=100, seed=0, workers=1)
+    assert [row['name'] for row in rows] == ['D', 'v', 'decay_size']
+    assert all(row['vrf'] > 5 for row in rows)
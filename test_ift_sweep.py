@@ -0,0 +1,39 @@
+from __future__ import division, print_function
+import numpy as np
+
+from ift_sweep import adaptive_sweep, grid, sweep
+
+
+def test_grid():
+    assert grid(D=[1,2], v=[2,3]) == [dict(D=1, v=2), dict(D=1, v=3), dict(D=2, v=2), dict(D=2, v=3)]
+
+
+def test_sweep_reproducible():
+    params = [dict(t=50, D=1), dict(t=50, D=5)]
+    first = {r['index']: r['L'] for r in sweep(params, seed=0, workers=1)}
+    second = {r['index']: r['L'] for r in sweep(params, seed=0, workers=2)}
+    assert first == second
+
+
+#A budget too small for the tolerance: every set gets at least 2 replicates, and none is reported converged
+def test_adaptive_sweep_budget():
+    results = sorted(adaptive_sweep([dict(t=50), dict(t=50, D=5)], tol=.001, seed=0, workers=1, budget=6), key=lambda r: r['index'])
+    assert len(results) == 2
+    assert sum(r['replicates'] for r in results) == 6
+    for r in results:
+        assert r['replicates'] >= 2
+        assert not r['converged']
+        assert np.isfinite(r['precision']['L'])
+
+
+def test_adaptive_sweep_too_few_replicates():
+    results = list(adaptive_sweep([dict(t=50), dict(t=50, D=5)], tol=.001, seed=0, workers=1, budget=3))
+    assert sum(r['replicates'] for r in results) == 3
+    assert not any(r['converged'] for r in results)
+
+
+def test_adaptive_sweep_converges():
+    result, = adaptive_sweep([dict(t=50)], tol=.5, statistics=('L',), seed=0, workers=1)
+    assert result['converged']
+    assert result['replicates'] == 5
+    assert result['precision']['L'] <= .5